@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+Run it with uvicorn, e.g.:
+    uvicorn aquaflux_backend.asgi:application --host 0.0.0.0 --port 8000
 """
 
 import os
@@ -12,5 +15,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aquaflux_backend.settings')
+# ASGI では、一覧・作成・詳細・ユーザー登録・ログインを非同期のビューで処理する (aquaflux_backend/asgi_urls.py)
+os.environ.setdefault('API_VIEW_MODE', 'async')
 
 application = get_asgi_application()
@@ -0,0 +1,19 @@
+# AQUAFLUX/backend/aquaflux_backend/asgi_urls.py
+# ASGI で動かす場合の URL 設定 (API_VIEW_MODE=async)
+# 飼育ログの一覧・作成・詳細と、ユーザー登録・ログインを非同期のビューに置き換える (先に書いたパターンが優先される)
+# それ以外は urls.py の同期のビューを使う (Django が sync_to_async で呼ぶ)
+# 変更の通知 (/api/logs/events/) は同期のビューのままだが、ASGI では非同期のジェネレーターで送る (logs/events.py)
+
+from django.urls import path
+
+from logs.views import AsyncLogEntryDetailView, AsyncLogEntryListCreateView
+from users.views import AsyncTokenObtainPairView, AsyncUserRegisterView
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/users/register/', AsyncUserRegisterView.as_view(), name='register'),
+    path('api/users/token/', AsyncTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/logs/', AsyncLogEntryListCreateView.as_view(), name='logentry-list-create'),
+    path('api/logs/<int:pk>/', AsyncLogEntryDetailView.as_view(), name='logentry-detail'),
+] + sync_urlpatterns
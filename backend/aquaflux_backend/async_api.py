@@ -0,0 +1,76 @@
+# AQUAFLUX/backend/aquaflux_backend/async_api.py
+# DRF の APIView を async def のハンドラーで動かすためのミックスイン (ASGI で動かすビュー用)
+#
+# DRF 3.15 の APIView.dispatch は同期なので、ハンドラーが async def だとコルーチンをそのまま返してしまう。
+# ここでは dispatch を非同期にし、
+#   - 認証は aauthenticate() を持つ認証クラス (StatelessJWTAuthentication) であればイベントループの上で行い、
+#     持たないもの (DBを引く JWTAuthentication など) は sync_to_async で呼ぶ
+#   - それ以外の前処理 (コンテンツネゴシエーション・権限の確認など) と例外の処理・レスポンスの仕上げは
+#     APIView のものをそのまま使う (DBを引かない)
+# Django は 1つのビューの中で同期と非同期のハンドラーを混ぜられないので、get/post/put/patch/delete は全て async def にする
+#
+# 非同期のORM (aget, acount, async for など) も、中ではDBの呼び出しを1本のスレッドで順番に実行する。
+# トランザクションは非同期のコードでは使えないので、トランザクションを使う保存・削除の処理は
+# 同期のコードのまま sync_to_async でまとめて呼ぶ
+
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework import exceptions
+
+
+class AsyncAPIViewMixin:
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        # request.user を先に決めておく (この後の initial() の perform_authentication は DB を引かない)
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._authenticator = None
+        request._not_authenticated()
+
+    async def aget_object(self):
+        # GenericAPIView.get_object の非同期版
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
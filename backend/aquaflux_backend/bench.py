@@ -0,0 +1,55 @@
+# AQUAFLUX/backend/aquaflux_backend/bench.py
+# ベンチマーク用の management コマンドで共有するヘルパー
+
+import contextlib
+import copy
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextlib.contextmanager
+def isolated_test_database(aliases=('default',)):
+    # 開発用DBを汚さないよう、テスト用DBを作成してその中で計測する
+    setup_test_environment()
+    old_names = []
+    try:
+        for alias in aliases:
+            connection = connections[alias]
+            old_names.append((connection, connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)))
+        yield
+    finally:
+        for connection, old_name in reversed(old_names):
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def register_database(alias, test_name=None):
+    # default と同じ設定のDBを alias として追加する (複数のシャードを手元で試すため。テスト用DBの作成は呼び出し側で行う)
+    # test_name を省略すると、SQLite ではメモリ上のDBになる
+    config = copy.deepcopy(connections.settings[DEFAULT_DB_ALIAS])
+    config['NAME'] = f"{config['NAME']}_{alias}"
+    config['TEST'] = {**config.get('TEST', {}), 'NAME': test_name}
+    settings.DATABASES[alias] = connections.settings[alias] = config
+
+
+def unregister_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    settings.DATABASES.pop(alias, None)
+    connections.settings.pop(alias, None)
+
+
+def measure_rps(func, duration=3.0, warmup=20):
+    # func を duration 秒間繰り返し呼び、1秒あたりの実行回数を返す
+    for _ in range(warmup):
+        func()
+    count = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        func()
+        count += 1
+    return count / (time.perf_counter() - started)
@@ -0,0 +1,45 @@
+# AQUAFLUX/backend/aquaflux_backend/cache.py
+# アプリ間で共有するプロセス内キャッシュ
+# (users の認証済みユーザーのキャッシュ、logs の異常検知用の直近のログなど)
+
+import threading
+import time
+
+
+class TTLCache:
+    # プロセス内で使う小さなTTL付きキャッシュ
+    # 他のプロセス (ワーカー) には共有されないので、書き込みを他のプロセスに伝える必要がある場合は
+    # 呼び出し側で Django のキャッシュなどと組み合わせる (logs/anomaly.py)
+
+    def __init__(self, ttl, maxsize=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= self.clock():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                # 一番古いものから捨てる (dict は挿入順を保持する)
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (self.clock() + self.ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
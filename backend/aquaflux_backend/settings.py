@@ -30,7 +30,7 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60), # アクセストークンの有効期限
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),    # リフレッシュトークンの有効期限
     'ROTATE_REFRESH_TOKENS': True, # リフレッシュトークンを使うたびに新しいトークンを発行するか
-    'BLACKLIST_AFTER_ROTATION': True, # 古いリフレッシュトークンをブラックリストに入れるか (トークンブラックリストが必要な場合)
+    'BLACKLIST_AFTER_ROTATION': True, # 古いリフレッシュトークンをブラックリストに入れるか (users.OutstandingRefreshToken で管理)
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY, # settings.SECRET_KEYを使う
     'VERIFYING_KEY': None,
@@ -47,7 +47,9 @@ SIMPLE_JWT = {
 
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
-    'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_USER_CLASS': 'users.authentication.ClaimsUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer', # username / is_active をトークンに埋め込む
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.RotatingTokenRefreshSerializer', # 使用済みリフレッシュトークンを失効させる (users/blacklist.py)
 
     'JTI_CLAIM': 'jti',
 
@@ -77,9 +79,28 @@ INSTALLED_APPS = [
     'logs',
 ]
 
+# JWT認証モード
+# 'stateless': トークンのクレームから軽量ユーザーを組み立て、リクエストごとのユーザーテーブル参照を省く
+# 'database' : 従来通り毎リクエスト CustomUser をDBから読み込む
+JWT_AUTH_MODE = os.environ.get('JWT_AUTH_MODE', 'stateless')
+JWT_AUTHENTICATION_CLASSES = {
+    'stateless': 'users.authentication.StatelessJWTAuthentication',
+    'database': 'rest_framework_simplejwt.authentication.JWTAuthentication',
+}
+# フルのユーザーが必要な場面 (get_full_user) で使うキャッシュの有効期間 (秒)
+JWT_USER_CACHE_TTL = int(os.environ.get('JWT_USER_CACHE_TTL', '30'))
+
+# アカウント削除 (users/purge.py)
+# ユーザーのデータは ACCOUNT_PURGE_CHUNK_SIZE 行ずつ、チャンクごとのトランザクションで削除する
+ACCOUNT_PURGE_CHUNK_SIZE = int(os.environ.get('ACCOUNT_PURGE_CHUNK_SIZE', '500'))
+# False にすると削除の依頼を受けたプロセスでは削除を始めず、purge_accounts (cron など) に任せる
+ACCOUNT_PURGE_IN_PROCESS = os.environ.get('ACCOUNT_PURGE_IN_PROCESS', '1') != '0'
+# 削除中のジョブがこの秒数以上進まなければ、止まったものとして purge_accounts が引き継ぐ
+ACCOUNT_PURGE_STALE_SECONDS = int(os.environ.get('ACCOUNT_PURGE_STALE_SECONDS', '300'))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated', # デフォルトで認証済みユーザーのみアクセス可能にする（後で調整します）
@@ -98,7 +119,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'aquaflux_backend.urls'
+# ビューの実行モード
+# 'sync' : 従来通り同期のビューだけを使う (WSGI: wsgi.py)
+# 'async': 飼育ログの一覧・作成・詳細とユーザー登録・ログインを非同期のビューにする (ASGI: asgi.py で既定になる)
+API_VIEW_MODE = os.environ.get('API_VIEW_MODE', 'sync')
+ROOT_URLCONF = {
+    'sync': 'aquaflux_backend.urls',
+    'async': 'aquaflux_backend.asgi_urls',
+}[API_VIEW_MODE]
 
 TEMPLATES = [
     {
@@ -173,6 +201,88 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
+# 画像解析APIのアップロード制限 (logs/uploads.py)
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024      # これを超える本文は受信前/受信中に拒否する
+IMAGE_UPLOAD_MAX_PIXELS = 40_000_000           # 縦×横の画素数の上限 (ヘッダーだけで判定)
+IMAGE_UPLOAD_SPOOL_THRESHOLD = 512 * 1024      # これを超えた分はメモリではなく一時ファイルに書き出す
+
+# ほぼ同じ試験紙写真の解析結果を再利用する条件
+IMAGE_SIMILARITY_MAX_DISTANCE = int(os.environ.get('IMAGE_SIMILARITY_MAX_DISTANCE', 3))      # dHash のハミング距離の上限 (負の値で無効)
+IMAGE_SIMILARITY_MAX_COLOR_DIFFERENCE = int(os.environ.get('IMAGE_SIMILARITY_MAX_COLOR_DIFFERENCE', 16))  # マスごとの平均色の差 (RGB 各 0-255) の上限
+IMAGE_SIMILARITY_WINDOW_MINUTES = int(os.environ.get('IMAGE_SIMILARITY_WINDOW_MINUTES', 60)) # 何分前までの解析結果を対象にするか
+
+# 同じ内容の同時リクエストをプロセス間でもまとめる場合のロックファイルの置き場所 (未設定ならプロセス内のみ)
+SINGLEFLIGHT_LOCK_DIR = os.environ.get('SINGLEFLIGHT_LOCK_DIR') or None
+
+# Gemini 呼び出しの流量制御 (全体とユーザーごとのトークンバケット, logs/ratelimit.py)
+# 全体のバケットは GEMINI_RATE_LIMIT_STATE_FILE を設定しない限りプロセスごとなので、ワーカーが N 個あれば N 倍のレートになる
+GEMINI_RATE_LIMIT_PER_SECOND = float(os.environ.get('GEMINI_RATE_LIMIT_PER_SECOND', 1.0))            # 全体の呼び出しレート (回/秒)
+GEMINI_RATE_LIMIT_BURST = int(os.environ.get('GEMINI_RATE_LIMIT_BURST', 5))                           # 全体で連続して呼べる回数
+GEMINI_USER_RATE_LIMIT_PER_SECOND = float(os.environ.get('GEMINI_USER_RATE_LIMIT_PER_SECOND', 0.2))  # ユーザーごとのレート (回/秒)
+GEMINI_USER_RATE_LIMIT_BURST = int(os.environ.get('GEMINI_USER_RATE_LIMIT_BURST', 3))                 # ユーザーごとに連続して呼べる回数
+GEMINI_RATE_LIMIT_MAX_QUEUE = int(os.environ.get('GEMINI_RATE_LIMIT_MAX_QUEUE', 32))                  # 順番待ちできる呼び出しの数
+GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS', 15))  # これより長く待つ必要があれば 429 を返す
+GEMINI_RATE_LIMIT_STATE_FILE = os.environ.get('GEMINI_RATE_LIMIT_STATE_FILE') or None                # 全体のバケットを同じホストの全ワーカーで共有するファイル
+
+# Gemini 呼び出しの期限とサーキットブレーカー
+GEMINI_REQUEST_DEADLINE_SECONDS = float(os.environ.get('GEMINI_REQUEST_DEADLINE_SECONDS', 150))    # 再試行を含めたリクエスト全体の期限
+GEMINI_ATTEMPT_TIMEOUT_SECONDS = float(os.environ.get('GEMINI_ATTEMPT_TIMEOUT_SECONDS', 120))      # 1回の呼び出しのタイムアウトの上限
+GEMINI_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('GEMINI_CIRCUIT_FAILURE_THRESHOLD', 5))      # 連続してこの回数失敗したら呼び出しを止める
+GEMINI_CIRCUIT_RESET_SECONDS = float(os.environ.get('GEMINI_CIRCUIT_RESET_SECONDS', 30))           # 止めてから様子見の呼び出しを行うまでの秒数
+
+# AIアドバイスのプロンプトに含める履歴
+ADVICE_PROMPT_TOKEN_BUDGET = int(os.environ.get('ADVICE_PROMPT_TOKEN_BUDGET', 800))  # プロンプト全体のトークン数の上限 (概算)
+ADVICE_CONTEXT_RECENT_LOGS = int(os.environ.get('ADVICE_CONTEXT_RECENT_LOGS', 5))    # 個別に含める最近のログの最大件数 (それより古いものは要約で渡す)
+
+# 飼育ログ保存時の水質の異常検知
+ANOMALY_WINDOW_SIZE = int(os.environ.get('ANOMALY_WINDOW_SIZE', 30))                # 比較に使う直近のログの件数
+ANOMALY_WINDOW_CACHE_TTL = int(os.environ.get('ANOMALY_WINDOW_CACHE_TTL', 300))     # 直近のログの配列をプロセス内にキャッシュする秒数
+ANOMALY_MIN_HISTORY = int(os.environ.get('ANOMALY_MIN_HISTORY', 5))                 # 項目ごとに、この件数の記録があるときだけ過去と比較する
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', 3.5))             # 異常とみなす z スコア (中央値/MAD・EWMA 共通)
+ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', 0.3))               # EWMA の平滑化係数 (大きいほど最近のログを重視)
+
+# 魚の種類の入力補完用のトライ木を作り直す間隔 (秒。辞書の変更は同じプロセス内ではすぐ反映される)
+SPECIES_TRIE_TTL = int(os.environ.get('SPECIES_TRIE_TTL', 300))
+
+# 飼育ログのシャーディング (logs/sharding.py)
+# 飼育ログなどのユーザーごとのデータを、ユーザーIDのハッシュで LOG_SHARDS のいずれかのDBに置く (ユーザーは常に default)
+# 追加のDBは LOG_SHARD_DATABASES="logs_1=postgres://...,logs_2=sqlite:////var/lib/aquaflux/logs_2.sqlite3" の形で指定する
+# シャードは末尾に追加するだけにし (順番で主キーの範囲とハッシュの割り当てが決まる)、追加後は rebalance_log_shards を実行する
+LOG_SHARDS = ['default']
+if os.environ.get('LOG_SHARD_DATABASES'):
+    import dj_database_url
+
+    for item in os.environ['LOG_SHARD_DATABASES'].split(','):
+        alias, url = (part.strip() for part in item.split('=', 1))
+        DATABASES[alias] = dj_database_url.parse(url)
+        LOG_SHARDS.append(alias)
+
+# 飼育ログの読み取り用のレプリカ (logs/replicas.py)
+# LOG_REPLICA_DATABASES="default/replica_1=postgres://...,logs_1/logs_1_replica=..." の形で「主DB/alias=URL」を指定する
+# (主DBを省略すると default)。SQLite のファイルのコピーは sync_sqlite_replicas で作り直せる
+LOG_REPLICAS = {}
+if os.environ.get('LOG_REPLICA_DATABASES'):
+    import dj_database_url
+
+    for item in os.environ['LOG_REPLICA_DATABASES'].split(','):
+        name, url = (part.strip() for part in item.split('=', 1))
+        primary, _, alias = name.rpartition('/')
+        DATABASES[alias] = dj_database_url.parse(url)
+        LOG_REPLICAS.setdefault(primary or 'default', []).append(alias)
+LOG_REPLICA_STICKY_SECONDS = int(os.environ.get('LOG_REPLICA_STICKY_SECONDS', 10))  # 書き込んだユーザーが主DBから読む秒数 (レプリカの遅れより長くする)
+
+DATABASE_ROUTERS = ['logs.replicas.ReplicaRouter', 'logs.sharding.LogShardRouter']
+
+# 飼育ログの変更の通知 (logs/events.py, GET /api/logs/events/)
+LOG_EVENTS_KEEPALIVE_SECONDS = 15  # 通知がない間に接続を保つためのコメントを送る間隔
+LOG_EVENTS_MAX_SECONDS = int(os.environ.get('LOG_EVENTS_MAX_SECONDS', 300))  # 1つの接続を保つ秒数 (過ぎたらクライアントがつなぎ直す)
+LOG_EVENTS_QUEUE_SIZE = 100  # 送りきれていない通知をためる件数 (超えたら読み直しを指示する)
+
+# 差分同期用の削除記録を保持する日数 (これより古いカーソルで同期すると全件が返される)
+LOG_TOMBSTONE_RETENTION_DAYS = 30
+# 差分同期のカーソルを、同期の時刻よりこの秒数だけ前までにする (遅れてコミットされた書き込みを取りこぼさない)
+LOG_SYNC_CURSOR_SAFETY_SECONDS = 5
+
 CORS_ALLOW_ALL_ORIGINS = True
 # あるいは、特定のオリジンのみを許可する場合 (本番向け)
 # CORS_ALLOWED_ORIGINS = [
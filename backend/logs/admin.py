@@ -1,4 +1,138 @@
-from django.contrib import admin
-from .models import LogEntry
+# AQUAFLUX/backend/logs/admin.py
 
-admin.site.register(LogEntry)
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .anomaly import invalidate_window
+from .models import FishSpecies, FishSpeciesAlias, LogEntry, LogEntryTombstone, LogHistorySummary, Tank, TankHistorySummary
+from .species import invalidate_trie
+
+
+# 件数が多いテーブルで COUNT(*) を毎回実行しないページネーター
+# ESTIMATE_THRESHOLD 件までは正確に数え (主キーのインデックスだけを読む)、それを超える場合は
+# PostgreSQL であれば統計情報の推定値、それ以外のDBでは閾値の件数を表示上の件数とする
+class EstimatedCountPaginator(Paginator):
+    ESTIMATE_THRESHOLD = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        capped = queryset.values('pk').order_by()[:self.ESTIMATE_THRESHOLD + 1].count()
+        if capped <= self.ESTIMATE_THRESHOLD:
+            return capped
+        estimate = self._table_estimate(queryset)
+        return max(estimate or 0, capped)
+
+    def _table_estimate(self, queryset):
+        # 絞り込みのない一覧の場合だけ、テーブル全体の推定行数を使う
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
+# シャーディング (logs/sharding.py) を使う場合、管理サイトで扱えるのは default に置かれたログだけ
+@admin.register(LogEntry)
+class LogEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'log_date', 'tank_type', 'fish_type', 'updated_at')
+    list_select_related = ('user',)  # __str__ と user 列で行ごとにユーザーを引かない
+    list_filter = ('tank_type',)
+    date_hierarchy = 'log_date'
+    ordering = ('-log_date', '-id')
+    raw_id_fields = ('user', 'tank')  # 変更画面でユーザー・水槽の全件の選択肢を読み込まない
+    readonly_fields = ('log_date', 'updated_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    # 検索はインデックスの効く完全一致だけにする (get_search_results を参照)
+    search_fields = ('user__username',)
+    search_help_text = 'ログID・ユーザーID (数字) またはユーザー名 (完全一致) で検索します。'
+    actions = ('mark_freshwater', 'mark_saltwater', 'delete_with_tombstones')
+    DELETE_BATCH_SIZE = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        # 標準の検索は icontains (LIKE '%...%') でテーブル全体を走査するため、
+        # 主キー・ユーザーの外部キー・ユーザー名の一意インデックスで引ける条件だけを使う
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)) | queryset.filter(user_id=int(term)), False
+        return queryset.filter(user__username=term), False
+
+    def get_actions(self, request):
+        # 標準の一括削除は対象を全件読み込んで1件ずつ削除するので使わない
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def _set_tank_type(self, request, queryset, tank_type):
+        # UPDATE 1本で更新する (auto_now は効かないので、差分同期のため updated_at も更新する)
+        updated = queryset.order_by().update(tank_type=tank_type, updated_at=timezone.now())
+        self.message_user(request, f'{updated}件のログを更新しました。', messages.SUCCESS)
+
+    @admin.action(description='選択したログを「淡水」にする', permissions=['change'])
+    def mark_freshwater(self, request, queryset):
+        self._set_tank_type(request, queryset, 'freshwater')
+
+    @admin.action(description='選択したログを「海水」にする', permissions=['change'])
+    def mark_saltwater(self, request, queryset):
+        self._set_tank_type(request, queryset, 'saltwater')
+
+    @admin.action(description='選択したログを削除する (同期用の削除記録を残す)', permissions=['delete'])
+    def delete_with_tombstones(self, request, queryset):
+        # 対象のIDだけを読み、削除記録の一括 INSERT と DELETE を DELETE_BATCH_SIZE 件ずつ実行する
+        rows = list(queryset.order_by().values_list('id', 'user_id', 'tank_id'))
+        using = queryset.db
+        with transaction.atomic(using=using):
+            for start in range(0, len(rows), self.DELETE_BATCH_SIZE):
+                batch = rows[start:start + self.DELETE_BATCH_SIZE]
+                LogEntryTombstone.objects.using(using).bulk_create(
+                    [LogEntryTombstone(user_id=user_id, log_id=log_id) for log_id, user_id, _ in batch]
+                )
+                LogEntry.objects.using(using).filter(pk__in=[log_id for log_id, _, _ in batch]).delete()
+            # 履歴の要約は次に使うときに作り直す
+            user_ids = {user_id for _, user_id, _ in rows}
+            tank_ids = {tank_id for _, _, tank_id in rows if tank_id is not None}
+            LogHistorySummary.objects.using(using).filter(user_id__in=user_ids).update(stale=True)
+            TankHistorySummary.objects.using(using).filter(tank_id__in=tank_ids).update(stale=True)
+        for user_id, tank_id in {(user_id, tank_id) for _, user_id, tank_id in rows}:
+            invalidate_window(user_id, tank_id)
+        self.message_user(request, f'{len(rows)}件のログを削除しました。', messages.SUCCESS)
+
+
+class FishSpeciesAliasInline(admin.TabularInline):
+    model = FishSpeciesAlias
+    fields = ('alias', 'normalized')
+    readonly_fields = ('normalized',)
+    extra = 1
+
+
+@admin.register(FishSpecies)
+class FishSpeciesAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'tank_type')
+    list_filter = ('tank_type',)
+    search_fields = ('name', 'slug', 'aliases__alias')
+    prepopulated_fields = {'slug': ('name',)}
+    inlines = (FishSpeciesAliasInline,)
+
+    def delete_queryset(self, request, queryset):
+        # 一括削除は save() を通らないので、入力補完のトライ木をここで作り直させる
+        super().delete_queryset(request, queryset)
+        invalidate_trie()
+
+
+@admin.register(Tank)
+class TankAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'name', 'tank_type', 'fish_type', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('tank_type',)
+    raw_id_fields = ('user', 'species')
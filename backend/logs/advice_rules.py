@@ -0,0 +1,274 @@
+# AQUAFLUX/backend/logs/advice_rules.py
+# 水質データからのルールベースのアドバイス (Gemini を呼ばずにその場で診断と対処を返す)
+#
+# - ルールはデータ (RULES / FISH_PROFILES) として定義し、起動時 (LogsConfig.ready) に
+#   (水槽の種類, 魚の種類, 項目) ごとの、しきい値の昇順に並べた表へ変換しておく
+# - 判定は項目ごとに二分探索を1回するだけで、当てはまるルールのうち一番厳しいものを選ぶ
+#   (「〜を超える」ルールは、値より小さいしきい値のうち最大のもの、「〜を下回る」ルールはその逆)
+# - 文章でのくわしい説明が必要な場合だけ、この診断結果を添えて Gemini に問い合わせる
+
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+from .species import SPECIES
+
+SEVERITY_ORDER = {'info': 0, 'caution': 1, 'danger': 2}
+
+TANK_TYPE_ALIASES = {
+    'freshwater': 'freshwater',
+    '淡水': 'freshwater',
+    'saltwater': 'saltwater',
+    '海水': 'saltwater',
+}
+
+# 水槽の種類ごとのルール
+#   above: 値がこれを超えたら当てはまる / below: 値がこれを下回ったら当てはまる
+#   同じ項目・同じ向きのルールは、しきい値が厳しいほど severity が重くなるように並べる
+RULES = [
+    # 亜硝酸: 少しでも検出されたら、ろ過がうまく働いていない
+    {'id': 'no2_detected', 'tank_types': ('freshwater', 'saltwater'), 'parameter': 'no2', 'above': 0.0, 'severity': 'caution',
+     'diagnosis': '亜硝酸 (NO2) が検出されています。ろ過バクテリアが十分に働いていない可能性があります。',
+     'actions': ['水槽の水の1/3程度を水換えする', '2〜3日は餌の量を減らす', 'ろ材を水道水で洗っていないか確認する']},
+    {'id': 'no2_toxic', 'tank_types': ('freshwater', 'saltwater'), 'parameter': 'no2', 'above': 0.5, 'severity': 'danger',
+     'diagnosis': '亜硝酸 (NO2) が魚に有害な濃度です。',
+     'actions': ['今日中に水の1/2程度を水換えし、翌日以降も数値が下がるまで続ける', '餌を1〜2日止める', '死んだ魚や食べ残しがないか確認する']},
+
+    # 硝酸塩: たまりすぎは水換え不足
+    {'id': 'no3_high', 'tank_types': ('freshwater',), 'parameter': 'no3', 'above': 25.0, 'severity': 'caution',
+     'diagnosis': '硝酸塩 (NO3) がたまってきています。',
+     'actions': ['水換えの頻度か量を増やす', '餌の与えすぎや魚の入れすぎがないか見直す']},
+    {'id': 'no3_very_high', 'tank_types': ('freshwater',), 'parameter': 'no3', 'above': 50.0, 'severity': 'danger',
+     'diagnosis': '硝酸塩 (NO3) がかなり高く、魚の体調不良やコケの原因になります。',
+     'actions': ['数日に分けて水換えを繰り返し、少しずつ下げる', '底砂の掃除をする']},
+    {'id': 'no3_high', 'tank_types': ('saltwater',), 'parameter': 'no3', 'above': 10.0, 'severity': 'caution',
+     'diagnosis': '硝酸塩 (NO3) がたまってきています。海水魚・サンゴには低めが望ましいです。',
+     'actions': ['水換えの頻度か量を増やす', 'プロテインスキマーの汚れを確認する']},
+    {'id': 'no3_very_high', 'tank_types': ('saltwater',), 'parameter': 'no3', 'above': 25.0, 'severity': 'danger',
+     'diagnosis': '硝酸塩 (NO3) がかなり高い状態です。',
+     'actions': ['数日に分けて水換えを繰り返し、少しずつ下げる', '餌の量を見直す']},
+
+    # 塩素: カルキ抜きの忘れ
+    {'id': 'cl2_detected', 'tank_types': ('freshwater', 'saltwater'), 'parameter': 'cl2', 'above': 0.0, 'severity': 'danger',
+     'diagnosis': '塩素 (Cl2) が検出されています。魚のエラやろ過バクテリアを傷めます。',
+     'actions': ['すぐにカルキ抜きを規定量入れる', '水換えの水にカルキ抜きを入れ忘れていないか確認する']},
+
+    # KH: 低いと pH が急に変わりやすい
+    {'id': 'kh_low', 'tank_types': ('freshwater',), 'parameter': 'kh', 'below': 2.0, 'severity': 'caution',
+     'diagnosis': 'KH (炭酸塩硬度) が低く、pH が急に下がりやすい状態です。',
+     'actions': ['こまめな水換えで KH を戻す', 'pH の変化に気をつけて、しばらくは毎日測る']},
+    {'id': 'kh_low', 'tank_types': ('saltwater',), 'parameter': 'kh', 'below': 7.0, 'severity': 'caution',
+     'diagnosis': 'KH (炭酸塩硬度) が低く、pH が不安定になりやすい状態です。',
+     'actions': ['水換えをする', 'KH を上げる添加剤を少しずつ使う']},
+
+    # GH
+    {'id': 'gh_low', 'tank_types': ('freshwater',), 'parameter': 'gh', 'below': 2.0, 'severity': 'caution',
+     'diagnosis': 'GH (総硬度) が低く、ミネラルが不足しています。',
+     'actions': ['水換えでミネラルを補う', 'エビを飼っている場合は脱皮不全に注意する']},
+    {'id': 'gh_high', 'tank_types': ('freshwater',), 'parameter': 'gh', 'above': 20.0, 'severity': 'caution',
+     'diagnosis': 'GH (総硬度) が高めです。',
+     'actions': ['水道水以外の水 (ミネラルウォーターなど) を使っていないか確認する', '石や流木など、水を硬くする素材がないか確認する']},
+
+    # pH
+    {'id': 'ph_low', 'tank_types': ('freshwater',), 'parameter': 'ph', 'below': 6.0, 'severity': 'caution',
+     'diagnosis': 'pH が低め (酸性寄り) です。',
+     'actions': ['少量ずつ水換えをして pH を戻す', '流木やソイルの影響がないか確認する']},
+    {'id': 'ph_very_low', 'tank_types': ('freshwater',), 'parameter': 'ph', 'below': 5.5, 'severity': 'danger',
+     'diagnosis': 'pH がかなり低く、魚やろ過バクテリアに悪影響があります。',
+     'actions': ['数日に分けて水換えをし、急に変えすぎないようにする', 'KH も測って、pH が下がり続ける原因を確認する']},
+    {'id': 'ph_high', 'tank_types': ('freshwater',), 'parameter': 'ph', 'above': 8.0, 'severity': 'caution',
+     'diagnosis': 'pH が高め (アルカリ性寄り) です。',
+     'actions': ['石やサンゴ砂など、pH を上げる素材がないか確認する', '少量ずつ水換えをする']},
+    {'id': 'ph_very_high', 'tank_types': ('freshwater',), 'parameter': 'ph', 'above': 8.5, 'severity': 'danger',
+     'diagnosis': 'pH がかなり高い状態です。',
+     'actions': ['数日に分けて水換えをし、急に変えすぎないようにする']},
+    {'id': 'ph_low', 'tank_types': ('saltwater',), 'parameter': 'ph', 'below': 7.8, 'severity': 'caution',
+     'diagnosis': 'pH が海水としては低めです。',
+     'actions': ['水換えをする', 'KH も測って、足りなければ補う', '部屋の換気をする (二酸化炭素がこもると下がりやすい)']},
+    {'id': 'ph_very_low', 'tank_types': ('saltwater',), 'parameter': 'ph', 'below': 7.5, 'severity': 'danger',
+     'diagnosis': 'pH が海水としてはかなり低い状態です。',
+     'actions': ['水換えをし、KH を補う']},
+    {'id': 'ph_high', 'tank_types': ('saltwater',), 'parameter': 'ph', 'above': 8.5, 'severity': 'caution',
+     'diagnosis': 'pH が海水としては高めです。',
+     'actions': ['添加剤の入れすぎがないか確認する']},
+]
+
+# 魚の種類ごとの適した範囲 (魚の種類の辞書の初期データから作る)
+FISH_PROFILES = {
+    item['slug']: {'name': item['name'], 'aliases': tuple(item['aliases']), 'ranges': item['ideal_ranges']}
+    for item in SPECIES
+}
+
+# 問題が見つからなかったときの日常の手入れ
+MAINTENANCE_ACTIONS = [
+    '今の水質を保つため、週に1回、水の1/4程度を水換えする',
+    '餌は2〜3分で食べきれる量にする',
+    '週に1回は水質を測って記録する',
+]
+NO_DATA_ACTIONS = ['試験紙で水質を測って記録する']
+
+
+def parameter_name(parameter):
+    return 'pH' if parameter == 'ph' else parameter.upper()
+
+
+def _fish_rules(key, profile):
+    # 魚の種類の適した範囲を「下回る」「超える」の2つのルールにする
+    rules = []
+    for parameter, (low, high) in profile['ranges'].items():
+        name = parameter_name(parameter)
+        rules.append({
+            'id': f'{key}_{parameter}_low', 'parameter': parameter, 'below': low, 'severity': 'caution',
+            'diagnosis': f"{profile['name']}に適した{name} ({low}〜{high}) より低めです。",
+            'actions': [f"{profile['name']}に合わせて、{name} を少しずつ {low}〜{high} に近づける"],
+        })
+        rules.append({
+            'id': f'{key}_{parameter}_high', 'parameter': parameter, 'above': high, 'severity': 'caution',
+            'diagnosis': f"{profile['name']}に適した{name} ({low}〜{high}) より高めです。",
+            'actions': [f"{profile['name']}に合わせて、{name} を少しずつ {low}〜{high} に近づける"],
+        })
+    return rules
+
+
+class ThresholdTable:
+    # 1つの項目のルールを、しきい値の昇順に並べたもの
+    def __init__(self, rules):
+        above = sorted((rule for rule in rules if 'above' in rule), key=lambda rule: (rule['above'], SEVERITY_ORDER[rule['severity']]))
+        below = sorted((rule for rule in rules if 'below' in rule), key=lambda rule: (rule['below'], -SEVERITY_ORDER[rule['severity']]))
+        self.above_thresholds = [rule['above'] for rule in above]
+        self.above_rules = above
+        self.below_thresholds = [rule['below'] for rule in below]
+        self.below_rules = below
+
+    def match(self, value):
+        matched = []
+        # value > しきい値 のルールのうち、しきい値が最大のもの
+        index = bisect_left(self.above_thresholds, value)
+        if index:
+            matched.append(self.above_rules[index - 1])
+        # value < しきい値 のルールのうち、しきい値が最小のもの
+        index = bisect_right(self.below_thresholds, value)
+        if index < len(self.below_rules):
+            matched.append(self.below_rules[index])
+        return matched
+
+
+@dataclass
+class RuleAdvice:
+    status: str
+    diagnosis: list
+    actions: list
+
+    def as_dict(self):
+        return {'status': self.status, 'diagnosis': self.diagnosis, 'actions': self.actions}
+
+
+class RuleEngine:
+    def __init__(self, tables, aliases, profiles):
+        self.tables = tables      # {(水槽の種類, 魚の種類 or None): {項目: ThresholdTable}}
+        self.aliases = aliases    # [(別名, 魚の種類)] (長い別名から順に照合する)
+        self.profiles = profiles
+
+    @classmethod
+    def compile(cls, rules=RULES, fish_profiles=FISH_PROFILES):
+        by_tank = {}
+        for rule in rules:
+            for tank_type in rule['tank_types']:
+                by_tank.setdefault(tank_type, []).append(rule)
+
+        tables = {}
+        for tank_type, tank_rules in by_tank.items():
+            tables[(tank_type, None)] = cls._tables(tank_rules)
+            for key, profile in fish_profiles.items():
+                tables[(tank_type, key)] = cls._tables(tank_rules + _fish_rules(key, profile))
+
+        aliases = sorted(
+            ((alias, key) for key, profile in fish_profiles.items() for alias in profile['aliases']),
+            key=lambda item: -len(item[0]),
+        )
+        return cls(tables, aliases, fish_profiles)
+
+    @staticmethod
+    def _tables(rules):
+        parameters = {}
+        for rule in rules:
+            parameters.setdefault(rule['parameter'], []).append(rule)
+        return {parameter: ThresholdTable(parameter_rules) for parameter, parameter_rules in parameters.items()}
+
+    def fish_key(self, fish_type):
+        for alias, key in self.aliases:
+            if alias in (fish_type or ''):
+                return key
+        return None
+
+    def evaluate(self, tank_type, fish_type, water_data, species=None):
+        # species: 魚の種類の辞書の slug (分かっている場合は fish_type の照合を省く)
+        tank_type = TANK_TYPE_ALIASES.get(tank_type, 'freshwater')
+        fish_key = species if species in self.profiles else self.fish_key(fish_type)
+        tables = self.tables.get((tank_type, fish_key)) or self.tables.get((tank_type, None), {})
+
+        matched, measured = [], False
+        for parameter, value in (water_data or {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            measured = True
+            table = tables.get(parameter)
+            if table is not None:
+                matched.extend((rule, parameter, value) for rule in table.match(value))
+
+        if not measured:
+            return RuleAdvice('unknown', [], list(NO_DATA_ACTIONS))
+
+        # 重いものから並べ、同じ対処は1回だけにする
+        matched.sort(key=lambda item: -SEVERITY_ORDER[item[0]['severity']])
+        diagnosis, actions = [], []
+        for rule, parameter, value in matched:
+            diagnosis.append({
+                'rule': rule['id'],
+                'parameter': parameter,
+                'value': value,
+                'severity': rule['severity'],
+                'message': rule['diagnosis'],
+            })
+            actions.extend(action for action in rule['actions'] if action not in actions)
+
+        status = diagnosis[0]['severity'] if diagnosis else 'good'
+        return RuleAdvice(status, diagnosis, actions or list(MAINTENANCE_ACTIONS))
+
+
+STATUS_LABELS = {
+    'good': '水質は良好です。',
+    'caution': '注意が必要な項目があります。',
+    'danger': '早めの対処が必要な項目があります。',
+    'unknown': '水質データがありません。',
+}
+
+
+def render_markdown(advice):
+    # 診断結果を、これまでのAIアドバイスと同じように表示できる文章にする
+    lines = [f"**{STATUS_LABELS[advice.status]}**"]
+    if advice.diagnosis:
+        lines.append('')
+        lines.append('### 診断')
+        lines.extend(f"- {parameter_name(item['parameter'])} {item['value']}: {item['message']}" for item in advice.diagnosis)
+    lines.append('')
+    lines.append('### 対処' if advice.diagnosis else '### おすすめの手入れ')
+    lines.extend(f"- {action}" for action in advice.actions)
+    return "\n".join(lines)
+
+
+_engine = None
+
+
+def load():
+    # 起動時 (LogsConfig.ready) にルールを表に変換しておく
+    global _engine
+    _engine = RuleEngine.compile()
+    return _engine
+
+
+def get_engine():
+    return _engine or load()
+
+
+def rule_advice(tank_type, fish_type, water_data, species=None):
+    return get_engine().evaluate(tank_type, fish_type, water_data, species)
@@ -0,0 +1,252 @@
+# AQUAFLUX/backend/logs/anomaly.py
+# 飼育ログ保存時の水質の異常検知 (Gemini を呼ばずにその場で判定する)
+#
+# - 水槽の種類ごとの安全な範囲を外れた値は out_of_range として記録する
+# - ユーザー自身の直近のログ (ANOMALY_WINDOW_SIZE 件) と比べ、いつもの値から大きく外れた値は deviation とする
+#   - 中央値と MAD (中央絶対偏差) によるロバストな z スコア: 過去の外れ値に引きずられない
+#   - EWMA (指数加重移動平均) と加重標準偏差による z スコア: 最近の水準からの急な変化を捉える
+#   どちらかがしきい値を超えたら異常とする。全項目を (ログ数 x 項目数) の配列にまとめて NumPy で一度に計算する
+# - 比較する相手は同じ水槽のログ (水槽が決まっていないログはユーザーの全てのログ)
+# - 直近のログの配列は (ユーザー, 水槽) ごとにプロセス内でキャッシュし、ログ作成時は末尾に1行足すだけにする
+#   (更新・削除されたときは捨てて、次に使うときに読み直す)
+# - 他のワーカーでの作成・更新・削除を知るため、(ユーザー, 水槽) ごとの版数を Django のキャッシュに置き、
+#   変更のたびに1つ進める。使うときに版数が手元の配列と違えば読み直す。複数のプロセスで動かす場合は
+#   CACHES に共有のキャッシュ (Redis など) を設定する (プロセスごとの LocMemCache のままだと、
+#   他のワーカーの変更は ANOMALY_WINDOW_CACHE_TTL 秒後に読み直すまで反映されない)
+
+import warnings
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from aquaflux_backend.cache import TTLCache
+
+from .models import LogEntry
+
+# 水槽の種類ごとの安全な範囲 (これを外れると魚に害が出やすい)
+SAFE_RANGES = {
+    'freshwater': {
+        'ph': (6.0, 8.0),
+        'kh': (1.0, 12.0),
+        'gh': (2.0, 20.0),
+        'no2': (0.0, 0.2),
+        'no3': (0.0, 40.0),
+        'cl2': (0.0, 0.1),
+    },
+    'saltwater': {
+        'ph': (7.8, 8.5),
+        'kh': (6.0, 14.0),
+        'no2': (0.0, 0.2),
+        'no3': (0.0, 20.0),
+        'cl2': (0.0, 0.1),
+    },
+}
+
+# 試験紙の読み取りの細かさ。過去の値がほとんど変わらない (MAD が 0 に近い) ときは、これをばらつきの下限にする
+MIN_SCALE = {
+    'ph': 0.2,
+    'kh': 1.0,
+    'gh': 1.0,
+    'no2': 0.1,
+    'no3': 5.0,
+    'cl2': 0.1,
+}
+DEFAULT_MIN_SCALE = 0.05  # 上記以外の項目 (中央値に対する割合。ただし 0.05 以上)
+
+MAD_TO_SIGMA = 1.4826  # 正規分布の場合に MAD を標準偏差に換算する係数
+
+
+def _numeric(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float))
+
+
+class HistoryWindow:
+    # ユーザーの直近のログの水質を (ログ数 x 項目数) の配列にしたもの (古い順、値がない箇所は NaN)
+    # キャッシュしたものを複数のスレッドで読むので、書き換えずに新しいインスタンスを返す
+    # version は読み込んだ (ログを足した) 時点の共有の版数
+
+    def __init__(self, keys, values, size, version=0):
+        self.keys = list(keys)
+        self.values = values
+        self.size = size
+        self.version = version
+
+    @classmethod
+    def from_water_data(cls, water_data_list, size):
+        keys = []
+        for water_data in water_data_list:
+            for key, value in (water_data or {}).items():
+                if _numeric(value) and key not in keys:
+                    keys.append(key)
+        values = np.full((len(water_data_list), len(keys)), np.nan)
+        for row, water_data in enumerate(water_data_list):
+            for column, key in enumerate(keys):
+                value = (water_data or {}).get(key)
+                if _numeric(value):
+                    values[row, column] = value
+        return cls(keys, values[-size:] if size else values[:0], size)
+
+    def appended(self, water_data):
+        keys = self.keys + [key for key, value in (water_data or {}).items() if _numeric(value) and key not in self.keys]
+        values = self.values
+        if len(keys) > len(self.keys):
+            values = np.hstack([values, np.full((len(values), len(keys) - len(self.keys)), np.nan)])
+        row = np.array([
+            water_data[key] if _numeric((water_data or {}).get(key)) else np.nan
+            for key in keys
+        ])
+        values = np.vstack([values, row])[-self.size:]
+        return HistoryWindow(keys, values, self.size, self.version)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def window_size():
+    return getattr(settings, 'ANOMALY_WINDOW_SIZE', 30)
+
+
+history_windows = TTLCache(ttl=getattr(settings, 'ANOMALY_WINDOW_CACHE_TTL', 300))
+
+
+def load_window(user_id, before=None, tank_id=None):
+    # 直近のログを読み込む (before を指定した場合は、そのログより前のもの)
+    queryset = LogEntry.objects.for_user(user_id)
+    if tank_id is not None:
+        queryset = queryset.filter(tank_id=tank_id)
+    if before is not None:
+        queryset = queryset.exclude(pk=before.pk).filter(
+            Q(log_date__lt=before.log_date) | Q(log_date=before.log_date, id__lt=before.pk)
+        )
+    size = window_size()
+    rows = list(queryset.order_by('-log_date', '-id').values_list('water_data', flat=True)[:size])
+    return HistoryWindow.from_water_data(rows[::-1], size)
+
+
+def _version_key(user_id, tank_id):
+    return f'logs:anomaly-window:{user_id}:{tank_id}'
+
+
+def shared_version(user_id, tank_id):
+    return cache.get(_version_key(user_id, tank_id), 0)
+
+
+def bump_version(user_id, tank_id):
+    # 共有の版数を1つ進め、進めた後の値を返す (ログの変更をコミットした後に呼ぶ)
+    key = _version_key(user_id, tank_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # add と incr の間に消えた (追い出された) 場合
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def get_window(user_id, tank_id=None):
+    # 版数を先に読んでからログを読むので、その間に他のワーカーが変更しても次に使うときに読み直される
+    version = shared_version(user_id, tank_id)
+    window = history_windows.get((user_id, tank_id))
+    if window is None or window.version != version:
+        window = load_window(user_id, tank_id=tank_id)
+        window.version = version
+        history_windows.set((user_id, tank_id), window)
+    return window
+
+
+def record_created(user_id, water_data, tank_id=None):
+    # 作成されたログをキャッシュ済みの配列の末尾に足す (キャッシュがなければ次に使うときに読み込む)
+    # 水槽のログはユーザー全体の配列にも含まれる
+    for key in {(user_id, None), (user_id, tank_id)}:
+        version = bump_version(*key)
+        window = history_windows.get(key)
+        if window is not None and window.version == version - 1:
+            # 手元の配列の後に、他のワーカーでの変更がない
+            appended = window.appended(water_data)
+            appended.version = version
+            history_windows.set(key, appended)
+        else:
+            history_windows.delete(key)
+
+
+def invalidate_window(user_id, *tank_ids):
+    for tank_id in {None, *tank_ids}:
+        bump_version(user_id, tank_id)
+        history_windows.delete((user_id, tank_id))
+
+
+def window_statistics(values, alpha):
+    # 項目ごとの中央値・MAD・EWMA・EWMA の加重標準偏差・有効な値の数をまとめて求める
+    present = ~np.isnan(values)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # 値が1つもない項目の nanmedian は RuntimeWarning を出すので抑える (結果は NaN になる)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(values, axis=0)
+        mad = np.nanmedian(np.abs(values - median), axis=0)
+        # 新しいログほど重くする: 重み (1 - alpha)^(経過件数)。値がない箇所の重みは 0
+        ages = np.arange(len(values) - 1, -1, -1)[:, None]
+        weights = np.where(present, (1 - alpha) ** ages, 0.0)
+        filled = np.where(present, values, 0.0)
+        total = weights.sum(axis=0)
+        ewma = (weights * filled).sum(axis=0) / total
+        ewm_std = np.sqrt((weights * (filled - ewma) ** 2).sum(axis=0) / total)
+    return median, mad, ewma, ewm_std, counts
+
+
+def range_anomalies(water_data, tank_type):
+    anomalies = []
+    for key, (low, high) in SAFE_RANGES.get(tank_type, {}).items():
+        value = (water_data or {}).get(key)
+        if _numeric(value) and not low <= value <= high:
+            anomalies.append({
+                'parameter': key,
+                'kind': 'out_of_range',
+                'value': value,
+                'direction': 'low' if value < low else 'high',
+                'range': [low, high],
+            })
+    return anomalies
+
+
+def deviation_anomalies(water_data, window):
+    if not len(window) or not window.keys:
+        return []
+    threshold = getattr(settings, 'ANOMALY_Z_THRESHOLD', 3.5)
+    min_history = getattr(settings, 'ANOMALY_MIN_HISTORY', 5)
+    alpha = getattr(settings, 'ANOMALY_EWMA_ALPHA', 0.3)
+
+    current = np.array([
+        water_data[key] if _numeric((water_data or {}).get(key)) else np.nan
+        for key in window.keys
+    ])
+    median, mad, ewma, ewm_std, counts = window_statistics(window.values, alpha)
+    min_scale = np.array([MIN_SCALE.get(key, np.nan) for key in window.keys])
+    min_scale = np.where(np.isnan(min_scale), np.maximum(DEFAULT_MIN_SCALE * np.abs(median), DEFAULT_MIN_SCALE), min_scale)
+    with np.errstate(invalid='ignore'):
+        robust_z = (current - median) / np.maximum(MAD_TO_SIGMA * mad, min_scale)
+        ewma_z = (current - ewma) / np.maximum(ewm_std, min_scale)
+        flagged = (counts >= min_history) & ~np.isnan(current) & (
+            (np.abs(robust_z) > threshold) | (np.abs(ewma_z) > threshold)
+        )
+
+    anomalies = []
+    for column in np.flatnonzero(flagged):
+        anomalies.append({
+            'parameter': window.keys[column],
+            'kind': 'deviation',
+            'value': water_data[window.keys[column]],
+            'direction': 'low' if current[column] < median[column] else 'high',
+            'median': round(float(median[column]), 3),
+            'ewma': round(float(ewma[column]), 3),
+            'robust_z': round(float(robust_z[column]), 2),
+            'ewma_z': round(float(ewma_z[column]), 2),
+        })
+    return anomalies
+
+
+def detect_anomalies(water_data, tank_type, window):
+    # 安全な範囲の判定と、過去のログとの比較の結果をまとめて返す
+    return range_anomalies(water_data, tank_type) + deviation_anomalies(water_data, window)
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_migrate
 
 
 class LogsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logs'
+
+    def ready(self):
+        # アドバイスのルールを起動時に判定用の表へ変換しておく
+        from . import advice_rules
+        advice_rules.load()
+
+        # シャーディング (logs/sharding.py): シャードの主キーの採番範囲と、ユーザー削除時のシャードのデータの削除
+        from . import sharding
+        post_migrate.connect(sharding.reserve_id_range, sender=self)
+        post_delete.connect(sharding.delete_user_data, sender=settings.AUTH_USER_MODEL)
@@ -0,0 +1,215 @@
+# AQUAFLUX/backend/logs/context.py
+# AIアドバイス用のプロンプトの組み立て (トークン数の上限つき)
+#
+# - 直近のログは必要な列 (日付・水質・メモ) だけを1クエリで読み込む
+# - それより古い履歴は、ユーザーごと (LogHistorySummary) または水槽ごと (TankHistorySummary) の要約を
+#   項目ごとの件数・平均・範囲・最初と最後の値として数行で渡す。要約はログ作成時に差分で更新する
+# - 「現在の状況」と指示文は必ず含め、残りの予算に要約 → 新しいログの順で詰める
+
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import LogEntry, LogHistorySummary, TankHistorySummary
+from .sharding import db_for_user
+
+NOTE_CHARS = 30  # プロンプトに含めるメモの最大文字数
+
+
+def estimate_tokens(text):
+    # トークン数の概算 (英数字は約4文字で1トークン、日本語などはおよそ1文字1トークン)
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _numeric(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float))
+
+
+def _add_to_parameters(parameters, log_date, water_data):
+    date = log_date.isoformat()
+    for key, value in (water_data or {}).items():
+        if not _numeric(value):
+            continue
+        item = parameters.get(key)
+        if item is None:
+            parameters[key] = {'count': 1, 'sum': value, 'min': value, 'max': value, 'first': [date, value], 'last': [date, value]}
+            continue
+        item['count'] += 1
+        item['sum'] += value
+        item['min'] = min(item['min'], value)
+        item['max'] = max(item['max'], value)
+        if date < item['first'][0]:
+            item['first'] = [date, value]
+        if date >= item['last'][0]:
+            item['last'] = [date, value]
+
+
+def _add_log(summary, log_date, water_data):
+    summary.log_count += 1
+    summary.first_date = min(summary.first_date, log_date) if summary.first_date else log_date
+    summary.last_date = max(summary.last_date, log_date) if summary.last_date else log_date
+    _add_to_parameters(summary.parameters, log_date, water_data)
+
+
+def _scope(user_id, tank_id):
+    # 要約のモデル・キーと、対象のログ (tank_id を指定した場合はその水槽のログだけ)
+    if tank_id is None:
+        return LogHistorySummary, {'user_id': user_id}, LogEntry.objects.for_user(user_id)
+    return TankHistorySummary, {'tank_id': tank_id}, LogEntry.objects.for_user(user_id).filter(tank_id=tank_id)
+
+
+def rebuild_summary(user_id, tank_id=None):
+    # ログ全件から要約を作り直す (日付と水質の列だけを順に読む)
+    model, key, logs = _scope(user_id, tank_id)
+    summary = model(**key)
+    rows = logs.order_by('log_date', 'id').values_list('log_date', 'water_data')
+    for log_date, water_data in rows.iterator():
+        _add_log(summary, log_date, water_data)
+    summary.stale = False
+    summary.save(using=db_for_user(user_id))
+    return summary
+
+
+def _create_stale_row(model, key, using):
+    # 要約の行がなければ「古い」印のついた空の行を作る
+    # 最初のログの作成やアドバイスが同時に来ても、主キーの重複で失敗せずにどちらかが作った行を使う
+    model.objects.using(using).get_or_create(**key, defaults={'stale': True})
+
+
+def record_log_created(entry):
+    # ログ作成時に、ユーザーと水槽の要約へ1件分を足し込む (要約がない・古い場合は作り直す)
+    scopes = [None] if entry.tank_id is None else [None, entry.tank_id]
+    using = db_for_user(entry.user_id)
+    with transaction.atomic(using=using):
+        for tank_id in scopes:
+            model, key, _ = _scope(entry.user_id, tank_id)
+            locked = model.objects.using(using).select_for_update().filter(**key)
+            summary = locked.first()
+            if summary is None:
+                # 行を作ってからロックするので、同時に来た最初の書き込みはここで順番に並ぶ
+                _create_stale_row(model, key, using)
+                summary = locked.first()
+            if summary.stale:
+                rebuild_summary(entry.user_id, tank_id)
+                continue
+            _add_log(summary, entry.log_date, entry.water_data)
+            summary.save(update_fields=['log_count', 'first_date', 'last_date', 'parameters', 'updated_at'])
+
+
+def invalidate_summary(user_id, *tank_ids):
+    # ログの更新・削除時は差分で戻せないので、次に使うときに作り直す
+    using = db_for_user(user_id)
+    LogHistorySummary.objects.using(using).filter(user_id=user_id).update(stale=True)
+    tank_ids = [tank_id for tank_id in tank_ids if tank_id is not None]
+    if tank_ids:
+        TankHistorySummary.objects.using(using).filter(tank_id__in=tank_ids).update(stale=True)
+
+
+def get_summary(user_id, tank_id=None):
+    model, key, _ = _scope(user_id, tank_id)
+    using = db_for_user(user_id)
+    summary = model.objects.using(using).filter(**key).first()
+    if summary is None:
+        _create_stale_row(model, key, using)
+    if summary is None or summary.stale:
+        summary = rebuild_summary(user_id, tank_id)
+    return summary
+
+
+def format_water_data(water_data, separator=': '):
+    parts = [f"{key}{separator}{value}" for key, value in (water_data or {}).items() if value is not None]
+    return ", ".join(parts)
+
+
+def format_summary(summary):
+    lines = [f"記録期間: {summary.first_date} 〜 {summary.last_date} (全{summary.log_count}件)"]
+    for key, item in summary.parameters.items():
+        count = f" {item['count']}件" if item['count'] < summary.log_count else ""
+        if item['min'] == item['max']:
+            lines.append(f"{key}{count}: 常に{item['min']}")
+            continue
+        avg = round(item['sum'] / item['count'], 2)
+        (first_date, first_value), (last_date, last_value) = item['first'], item['last']
+        lines.append(
+            f"{key}{count}: 平均{avg} 範囲{item['min']}〜{item['max']} "
+            f"{first_date}={first_value} → {last_date}={last_value}"
+        )
+    return "\n".join(lines)
+
+
+def format_log(row, previous_notes=None):
+    line = f"{row['log_date']} {format_water_data(row['water_data'], separator='=') or 'データなし'}"
+    notes = (row['notes'] or '').strip()
+    if notes and notes != previous_notes:
+        # 直前の行と同じメモは繰り返さない
+        line += f" メモ:{notes[:NOTE_CHARS]}{'…' if len(notes) > NOTE_CHARS else ''}"
+    return line
+
+
+@dataclass
+class AdvicePrompt:
+    text: str
+    tokens: int
+    included_logs: int
+    total_logs: int
+
+
+def format_diagnosis(diagnosis):
+    return " / ".join(f"{item['parameter']}={item['value']}: {item['message']}" for item in diagnosis)
+
+
+def build_advice_prompt(user_id, tank_type, fish_type, water_data, notes, token_budget=None, recent_limit=None, diagnosis=None,
+                        tank_id=None):
+    # tank_id を指定した場合は、その水槽の履歴だけを含める
+    token_budget = token_budget or getattr(settings, 'ADVICE_PROMPT_TOKEN_BUDGET', 800)
+    recent_limit = recent_limit or getattr(settings, 'ADVICE_CONTEXT_RECENT_LOGS', 5)
+
+    head = (
+        f"あなたは水槽の専門家です。以下の水槽のデータに基づいて、具体的で分かりやすいアドバイスをしてください。\n\n"
+        f"【現在の状況】\n"
+        f"水槽の種類: {tank_type}\n"
+        f"主な魚の種類: {fish_type}\n"
+        f"水質データ: {format_water_data(water_data) or '（データなし）'}\n"
+        f"その他メモ: {notes}"
+    )
+    if diagnosis:
+        # ルールによる診断を渡し、それと食い違わない説明にしてもらう
+        head += f"\n自動診断: {format_diagnosis(diagnosis)}"
+    tail = (
+        "\n\n診断結果と、魚が快適に過ごせるように、具体的にどうすれば良いか教えてください。改善策は箇条書きで、専門用語は避け、初心者にも理解できるように説明してください。"
+        "現在の水質が良い場合は、それを維持するためのアドバイスをしてください。"
+        "過去のデータがある場合は、変化の傾向についてもコメントしてください。"
+    )
+    remaining = token_budget - estimate_tokens(head) - estimate_tokens(tail)
+
+    summary = get_summary(user_id, tank_id)
+    history = []
+    if summary.log_count:
+        summary_text = f"\n\n【参考：これまでの記録の要約】\n{format_summary(summary)}"
+        if estimate_tokens(summary_text) <= remaining:
+            history.append(summary_text)
+            remaining -= estimate_tokens(summary_text)
+
+    rows = []
+    if summary.log_count:
+        _, _, logs = _scope(user_id, tank_id)
+        rows = logs.order_by('-log_date', '-id').values('log_date', 'water_data', 'notes')[:recent_limit]
+    log_lines = []
+    header = "\n\n【参考：最近の飼育ログ】\n"
+    remaining -= estimate_tokens(header)
+    previous_notes = None
+    for row in rows:
+        line = f"{format_log(row, previous_notes)}\n"
+        previous_notes = (row['notes'] or '').strip()
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            break
+        log_lines.append(line)
+        remaining -= cost
+    if log_lines:
+        history.append(header + "".join(log_lines).rstrip("\n"))
+
+    text = head + "".join(history) + tail
+    return AdvicePrompt(text=text, tokens=estimate_tokens(text), included_logs=len(log_lines), total_logs=summary.log_count)
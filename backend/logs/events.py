@@ -0,0 +1,172 @@
+# AQUAFLUX/backend/logs/events.py
+# 飼育ログの変更の通知 (GET /api/logs/events/ の Server-Sent Events で、開いている一覧ページに送る)
+#
+# - ログを作成・更新・削除したリクエストは、コミット後に publish_log_event() でそのユーザーの購読者に通知する
+#     log.saved   {"log": {...}}   1件の作成・更新 (一覧と同じ形のログ。受け取った側は行を差し替える)
+#     log.deleted {"ids": [...]}   削除
+#     log.changed {"ids": [...]}   一括更新 (該当する行を表示していれば読み直す)
+#     logs.reset  {}               通知を取りこぼした (読み直す)
+# - 購読はプロセス内 (broker) なので、届くのは同じプロセスで処理された変更だけ。ワーカーが複数のプロセスに
+#   分かれる構成では、イベントの配信を1つのプロセス (ASGI サーバーなど) にまとめる
+# - ASGI では event_stream() (非同期のジェネレーター) で、接続ごとの asyncio.Queue を待つ。
+#   同期のジェネレーターを渡すと、Django は全部を読み切ってから送るので、通知が接続を閉じるまで届かない
+# - WSGI では blocking_event_stream() で、購読中の接続がワーカーのスレッドを1つ使い続ける
+# - どちらも LOG_EVENTS_MAX_SECONDS 秒で接続を閉じ、クライアントにつなぎ直させる
+
+import asyncio
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.renderers import BaseRenderer
+
+from .sharding import db_for_user
+
+
+class Subscription:
+    # 同期のジェネレーター (WSGI) 用の購読
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # 読み出しが追いつかない購読者には、たまった通知の代わりに読み直しを指示する
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait((event[0], 'logs.reset', {}))
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    # 非同期のジェネレーター (ASGI) 用の購読。購読したイベントループの asyncio.Queue に通知をためる
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        # 通知はビューを処理するスレッドから送られるので、イベントループのスレッドで追加する
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # イベントループが閉じている (接続は終わっている)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((event[0], 'logs.reset', {}))
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    # ユーザーごとの購読者に通知を配る (スレッドセーフ)
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, user_id, subscription_class=Subscription):
+        subscription = subscription_class(user_id, getattr(settings, 'LOG_EVENTS_QUEUE_SIZE', 100))
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event_type, data):
+        with self._lock:
+            event = (next(self._ids), event_type, data)
+            for subscription in self._subscribers.get(user_id, ()):
+                subscription.put(event)
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscribers.get(user_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+broker = EventBroker()
+
+
+def publish_log_event(user_id, event_type, **data):
+    # ユーザーのシャードのトランザクションがコミットされてから通知する (トランザクション外であればすぐに通知する)
+    transaction.on_commit(lambda: broker.publish(user_id, event_type, data), using=db_for_user(user_id))
+
+
+def format_event(event):
+    event_id, event_type, data = event
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+
+
+async def event_stream(user_id):
+    # ASGI で StreamingHttpResponse に渡す非同期のジェネレーター (クライアントが切断すると閉じられ、購読をやめる)
+    keepalive = getattr(settings, 'LOG_EVENTS_KEEPALIVE_SECONDS', 15)
+    deadline = time.monotonic() + getattr(settings, 'LOG_EVENTS_MAX_SECONDS', 300)
+    subscription = broker.subscribe(user_id, AsyncSubscription)
+    try:
+        yield 'retry: 3000\n\n'  # 切れたときに、つなぎ直すまでのミリ秒
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = await subscription.get(timeout=min(keepalive, remaining))
+            # 通知がない間もコメント行を送り、プロキシに接続を切られないようにする
+            yield ': keepalive\n\n' if event is None else format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def blocking_event_stream(user_id):
+    # WSGI で StreamingHttpResponse に渡すジェネレーター (レスポンスを閉じると購読をやめる)
+    keepalive = getattr(settings, 'LOG_EVENTS_KEEPALIVE_SECONDS', 15)
+    deadline = time.monotonic() + getattr(settings, 'LOG_EVENTS_MAX_SECONDS', 300)
+    subscription = broker.subscribe(user_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = subscription.get(timeout=min(keepalive, remaining))
+            yield ': keepalive\n\n' if event is None else format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Accept: text/event-stream のリクエストを受け付けるためのレンダラー
+    # ストリーム以外のレスポンス (認証エラーなど) は JSON の本文を返す
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode()
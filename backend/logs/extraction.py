@@ -0,0 +1,121 @@
+# AQUAFLUX/backend/logs/extraction.py
+# 試験紙画像からの水質データ抽出 (スキーマ指定の JSON 出力と値の検証)
+#
+# - Gemini には response_schema で出力の形 (各項目の数値と、読み取った試験パッドの色) を指定し、
+#   自由記述の JSON を手で取り出す必要をなくす
+# - 返ってきた値はここで範囲を検証し、ありえない値は捨てる
+# - 一部の項目だけ読み取れなかった場合は、パッドの色の説明だけを渡すテキストのみの
+#   問い合わせで、その項目だけを聞き直す (画像を送り直さない)
+
+import json
+
+import google.generativeai as genai
+
+PARAMETERS = ('ph', 'kh', 'gh', 'no2', 'no3', 'cl2')
+
+PARAMETER_LABELS = {
+    'ph': 'pH',
+    'kh': 'KH (炭酸塩硬度, °dH)',
+    'gh': 'GH (総硬度, °dH)',
+    'no2': 'NO2 (亜硝酸, mg/L)',
+    'no3': 'NO3 (硝酸塩, mg/L)',
+    'cl2': 'Cl2 (塩素, mg/L)',
+}
+
+# 試験紙で測れる値の範囲 (これを外れる値は読み取りの誤りとみなす)
+PARAMETER_RANGES = {
+    'ph': (0.0, 14.0),
+    'kh': (0.0, 40.0),
+    'gh': (0.0, 60.0),
+    'no2': (0.0, 20.0),
+    'no3': (0.0, 500.0),
+    'cl2': (0.0, 10.0),
+}
+
+EXTRACTION_PROMPT = (
+    "これは水質試験紙の画像です。写真から、pH、KH、GH、NO2、NO3、Cl2の値を読み取ってください。"
+    "読み取れない項目は null にしてください。"
+    "あわせて、各項目の試験パッドの色を pad_colors に短い言葉で書いてください (例: \"黄緑\", \"薄いピンク\")。"
+)
+
+
+def response_schema(keys=PARAMETERS, with_colors=True):
+    properties = {
+        key: {'type': 'number', 'nullable': True, 'description': PARAMETER_LABELS[key]}
+        for key in keys
+    }
+    if with_colors:
+        properties['pad_colors'] = {
+            'type': 'object',
+            'nullable': True,
+            'properties': {key: {'type': 'string', 'nullable': True} for key in keys},
+        }
+    return {'type': 'object', 'properties': properties}
+
+
+def generation_config(keys=PARAMETERS, with_colors=True):
+    return genai.GenerationConfig(
+        response_mime_type='application/json',
+        response_schema=response_schema(keys, with_colors),
+        temperature=0,
+    )
+
+
+def follow_up_prompt(pad_colors):
+    lines = [f"- {PARAMETER_LABELS[key]}: {color}" for key, color in pad_colors.items()]
+    return (
+        "水質試験紙の試験パッドの色から、各項目の値を一般的な試験紙の比色表に基づいて推定してください。"
+        "推定できない項目は null にしてください。\n" + "\n".join(lines)
+    )
+
+
+def parse_model_json(text):
+    # スキーマ指定の応答はそのまま JSON として読める。念のためコードブロックで囲まれた応答も受け付ける
+    text = (text or '').strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        if text.startswith('json'):
+            text = text[4:].strip()
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError('JSON object expected')
+    return data
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def clean_water_data(data):
+    # 範囲内の値だけを残す。範囲外・数値でない値は rejected として返す
+    # 既知の項目以外 (モデルが追加で返した項目) は数値であればそのまま残す
+    water_data, rejected = {}, {}
+    for key, value in data.items():
+        if key == 'pad_colors' or value is None:
+            continue
+        number = _to_number(value)
+        limits = PARAMETER_RANGES.get(key)
+        if number is None or (limits and not limits[0] <= number <= limits[1]):
+            rejected[key] = value
+            continue
+        water_data[key] = number
+    return water_data, rejected
+
+
+def missing_with_colors(water_data, data):
+    # 値が読み取れなかったが、パッドの色は分かっている項目
+    pad_colors = data.get('pad_colors') or {}
+    return {
+        key: pad_colors[key]
+        for key in PARAMETERS
+        if key not in water_data and isinstance(pad_colors.get(key), str) and pad_colors[key].strip()
+    }
@@ -0,0 +1,72 @@
+# AQUAFLUX/backend/logs/imagehash.py
+# 試験紙写真の知覚ハッシュ (dHash)
+#
+# 同じ試験紙を撮り直した写真はバイト列が毎回異なるが、縮小したグレースケール画像の
+# 隣り合う画素の明暗関係はほとんど変わらない。dHash はこれを 64 ビットに詰めたもので、
+# 2枚の写真の近さをハミング距離 (異なるビットの数) で比べられる。
+# ただし dHash は明暗しか見ないので、パッドの並びが同じで色だけ違う試験紙 (= 別の測定結果) を
+# 区別できない。そこで 12x12 に縮小した各マスの平均色 (RGB) も一緒に求めて、色の差も比べる。
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8                      # 8x8 = 64 ビット
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BAND_COUNT = 4                     # 多重インデックス用に 16 ビットずつ 4 つに分割する
+BAND_BITS = HASH_BITS // BAND_COUNT
+BAND_MASK = (1 << BAND_BITS) - 1
+COLOR_GRID = 12                    # 12x12 マスの平均色 (432 バイト, 16進で 864 文字)
+
+
+def dhash(image):
+    # PIL の Image から 64 ビットの dHash (符号なし int) を求める
+    # JPEG は draft で縮小デコードされるので、フル解像度の画素を展開しない
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def color_signature(image):
+    # COLOR_GRID x COLOR_GRID マスそれぞれの平均色を 16 進文字列にする
+    small = image.convert('RGB').resize((COLOR_GRID, COLOR_GRID), Image.Resampling.BOX)
+    return np.asarray(small, dtype=np.uint8).tobytes().hex()
+
+
+def color_distance(a, b):
+    # 同じ位置のマス同士で、RGB の各チャンネルの差の最大値 (どちらかが空なら None)
+    if not a or not b or len(a) != len(b):
+        return None
+    diff = np.frombuffer(bytes.fromhex(a), dtype=np.uint8).astype(np.int16) - np.frombuffer(bytes.fromhex(b), dtype=np.uint8)
+    return int(np.abs(diff).max())
+
+
+def fingerprint_file(file):
+    # アップロードファイルから (dHash, 平均色) を求め、読み取り位置を先頭に戻す
+    # JPEG は draft で縮小デコードしたカラー画像から両方を求める
+    try:
+        with Image.open(file) as image:
+            image.draft('RGB', (HASH_SIZE * 8, HASH_SIZE * 8))
+            rgb = image.convert('RGB')
+            return dhash(rgb), color_signature(rgb)
+    finally:
+        file.seek(0)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def split_bands(value):
+    # 64 ビットのハッシュを上位から 16 ビットずつの 4 つの値に分割する
+    return [(value >> (BAND_BITS * (BAND_COUNT - 1 - i))) & BAND_MASK for i in range(BAND_COUNT)]
+
+
+def to_signed(value):
+    # BigIntegerField (符号付き 64 ビット) に保存するための変換
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
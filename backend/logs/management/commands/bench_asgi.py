@@ -0,0 +1,157 @@
+# AQUAFLUX/backend/logs/management/commands/bench_asgi.py
+# GET /api/logs/ のスループット・レイテンシ・サーバーのメモリを、WSGI (同期のビュー・スレッド) と
+# ASGI (uvicorn・非同期のビュー, aquaflux_backend/asgi_urls.py) で、同時接続数を揃えて比べる
+#   python manage.py bench_asgi --connections 1000 --duration 10
+#
+# サーバーはそれぞれ子プロセスで起動する (テスト用DBはファイルにして、子プロセスから同じDBを読む)。
+# WSGI は Django の開発サーバー (1接続1スレッド) を、待ち受けのキューだけ uvicorn と同じ長さにして使う。
+# メモリは計測中のサーバープロセスの最大RSS (/proc/<pid>/status の VmHWM)。
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import WSGIServer, run
+from django.db import connections
+from django.test import override_settings
+
+from aquaflux_backend.bench import isolated_test_database
+from logs.models import LogEntry
+from users.models import CustomUser
+from users.serializers import ClaimsTokenObtainPairSerializer
+
+BACKLOG = 2048
+
+
+class BacklogWSGIServer(WSGIServer):
+    request_queue_size = BACKLOG
+
+
+def serve_wsgi(port):
+    from django.core.wsgi import get_wsgi_application
+
+    logging.disable(logging.INFO)  # アクセスログを出さない
+    run('127.0.0.1', port, get_wsgi_application(), threading=True, server_cls=BacklogWSGIServer)
+
+
+def serve_asgi(port):
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    override_settings(ROOT_URLCONF='aquaflux_backend.asgi_urls').enable()
+    uvicorn.run(get_asgi_application(), host='127.0.0.1', port=port, log_level='warning', backlog=BACKLOG)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+
+async def wait_until_ready(url, headers, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get(url, headers=headers)
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'server at {url} did not become ready')
+
+
+async def load(url, headers, connections_count, duration):
+    # connections_count 本の接続から、duration 秒の間リクエストを送り続ける
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=connections_count, max_keepalive_connections=connections_count)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, headers=headers)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(connections_count)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compare GET /api/logs/ throughput, latency and server memory of the WSGI and ASGI deployments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='number of concurrent client connections')
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--logs', type=int, default=50, help='number of log entries owned by the user')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as tmp:
+            # 子プロセスから同じテスト用DBを開けるよう、メモリ上ではなくファイルに作る
+            connections['default'].settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+            with isolated_test_database():
+                user = CustomUser.objects.create_user(username='bench', email='bench@example.com', password='bench-pass')
+                LogEntry.objects.bulk_create(
+                    LogEntry(user=user, water_data={'ph': 7.0, 'no3': 10}) for _ in range(options['logs'])
+                )
+                access = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+                headers = {'Authorization': f'Bearer {access}'}
+                connections.close_all()  # 子プロセスに接続を引き継がない
+
+                for name, target in (('wsgi', serve_wsgi), ('asgi', serve_asgi)):
+                    port = free_port()
+                    url = f'http://127.0.0.1:{port}/api/logs/?page=1'
+                    server = context.Process(target=target, args=(port,), daemon=True)
+                    server.start()
+                    try:
+                        asyncio.run(wait_until_ready(url, headers))
+                        latencies, errors, elapsed = asyncio.run(
+                            load(url, headers, options['connections'], options['duration'])
+                        )
+                        rss = peak_rss_mb(server.pid)
+                    finally:
+                        server.terminate()
+                        server.join()
+
+                    if latencies:
+                        latencies.sort()
+                        p50 = statistics.median(latencies) * 1000
+                        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+                    else:
+                        p50 = p99 = float('nan')
+                    self.stdout.write(
+                        f'{name}  {len(latencies) / elapsed:8.1f} req/s  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms  '
+                        f'errors {errors:5d}  server peak RSS {rss:7.1f} MB  ({options["connections"]} connections)'
+                    )
@@ -0,0 +1,72 @@
+# AQUAFLUX/backend/logs/management/commands/bench_log_shards.py
+# 飼育ログの書き込みのスループットをシャード数別に計測する (シャードは一時ディレクトリの SQLite ファイル)
+#   python manage.py bench_log_shards --shards 1,2,4 --writers 8
+#
+# SQLite はファイルごとに書き込みが直列になるので、ユーザーを複数のファイルに分けるとその分だけ同時に書き込める
+
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from aquaflux_backend.bench import isolated_test_database, register_database, unregister_database
+from logs.models import LogEntry
+from logs.sharding import db_for_user
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent log entry inserts per second for different numbers of SQLite shards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='1,2,4', help='comma separated shard counts')
+        parser.add_argument('--writers', type=int, default=8, help='number of concurrent writer processes (one user each)')
+        parser.add_argument('--duration', type=float, default=3.0)
+
+    def handle(self, *args, **options):
+        for count in [int(value) for value in options['shards'].split(',')]:
+            with tempfile.TemporaryDirectory() as directory:
+                aliases = [f'bench_shard_{i}' for i in range(count)]
+                for alias in aliases:
+                    register_database(alias, test_name=os.path.join(directory, f'{alias}.sqlite3'))
+                try:
+                    with override_settings(LOG_SHARDS=aliases), isolated_test_database(aliases):
+                        rate, placement = self.measure(options['writers'], options['duration'])
+                finally:
+                    for alias in aliases:
+                        unregister_database(alias)
+            spread = ' '.join(f'{alias[len("bench_shard_"):]}:{users}' for alias, users in sorted(placement.items()))
+            self.stdout.write(f'{count} shards {rate:9.1f} inserts/s  (users per shard {spread})')
+
+    def measure(self, writers, duration):
+        # 本番の複数ワーカーと同じく、書き込み手ごとに別のプロセス (別のDB接続) にする
+        user_ids = list(range(1, writers + 1))
+        context = multiprocessing.get_context('fork')
+        counts = context.Array('q', writers)
+        start = context.Barrier(writers + 1)
+        connections.close_all()  # 接続を子プロセスに引き継がない
+
+        def write(index, user_id):
+            start.wait()
+            deadline = time.perf_counter() + duration
+            count = 0
+            while time.perf_counter() < deadline:
+                # 1件ずつ自動コミットで書き込む (API からのログ作成と同じ)
+                LogEntry.objects.create(user_id=user_id, water_data={'ph': 7.0, 'no3': 10})
+                count += 1
+            counts[index] = count
+            connections.close_all()
+
+        processes = [context.Process(target=write, args=(i, user_id)) for i, user_id in enumerate(user_ids)]
+        for process in processes:
+            process.start()
+        start.wait()
+        started = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        return sum(counts) / elapsed, Counter(db_for_user(user_id) for user_id in user_ids)
@@ -0,0 +1,134 @@
+# AQUAFLUX/backend/logs/management/commands/bench_upload.py
+# /api/logs/analyze-image/ に同時アップロードしたときのピークメモリ (RSS) を計測する
+#   python manage.py bench_upload --concurrency 50 --size 2
+#
+# 計測はモードごとに別プロセスで行う (ru_maxrss はプロセスの最大値なので、同じプロセスでは比較できない)。
+# Gemini の呼び出しはモックし、応答待ちの間に全リクエストがアップロードを保持している状態を作る。
+
+import io
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.core.handlers.wsgi import WSGIRequest
+from django.test.client import BOUNDARY, RequestFactory, encode_multipart
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.views import APIView
+
+from logs.views import ImageAnalyzeView
+
+MODES = ('legacy', 'bounded')
+
+
+class LegacyImageUploadSerializer(serializers.Serializer):
+    image = serializers.ImageField()
+
+
+class LegacyImageAnalyzeView(ImageAnalyzeView):
+    # 変更前の経路: Django 標準のアップロードハンドラー + ImageField での検証
+    serializer_class = LegacyImageUploadSerializer
+
+    def initialize_request(self, request, *args, **kwargs):
+        return APIView.initialize_request(self, request, *args, **kwargs)
+
+
+def make_jpeg(megabytes):
+    # ノイズ画像は圧縮が効かないので、目標のファイルサイズに近い JPEG が作れる
+    side = int((megabytes * 1024 * 1024 / 1.1) ** 0.5)
+    pixels = np.random.default_rng(0).integers(0, 256, size=(side, side, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def peak_rss_mb():
+    # Linux では ru_maxrss は KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Measure peak RSS of concurrent analyze-image uploads with the legacy and bounded upload handlers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--size', type=float, default=2.0, help='size of the uploaded JPEG in MB')
+        parser.add_argument('--gemini-delay', type=float, default=0.5, help='simulated Gemini latency in seconds')
+        parser.add_argument('--mode', choices=MODES, help='run a single mode in this process (used internally)')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.run_mode(options)
+            return
+
+        for mode in MODES:
+            command = [
+                sys.executable, sys.argv[0], 'bench_upload', '--mode', mode,
+                '--concurrency', str(options['concurrency']),
+                '--size', str(options['size']),
+                '--gemini-delay', str(options['gemini_delay']),
+            ]
+            result = subprocess.run(command, capture_output=True, text=True, check=True)
+            self.stdout.write(result.stdout.strip())
+
+    def run_mode(self, options):
+        view = (LegacyImageAnalyzeView if options['mode'] == 'legacy' else ImageAnalyzeView).as_view()
+
+        # 全リクエストで同じ本文のバイト列を共有し、クライアント側のコピーを計測に含めない
+        jpeg = make_jpeg(options['size'])
+        body = encode_multipart(BOUNDARY, {'image': _NamedBytesIO(jpeg, 'strip.jpg')})
+        del jpeg
+        factory = RequestFactory()
+
+        def make_request():
+            environ = factory._base_environ(
+                PATH_INFO='/api/logs/analyze-image/',
+                REQUEST_METHOD='POST',
+                CONTENT_TYPE=f'multipart/form-data; boundary={BOUNDARY}',
+                CONTENT_LENGTH=str(len(body)),
+            )
+            environ['wsgi.input'] = io.BytesIO(body)
+            return WSGIRequest(environ)
+
+        def slow_generate_content(*args, **kwargs):
+            time.sleep(options['gemini_delay'])
+            return MagicMock(text='{"ph": 7.0}')
+
+        statuses = []
+        start = threading.Barrier(options['concurrency'])
+
+        def upload():
+            request = make_request()
+            start.wait()
+            response = view(request)
+            statuses.append(response.status_code)
+
+        baseline = peak_rss_mb()
+        with patch.dict(os.environ, {'GEMINI_API_KEY': 'bench'}), \
+                patch('google.generativeai.GenerativeModel.generate_content', side_effect=slow_generate_content):
+            threads = [threading.Thread(target=upload) for _ in range(options['concurrency'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        assert statuses == [200] * options['concurrency'], statuses
+        peak = peak_rss_mb()
+        self.stdout.write(
+            f"{options['mode']:8s} peak RSS {peak:7.1f} MB  (+{peak - baseline:6.1f} MB over baseline, "
+            f"{options['concurrency']} x {len(body) / 1024 / 1024:.1f} MB uploads in {elapsed:.2f}s)"
+        )
+
+
+class _NamedBytesIO(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
@@ -0,0 +1,96 @@
+# AQUAFLUX/backend/logs/management/commands/bench_upstream_limit.py
+# 上流 (Gemini) の上限を超えるバーストを流したときの成功数と 429 の数を比較する
+#   python manage.py bench_upstream_limit --clients 60 --upstream-rate 20
+#
+# 上流は「1秒あたり upstream-rate 回まで受け付け、それを超えると 429」を返すものとして模擬する。
+#   legacy : 流量制御なし。429 なら固定の遅延で再試行する (変更前の ImageAnalyzeView と同じ)
+#   limited: UpstreamLimiter で上流のレートに合わせて呼び出す
+# 時間は縮めて計測する (固定遅延 2 秒 -> 2 / upstream-rate 秒)。
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.exceptions import Throttled
+
+from logs.ratelimit import TokenBucket, UpstreamLimiter
+
+
+class SimulatedUpstream:
+    def __init__(self, rate, latency):
+        self.bucket = TokenBucket(rate, capacity=2)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+            now = time.monotonic()
+            accepted = self.bucket.wait_time(now) == 0
+            if accepted:
+                self.bucket.reserve(now)
+            else:
+                self.rejected += 1
+        time.sleep(self.latency)
+        return accepted
+
+
+class Command(BaseCommand):
+    help = 'Compare fixed-delay retries against the upstream token-bucket limiter under a burst.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=60, help='number of concurrent requests in the burst')
+        parser.add_argument('--upstream-rate', type=float, default=20.0, help='requests per second accepted upstream')
+        parser.add_argument('--latency', type=float, default=0.02, help='simulated upstream latency in seconds')
+        parser.add_argument('--retries', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rate = options['upstream_rate']
+        retry_delay = 2 / rate
+
+        def legacy(upstream, user_id):
+            for attempt in range(options['retries']):
+                if upstream.call():
+                    return 'ok'
+                if attempt < options['retries'] - 1:
+                    time.sleep(retry_delay)
+            return 'failed'
+
+        limiter = UpstreamLimiter(
+            rate=rate, burst=1, user_rate=rate, user_burst=options['retries'],
+            max_queue=options['clients'], max_wait=options['clients'] / rate + 1,
+        )
+
+        def limited(upstream, user_id):
+            for attempt in range(options['retries']):
+                try:
+                    limiter.acquire(user_id)
+                except Throttled:
+                    return 'throttled'
+                if upstream.call():
+                    return 'ok'
+                limiter.backoff(retry_delay)
+            return 'failed'
+
+        for name, strategy in (('legacy', legacy), ('limited', limited)):
+            upstream = SimulatedUpstream(rate, options['latency'])
+            outcomes = []
+            threads = [
+                threading.Thread(target=lambda i=i: outcomes.append(strategy(upstream, i)))
+                for i in range(options['clients'])
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            ok = outcomes.count('ok')
+            self.stdout.write(
+                f'{name:8s} ok {ok:4d}/{len(outcomes)}  failed {outcomes.count("failed"):4d}  '
+                f'throttled {outcomes.count("throttled"):4d}  upstream calls {upstream.calls:4d} '
+                f'(429: {upstream.rejected:4d})  {ok / elapsed:6.1f} ok/s in {elapsed:.2f}s'
+            )
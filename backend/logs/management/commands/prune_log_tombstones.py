@@ -0,0 +1,23 @@
+# AQUAFLUX/backend/logs/management/commands/prune_log_tombstones.py
+# 保持期間を過ぎた削除記録を削除する (cron などで定期実行する想定)
+#   python manage.py prune_log_tombstones
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from logs.models import LogEntryTombstone
+from logs.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Delete log tombstones older than LOG_TOMBSTONE_RETENTION_DAYS.'
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(days=settings.LOG_TOMBSTONE_RETENTION_DAYS)
+        deleted = 0
+        for alias in shard_aliases():
+            deleted += LogEntryTombstone.objects.using(alias).filter(deleted_at__lt=threshold).delete()[0]
+        self.stdout.write(f'{deleted} tombstones deleted')
@@ -0,0 +1,45 @@
+# AQUAFLUX/backend/logs/management/commands/rebalance_log_shards.py
+# LOG_SHARDS を変更した後、ハッシュで決まるシャードとは別のDBにあるユーザーのデータを移す
+#   python manage.py rebalance_log_shards --dry-run
+#   python manage.py rebalance_log_shards --user 42
+#
+# 移動中のユーザーのデータは移動が終わるまで読めないので、シャードを追加した直後 (アクセスの少ない時間) に実行する
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from logs.sharding import db_for_user, move_user_data, shard_aliases, users_on_shard
+
+
+class Command(BaseCommand):
+    help = 'Move per-user log data to the shard chosen by the current LOG_SHARDS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the users that would be moved')
+        parser.add_argument('--user', type=int, action='append', dest='users', help='move only this user (repeatable)')
+        parser.add_argument('--source', action='append', dest='sources', help='database aliases to scan (default: LOG_SHARDS)')
+
+    def handle(self, *args, **options):
+        sources = options['sources'] or shard_aliases()
+        unknown = set(sources) - set(connections)
+        if unknown:
+            raise CommandError(f'unknown database: {", ".join(sorted(unknown))}')
+
+        moved_users = 0
+        for source in sources:
+            user_ids = users_on_shard(source)
+            if options['users']:
+                user_ids &= set(options['users'])
+            for user_id in sorted(user_ids):
+                target = db_for_user(user_id)
+                if target == source:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'user {user_id}: {source} -> {target}')
+                else:
+                    moved = move_user_data(user_id, source, target)
+                    counts = ', '.join(f'{label}={count}' for label, count in moved.items() if count)
+                    self.stdout.write(f'user {user_id}: {source} -> {target} ({counts or "no rows"})')
+                moved_users += 1
+        verb = 'would be moved' if options['dry_run'] else 'moved'
+        self.stdout.write(f'{moved_users} users {verb}')
@@ -0,0 +1,28 @@
+# AQUAFLUX/backend/logs/management/commands/sync_sqlite_replicas.py
+# SQLite の主DBの内容を、ファイルのレプリカ (LOG_REPLICAS) にコピーする (手元でレプリカを試すため)
+#   python manage.py sync_sqlite_replicas
+#
+# 本番の PostgreSQL などのレプリカは、DBのレプリケーションで複製する (このコマンドは何もしない)
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from logs.replicas import replica_map
+
+
+class Command(BaseCommand):
+    help = 'Copy each SQLite primary database into its SQLite replicas with the online backup API.'
+
+    def handle(self, *args, **options):
+        for primary, replicas in replica_map().items():
+            source = connections[primary]
+            for alias in replicas:
+                target = connections[alias]
+                if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+                    self.stdout.write(f'{primary} -> {alias}: skipped (not SQLite)')
+                    continue
+                source.ensure_connection()
+                target.ensure_connection()
+                # 主DBへの書き込みを止めずに、ページ単位でコピーする
+                source.connection.backup(target.connection)
+                self.stdout.write(f'{primary} -> {alias}: copied')
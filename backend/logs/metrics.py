@@ -0,0 +1,54 @@
+# AQUAFLUX/backend/logs/metrics.py
+# プロセス内のメトリクス (カウンター・ゲージ・観測値の集計)
+# 管理者向けの /api/logs/metrics/ から現在値を確認できる。プロセスごとの値なので、
+# 複数ワーカーで動かす場合はワーカーごとの値になる。
+
+import threading
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        # 件数・合計・最大値だけを保持する (平均は snapshot で計算する)
+        with self._lock:
+            stats = self._observations.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['sum'] += value
+            stats['max'] = max(stats['max'], value)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'observations': {
+                    name: {**stats, 'avg': stats['sum'] / stats['count'] if stats['count'] else 0.0}
+                    for name, stats in self._observations.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._observations.clear()
+
+
+metrics = MetricsRegistry()
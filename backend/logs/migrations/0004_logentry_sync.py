@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-19 11:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0003_remove_logentry_ammonia_remove_logentry_gh_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogEntryTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': '削除済み飼育ログ',
+                'verbose_name_plural': '削除済み飼育ログ',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['user', 'updated_at'], name='logentry_user_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='logentrytombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='logentrytombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ),
+    ]
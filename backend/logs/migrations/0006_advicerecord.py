@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-19 11:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0005_logentry_user_date_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdviceRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('advice', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('log_entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='advice_records', to='logs.logentry')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='advice_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'AIアドバイス',
+                'verbose_name_plural': 'AIアドバイス',
+                'indexes': [models.Index(fields=['log_entry', '-created_at'], name='advice_log_created_idx')],
+            },
+        ),
+    ]
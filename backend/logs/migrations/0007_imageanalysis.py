@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-19 11:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0006_advicerecord'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phash', models.BigIntegerField()),
+                ('phash_band0', models.PositiveIntegerField()),
+                ('phash_band1', models.PositiveIntegerField()),
+                ('phash_band2', models.PositiveIntegerField()),
+                ('phash_band3', models.PositiveIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('water_data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_analyses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '画像解析結果',
+                'verbose_name_plural': '画像解析結果',
+                'indexes': [models.Index(fields=['user', 'phash_band0', 'created_at'], name='imageanalysis_band0_idx'), models.Index(fields=['user', 'phash_band1', 'created_at'], name='imageanalysis_band1_idx'), models.Index(fields=['user', 'phash_band2', 'created_at'], name='imageanalysis_band2_idx'), models.Index(fields=['user', 'phash_band3', 'created_at'], name='imageanalysis_band3_idx'), models.Index(fields=['user', 'created_at'], name='imageanalysis_user_created_idx')],
+            },
+        ),
+    ]
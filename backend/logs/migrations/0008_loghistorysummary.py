@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0007_imageanalysis'),
+        ('users', '0002_outstandingrefreshtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogHistorySummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='log_history_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('log_count', models.PositiveIntegerField(default=0)),
+                ('first_date', models.DateField(blank=True, null=True)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('parameters', models.JSONField(default=dict)),
+                ('stale', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '飼育ログ履歴の要約',
+                'verbose_name_plural': '飼育ログ履歴の要約',
+            },
+        ),
+    ]
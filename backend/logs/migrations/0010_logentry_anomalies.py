@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0009_logentry_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logentry',
+            name='anomalies',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
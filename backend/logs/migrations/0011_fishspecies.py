@@ -0,0 +1,47 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0010_logentry_anomalies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FishSpecies',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('tank_type', models.CharField(choices=[('freshwater', '淡水'), ('saltwater', '海水')], default='freshwater', max_length=20)),
+                ('ideal_ranges', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'verbose_name': '魚の種類',
+                'verbose_name_plural': '魚の種類',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='species',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='log_entries', to='logs.fishspecies'),
+        ),
+        migrations.CreateModel(
+            name='FishSpeciesAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100)),
+                ('normalized', models.CharField(max_length=100, unique=True)),
+                ('species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='logs.fishspecies')),
+            ],
+            options={
+                'verbose_name': '魚の種類の別名',
+                'verbose_name_plural': '魚の種類の別名',
+            },
+        ),
+    ]
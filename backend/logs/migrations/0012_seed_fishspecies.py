@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:15
+
+from django.db import migrations
+
+from logs.species import SPECIES, SpeciesTrie, normalize
+
+
+def seed_species(apps, schema_editor):
+    FishSpecies = apps.get_model('logs', 'FishSpecies')
+    FishSpeciesAlias = apps.get_model('logs', 'FishSpeciesAlias')
+    LogEntry = apps.get_model('logs', 'LogEntry')
+
+    catalog = []
+    for item in SPECIES:
+        species, _ = FishSpecies.objects.get_or_create(
+            slug=item['slug'],
+            defaults={'name': item['name'], 'tank_type': item['tank_type'],
+                      'ideal_ranges': {key: list(limits) for key, limits in item['ideal_ranges'].items()}},
+        )
+        for alias in item['aliases']:
+            FishSpeciesAlias.objects.get_or_create(normalized=normalize(alias), defaults={'species': species, 'alias': alias})
+        catalog.append({'id': species.id, 'slug': species.slug, 'name': species.name, 'tank_type': species.tank_type,
+                        'aliases': item['aliases']})
+
+    # 既存のログの魚の種類 (自由入力) を、表記ごとに1回だけ照合して対応づける
+    trie = SpeciesTrie(catalog)
+    fish_types = LogEntry.objects.filter(species__isnull=True).exclude(fish_type__isnull=True).exclude(fish_type='')
+    for fish_type in fish_types.values_list('fish_type', flat=True).distinct().order_by():
+        species = trie.match(fish_type)
+        if species is not None:
+            LogEntry.objects.filter(species__isnull=True, fish_type=fish_type).update(species_id=species['id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0011_fishspecies'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_species, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0012_seed_fishspecies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('tank_type', models.CharField(choices=[('freshwater', '淡水'), ('saltwater', '海水')], default='freshwater', max_length=20)),
+                ('fish_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('species', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tanks', to='logs.fishspecies')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tanks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '水槽',
+                'verbose_name_plural': '水槽',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TankHistorySummary',
+            fields=[
+                ('log_count', models.PositiveIntegerField(default=0)),
+                ('first_date', models.DateField(blank=True, null=True)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('parameters', models.JSONField(default=dict)),
+                ('stale', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tank', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='history_summary', serialize=False, to='logs.tank')),
+            ],
+            options={
+                'verbose_name': '水槽ごとの飼育ログ履歴の要約',
+                'verbose_name_plural': '水槽ごとの飼育ログ履歴の要約',
+            },
+        ),
+        migrations.AddField(
+            model_name='logentry',
+            name='tank',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='log_entries', to='logs.tank'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['tank', 'log_date', 'id'], name='logentry_tank_date_idx'),
+        ),
+    ]
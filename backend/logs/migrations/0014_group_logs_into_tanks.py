@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:20
+
+import unicodedata
+
+from django.db import migrations
+from django.db.models import Count, Q
+
+TANK_TYPE_LABELS = {'freshwater': '淡水', 'saltwater': '海水'}
+
+# 表記ゆれを揃える処理 (logs/species.py の normalize() の作成時点の写し)
+# あとで normalize() が変わっても、このマイグレーションのまとめ方は変わらないようにここに固定する
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+_IGNORED = str.maketrans('', '', ' ・-_')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '').lower().translate(_IGNORED)
+    return text.translate(_KATAKANA_TO_HIRAGANA)
+
+
+def group_logs_into_tanks(apps, schema_editor):
+    # 既存のログを (ユーザー, 水槽の種類, 魚の種類) ごとに1つの水槽にまとめる
+    # 魚の種類は、辞書の種類 (0012 で表記の違いを同じ種類に対応づけ済み) があればそれで、
+    # なければ normalize() した表記でまとめる ('neon tetra' と 'ネオンテトラ' は同じ水槽になる)
+    Tank = apps.get_model('logs', 'Tank')
+    LogEntry = apps.get_model('logs', 'LogEntry')
+    db_alias = schema_editor.connection.alias  # シャードごとに実行される (logs/sharding.py)
+
+    rows = (
+        LogEntry.objects.using(db_alias).filter(tank__isnull=True)
+        .values_list('user_id', 'tank_type', 'species_id', 'fish_type')
+        .annotate(count=Count('id'))
+        .order_by('user_id', 'tank_type', 'species_id', 'fish_type')
+    )
+    groups = {}
+    for user_id, tank_type, species_id, fish_type, count in rows:
+        key = (user_id, tank_type, species_id if species_id is not None else normalize(fish_type))
+        groups.setdefault(key, []).append((fish_type, count))
+
+    for (user_id, tank_type, species_key), fish_types in groups.items():
+        logs = LogEntry.objects.using(db_alias).filter(tank__isnull=True, user_id=user_id, tank_type=tank_type)
+        if isinstance(species_key, int):
+            species_id = species_key
+            logs = logs.filter(species_id=species_id)
+        else:
+            species_id = None
+            spellings = Q(fish_type__in=[fish_type for fish_type, _ in fish_types if fish_type is not None])
+            if any(fish_type is None for fish_type, _ in fish_types):
+                spellings |= Q(fish_type__isnull=True)
+            logs = logs.filter(spellings, species__isnull=True)
+        # 水槽の名前と魚の種類には、一番多く使われている表記を使う
+        fish_type = max(fish_types, key=lambda item: item[1])[0]
+        name = f"{fish_type or '魚'}の水槽 ({TANK_TYPE_LABELS.get(tank_type, tank_type)})"
+        tank = Tank.objects.using(db_alias).create(
+            user_id=user_id, name=name[:100], tank_type=tank_type, fish_type=fish_type, species_id=species_id,
+        )
+        logs.update(tank=tank)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0013_tank'),
+    ]
+
+    operations = [
+        migrations.RunPython(group_logs_into_tanks, migrations.RunPython.noop, hints={'model_name': 'logentry'}),
+    ]
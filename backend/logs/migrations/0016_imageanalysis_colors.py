@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0015_shard_cross_db_relations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageanalysis',
+            name='colors',
+            field=models.CharField(blank=True, default='', max_length=864),
+        ),
+    ]
@@ -1,10 +1,14 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from .sharding import UserShardQuerySet
 
 class LogEntry(models.Model):
     # どのユーザーのログかを示すフィールド (CustomUserと紐付け)
     # ユーザーが削除されたら、関連するログも一緒に削除されるように設定 (on_delete=models.CASCADE)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='log_entries')
+    # ログはユーザーとは別のDBに置くことがあるので、DBの外部キー制約は付けない (logs/sharding.py)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='log_entries', db_constraint=False)
 
     # ログを記録した日付
     log_date = models.DateField(auto_now_add=True) # 作成時に自動的に日付が入力される
@@ -13,6 +17,11 @@ class LogEntry(models.Model):
 
     # 魚の種類 (オプション)
     fish_type = models.CharField(max_length=100, blank=True, null=True)
+    # 魚の種類の辞書の項目 (fish_type の表記ゆれをまとめたもの。種類ごとの集計・絞り込みに使う)
+    species = models.ForeignKey('FishSpecies', on_delete=models.SET_NULL, blank=True, null=True, related_name='log_entries', db_constraint=False)
+
+    # どの水槽のログか (水槽の種類・魚の種類は記録時点の値をログにも残す)
+    tank = models.ForeignKey('Tank', on_delete=models.SET_NULL, blank=True, null=True, related_name='log_entries')
 
     # 水槽の種類 (淡水/海水など)
     TANK_TYPE_CHOICES = [
@@ -28,15 +37,228 @@ class LogEntry(models.Model):
     # 自由記述のメモ
     notes = models.TextField(blank=True, null=True)
 
+    # 保存時に検知した水質の異常 (安全な範囲外の値や、いつもの値からの大きな変化。logs/anomaly.py を参照)
+    anomalies = models.JSONField(default=list, blank=True)
+
     # ログの最終更新日時
     updated_at = models.DateTimeField(auto_now=True) # 更新時に自動的に日時が更新される
 
+    objects = UserShardQuerySet.as_manager()
+
     class Meta:
         # データベースでのテーブル名やソート順などを設定します
         verbose_name = '飼育ログ' # 管理サイトでの表示名
         verbose_name_plural = '飼育ログ' # 管理サイトでの複数形表示名
         ordering = ['-log_date', '-id'] # デフォルトのソート順 (新しい日付のログが上に来るように)
+        indexes = [
+            # ユーザーごとの一覧 (日付の新しい順) をインデックス順に読み出してページングする
+            models.Index(fields=['user', '-log_date', '-id'], name='logentry_user_date_idx'),
+            # 差分同期 (updated_at > カーソル) をユーザー単位のインデックス範囲走査で済ませる
+            models.Index(fields=['user', 'updated_at'], name='logentry_user_updated_idx'),
+            # 管理サイトの日付での絞り込み (date_hierarchy) と全ユーザー横断の日付順の一覧
+            models.Index(fields=['log_date', 'id'], name='logentry_date_idx'),
+            # 水槽ごとの一覧・最新のログ・傾向を、その水槽のログだけのインデックス範囲で読む
+            models.Index(fields=['tank', 'log_date', 'id'], name='logentry_tank_date_idx'),
+        ]
 
     def __str__(self):
         # オブジェクトが文字列として表示されるときの形式
         return f"{self.user.username} - {self.log_date} のログ"
+
+
+
+# 魚の種類の辞書
+class FishSpecies(models.Model):
+    slug = models.SlugField(max_length=50, unique=True)
+    name = models.CharField(max_length=100)  # 表示名
+    tank_type = models.CharField(max_length=20, choices=LogEntry.TANK_TYPE_CHOICES, default='freshwater')
+    # 適した水質の範囲 {"ph": [6.0, 7.5], ...}
+    ideal_ranges = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        verbose_name = '魚の種類'
+        verbose_name_plural = '魚の種類'
+        ordering = ['name']
+
+    def save(self, *args, **kwargs):
+        from .species import invalidate_trie
+        super().save(*args, **kwargs)
+        invalidate_trie()
+
+    def delete(self, *args, **kwargs):
+        from .species import invalidate_trie
+        result = super().delete(*args, **kwargs)
+        invalidate_trie()
+        return result
+
+    def __str__(self):
+        return self.name
+
+
+# 水槽 (ユーザーは複数の水槽を持てる)
+class Tank(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tanks', db_constraint=False)
+    name = models.CharField(max_length=100)
+    tank_type = models.CharField(max_length=20, choices=LogEntry.TANK_TYPE_CHOICES, default='freshwater')
+    # 主な魚の種類 (自由入力と、辞書の項目)
+    fish_type = models.CharField(max_length=100, blank=True, null=True)
+    species = models.ForeignKey(FishSpecies, on_delete=models.SET_NULL, blank=True, null=True, related_name='tanks', db_constraint=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = UserShardQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '水槽'
+        verbose_name_plural = '水槽'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.user_id} - {self.name}"
+
+
+# 魚の種類の別名 (カタカナ・ひらがな・漢字・ローマ字など)
+class FishSpeciesAlias(models.Model):
+    species = models.ForeignKey(FishSpecies, on_delete=models.CASCADE, related_name='aliases')
+    alias = models.CharField(max_length=100)
+    # 表記ゆれを揃えた形 (logs.species.normalize)。一意なので同じ別名を複数の種類に登録できない
+    normalized = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        verbose_name = '魚の種類の別名'
+        verbose_name_plural = '魚の種類の別名'
+
+    def save(self, *args, **kwargs):
+        from .species import invalidate_trie, normalize
+        self.normalized = normalize(self.alias)
+        super().save(*args, **kwargs)
+        invalidate_trie()
+
+    def delete(self, *args, **kwargs):
+        from .species import invalidate_trie
+        result = super().delete(*args, **kwargs)
+        invalidate_trie()
+        return result
+
+    def __str__(self):
+        return f"{self.alias} ({self.species_id})"
+
+
+
+# 削除された飼育ログの記録 (差分同期でクライアントに削除を伝えるため)
+class LogEntryTombstone(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='log_tombstones', db_constraint=False)
+    # 削除されたログのID (ログ本体はもう存在しないので外部キーにはしない)
+    log_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    objects = UserShardQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '削除済み飼育ログ'
+        verbose_name_plural = '削除済み飼育ログ'
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.log_id} ({self.deleted_at})"
+
+
+
+# 生成したAIアドバイスの保存 (ダッシュボードで再利用し、同じログに対する再生成を避ける)
+class AdviceRecord(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='advice_records', db_constraint=False)
+    # どのログに対するアドバイスか (フォームの入力値から生成した場合は NULL)
+    log_entry = models.ForeignKey(LogEntry, on_delete=models.CASCADE, related_name='advice_records', blank=True, null=True)
+    advice = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = UserShardQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'AIアドバイス'
+        verbose_name_plural = 'AIアドバイス'
+        indexes = [
+            # ログごとの最新アドバイスをインデックスだけで引く
+            models.Index(fields=['log_entry', '-created_at'], name='advice_log_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.log_entry_id} ({self.created_at})"
+
+
+
+# 試験紙写真の解析結果 (ほぼ同じ写真が再送されたときに Gemini を呼ばずに結果を再利用する)
+class ImageAnalysis(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='image_analyses', db_constraint=False)
+    # 知覚ハッシュ (dHash, 64ビット) と、それを16ビットずつに分けた値
+    # 距離が3以下なら4つのうち少なくとも1つは完全一致するので、各部分の一致をインデックスで引いて候補を絞る
+    phash = models.BigIntegerField()
+    phash_band0 = models.PositiveIntegerField()
+    phash_band1 = models.PositiveIntegerField()
+    phash_band2 = models.PositiveIntegerField()
+    phash_band3 = models.PositiveIntegerField()
+    # 12x12 マスの平均色 (imagehash.color_signature)。dHash は明暗しか見ないので、色違いの試験紙を区別するのに使う
+    colors = models.CharField(max_length=864, blank=True, default='')
+    # アップロードされたファイルそのもののハッシュ
+    sha256 = models.CharField(max_length=64)
+    water_data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = UserShardQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '画像解析結果'
+        verbose_name_plural = '画像解析結果'
+        indexes = [
+            models.Index(fields=['user', 'phash_band0', 'created_at'], name='imageanalysis_band0_idx'),
+            models.Index(fields=['user', 'phash_band1', 'created_at'], name='imageanalysis_band1_idx'),
+            models.Index(fields=['user', 'phash_band2', 'created_at'], name='imageanalysis_band2_idx'),
+            models.Index(fields=['user', 'phash_band3', 'created_at'], name='imageanalysis_band3_idx'),
+            models.Index(fields=['user', 'created_at'], name='imageanalysis_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.sha256[:12]} ({self.created_at})"
+
+
+
+# 飼育ログ履歴の要約 (AIアドバイスのプロンプトに古い履歴の傾向を少ないトークンで含めるため)
+# ログの作成時に差分で更新し、更新・削除されたときは stale にして次に使うときに作り直す
+class HistorySummary(models.Model):
+    log_count = models.PositiveIntegerField(default=0)
+    first_date = models.DateField(blank=True, null=True)
+    last_date = models.DateField(blank=True, null=True)
+    # 項目ごとの集計 {"ph": {"count", "sum", "min", "max", "first": [日付, 値], "last": [日付, 値]}, ...}
+    parameters = models.JSONField(default=dict)
+    stale = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+
+# ユーザーごとの要約 (全ての水槽のログ)
+class LogHistorySummary(HistorySummary):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='log_history_summary', db_constraint=False)
+
+    objects = UserShardQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = '飼育ログ履歴の要約'
+        verbose_name_plural = '飼育ログ履歴の要約'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.log_count}件"
+
+
+# 水槽ごとの要約
+class TankHistorySummary(HistorySummary):
+    tank = models.OneToOneField(Tank, on_delete=models.CASCADE, primary_key=True, related_name='history_summary')
+
+    class Meta:
+        verbose_name = '水槽ごとの飼育ログ履歴の要約'
+        verbose_name_plural = '水槽ごとの飼育ログ履歴の要約'
+
+    def __str__(self):
+        return f"{self.tank_id} - {self.log_count}件"
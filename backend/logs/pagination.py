@@ -0,0 +1,35 @@
+# AQUAFLUX/backend/logs/pagination.py
+
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+
+
+# 飼育ログ一覧のページネーション
+# ?page= が指定された場合だけページ単位で返す (指定がなければ従来通り全件のリストを返す)
+class LogEntryPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # 非同期のビュー用。件数とページの行を非同期のORMで読む (それ以外は paginate_queryset と同じ)
+        if self.page_query_param not in request.query_params:
+            return None
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        paginator.count = await queryset.acount()  # Paginator.count (cached_property) を先に埋めておく
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
@@ -0,0 +1,203 @@
+# AQUAFLUX/backend/logs/ratelimit.py
+# 上流 (Gemini) 呼び出しの流量制御 (トークンバケット + 待ち行列の上限)
+#
+# アクセスが集中したときに全ワーカーが一斉に Gemini を呼ぶと 429 が返り、再試行がさらに
+# 負荷を増やす。ここでは呼び出しの前に
+#   - 全体のバケットと、ユーザーごとのバケットの両方からトークンを予約し
+#   - トークンが足りなければ、使えるようになる時刻まで待つ (予約制なので待っている呼び出しは
+#     上限のレートちょうどの間隔で順番に流れる)
+#   - 待っている呼び出しの数が上限に達している、または待ち時間が上限を超える場合は待たずに
+#     Throttled (429 + Retry-After) を返す
+# ことで、上流の上限いっぱいのスループットを保ちつつ、再試行の嵐を防ぐ。
+#
+# バケットは既定ではプロセスごとなので、ワーカーが N 個あれば全体ではレートも N 倍になる。
+# settings.GEMINI_RATE_LIMIT_STATE_FILE を設定すると、全体のバケットの状態をそのファイルに置き、
+# 排他ロック (fcntl.flock) をかけて読み書きするので、同じホストの全ワーカーで1つのバケットを共有する。
+# ユーザーごとのバケットと待ち行列の上限は、設定によらずプロセスごと。
+
+import contextlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセスごとのバケットのみ
+    fcntl = None
+
+
+class TokenBucket:
+    # rate: 1秒あたりに補充されるトークン数, capacity: 貯めておけるトークン数 (バースト)
+    # トークンは負の値まで予約できる (負の分は将来の補充で返済される)
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        # 1トークンを予約した場合に待つ必要がある秒数
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self, now, seconds):
+        # 上流から 429 が返ったときに、seconds 秒分のトークンを取り上げて呼び出しを間引く
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def locked(self):
+        # 共有の状態を読み書きする区間 (プロセス内のバケットでは何もしない)
+        return contextlib.nullcontext()
+
+
+class SharedTokenBucket(TokenBucket):
+    # トークン数と更新時刻をファイルに置き、locked() の間だけ排他ロックをかけて読み書きする
+    # 時刻は time.monotonic (同じホストのプロセス間で共通) なので、共有できるのは同じホストのワーカーまで
+
+    def __init__(self, rate, capacity, path, clock=time.monotonic):
+        super().__init__(rate, capacity, clock)
+        self.path = path
+
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.path, 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state_file.seek(0)
+                try:
+                    state = json.loads(state_file.read())
+                    self.tokens, self.updated = float(state['tokens']), float(state['updated'])
+                except (ValueError, KeyError, TypeError):
+                    # 初回 (空のファイル) や壊れた内容は満タンから始める
+                    self.tokens, self.updated = self.capacity, self.clock()
+                if self.updated > self.clock():
+                    # 再起動前の時刻が残っている
+                    self.tokens, self.updated = self.capacity, self.clock()
+                yield self
+                state_file.truncate(0)
+                state_file.write(json.dumps({'tokens': self.tokens, 'updated': self.updated}))
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def reset(self):
+        with self.locked():
+            self.tokens, self.updated = self.capacity, self.clock()
+
+
+class UpstreamLimiter:
+    MAX_USER_BUCKETS = 10_000
+
+    def __init__(self, rate, burst, user_rate, user_burst, max_queue, max_wait,
+                 clock=time.monotonic, sleep=None, name='upstream', state_file=None):
+        self.rate = rate
+        self.burst = burst
+        self.state_file = state_file
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+        self.name = name
+        self.queue_depth = 0
+        self._user_buckets = {}
+        self._lock = threading.Lock()
+        self.global_bucket = self._global_bucket()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            rate=settings.GEMINI_RATE_LIMIT_PER_SECOND,
+            burst=settings.GEMINI_RATE_LIMIT_BURST,
+            user_rate=settings.GEMINI_USER_RATE_LIMIT_PER_SECOND,
+            user_burst=settings.GEMINI_USER_RATE_LIMIT_BURST,
+            max_queue=settings.GEMINI_RATE_LIMIT_MAX_QUEUE,
+            max_wait=settings.GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS,
+            state_file=getattr(settings, 'GEMINI_RATE_LIMIT_STATE_FILE', None),
+        )
+
+    def acquire(self, user_id=None):
+        # 上流を呼んでよくなるまで待つ。待てない場合は Throttled を送出する
+        with self._lock, self.global_bucket.locked():
+            now = self.clock()
+            user_bucket = self._user_bucket(user_id, now)
+            user_wait = user_bucket.wait_time(now)
+            wait = max(self.global_bucket.wait_time(now), user_wait)
+
+            if wait > 0 and (self.queue_depth >= self.max_queue or wait > self.max_wait):
+                metrics.incr(f'{self.name}.rejected')
+                if user_wait > self.max_wait:
+                    metrics.incr(f'{self.name}.rejected_user_quota')
+                raise Throttled(wait=wait)
+
+            self.global_bucket.reserve(now)
+            user_bucket.reserve(now)
+            if wait > 0:
+                self.queue_depth += 1
+                metrics.set_gauge(f'{self.name}.queue_depth', self.queue_depth)
+
+        if wait > 0:
+            try:
+                (self.sleep or time.sleep)(wait)
+            finally:
+                with self._lock:
+                    self.queue_depth -= 1
+                    metrics.set_gauge(f'{self.name}.queue_depth', self.queue_depth)
+        metrics.incr(f'{self.name}.admitted')
+        metrics.observe(f'{self.name}.wait_seconds', wait)
+        return wait
+
+    def backoff(self, seconds):
+        # 上流が 429 を返したときに呼ぶ。全体の呼び出しを seconds 秒分遅らせる
+        with self._lock, self.global_bucket.locked():
+            self.global_bucket.drain(self.clock(), seconds)
+        metrics.incr(f'{self.name}.upstream_throttled')
+
+    def _global_bucket(self):
+        if self.state_file and fcntl is not None:
+            return SharedTokenBucket(self.rate, self.burst, self.state_file, self.clock)
+        return TokenBucket(self.rate, self.burst, self.clock)
+
+    def _user_bucket(self, user_id, now):
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            if len(self._user_buckets) >= self.MAX_USER_BUCKETS:
+                # 満タンのバケットは作り直しても同じなので捨てる
+                for key in [key for key, b in self._user_buckets.items() if b.is_idle(now)]:
+                    del self._user_buckets[key]
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst, self.clock)
+        return bucket
+
+    def reset(self):
+        with self._lock:
+            self._user_buckets.clear()
+            self.global_bucket = self._global_bucket()
+            if isinstance(self.global_bucket, SharedTokenBucket):
+                self.global_bucket.reset()
+            self.queue_depth = 0
+
+
+upstream_limiter = UpstreamLimiter.from_settings()
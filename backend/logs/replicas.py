@@ -0,0 +1,104 @@
+# AQUAFLUX/backend/logs/replicas.py
+# 飼育ログの読み取りを、読み取り専用のレプリカDBに振り分ける
+#
+# - LOG_REPLICAS = {主DBの alias: [レプリカの alias, ...]} (主DBは default またはシャード)
+# - ReplicaReadMixin を付けたビューの GET などの読み取りだけをレプリカに送る。書き込みと、
+#   書き込みのリクエスト内の読み取り (異常検知用の直近のログなど) は常に主DB
+# - レプリカは少し遅れて追いつくので、書き込んだユーザーは LOG_REPLICA_STICKY_SECONDS 秒の間
+#   主DBから読む (read-your-writes)。記録は Django のキャッシュに置くので、複数のプロセスで
+#   動かす場合は CACHES に共有のキャッシュ (Redis など) を設定する
+
+import contextlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from .sharding import LogShardRouter, is_sharded
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+_shard_router = LogShardRouter()
+
+
+def replica_map():
+    return getattr(settings, 'LOG_REPLICAS', None) or {}
+
+
+def primary_for(alias):
+    # レプリカであれば、その主DBの alias
+    for primary, replicas in replica_map().items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+def _sticky_key(user_id):
+    return f'logs:primary-reads:{user_id}'
+
+
+def record_write(user_id):
+    # このユーザーの読み取りを、しばらく主DBに固定する
+    if replica_map() and user_id is not None:
+        cache.set(_sticky_key(user_id), True, getattr(settings, 'LOG_REPLICA_STICKY_SECONDS', 10))
+
+
+def reads_pinned(user_id):
+    return user_id is not None and cache.get(_sticky_key(user_id)) is not None
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    # このブロックの中の飼育ログの読み取りをレプリカに送る
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    # settings.DATABASE_ROUTERS でシャーディングのルーターより前に登録する
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or not is_sharded(model):
+            return None
+        primary = primary_for(_shard_router.db_for_read(model, **hints) or DEFAULT_DB_ALIAS)
+        replicas = replica_map().get(primary)
+        return random.choice(replicas) if replicas else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカから読んだインスタンスは、その主DBのインスタンスと同じものとして扱う
+        if obj1._state.db and obj2._state.db and primary_for(obj1._state.db) == primary_for(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカには主DBから複製されるので、マイグレーションは実行しない
+        if any(db in replicas for replicas in replica_map().values()):
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    # 読み取りのリクエストをレプリカで処理するビュー (書き込みが成功したら、そのユーザーの読み取りを主DBに固定する)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and replica_map() and not reads_pinned(request.user.id):
+            self._replica_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_token = None
+        elif request.method not in SAFE_METHODS and response.status_code < 400:
+            record_write(getattr(request.user, 'id', None))
+        return super().finalize_response(request, response, *args, **kwargs)
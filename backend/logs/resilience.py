@@ -0,0 +1,213 @@
+# AQUAFLUX/backend/logs/resilience.py
+# 上流 (Gemini) 呼び出しの再試行ポリシーとサーキットブレーカー
+#
+# - 再試行の間隔は指数バックオフ + フルジッター (0 〜 base * 2^(n-1) の一様乱数) にして、
+#   同時に失敗したリクエストが同じタイミングで再送しないようにする
+# - リクエスト全体の期限 (deadline) を決め、各試行のタイムアウトは残り時間を超えないようにする
+# - 再試行しても結果が変わらないエラー (リクエスト内容の誤り・認証エラーなど) は再試行しない
+# - 上流の失敗が続いたらサーキットを開き、しばらくは呼び出さずにすぐ失敗させる
+#
+# 時計 (clock) と待機 (sleep) は差し替えられるので、テストで実際に待つ必要はない。
+# sleep を指定しない場合は呼び出し時点の time.sleep を使う (テストでの patch('time.sleep') が効く)。
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import metrics
+
+
+class UnusableResponse(Exception):
+    # 上流は応答したが、内容が使えなかった (JSON になっていないなど)
+    # 再試行はするが、上流の障害ではないのでサーキットブレーカーの失敗には数えない
+    def __init__(self, message, raw_response=None):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__('upstream circuit is open')
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class UpstreamUnavailable(APIException):
+    # サーキットが開いている間に返すエラー (Retry-After 付きの 503)
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Gemini APIが一時的に利用できません。しばらくしてから再試行してください。'
+    default_code = 'upstream_unavailable'
+
+    def __init__(self, wait=None, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = max(1, round(wait)) if wait is not None else None
+
+
+# 再試行しても結果が変わらないエラー
+NON_RETRYABLE_ERRORS = (
+    google_exceptions.BadRequest,          # InvalidArgument, FailedPrecondition など 400 系
+    google_exceptions.Unauthorized,
+    google_exceptions.Forbidden,           # PermissionDenied
+    google_exceptions.NotFound,
+    APIException,                          # こちら側で送出したエラー (Throttled など)
+    CircuitOpenError,
+    DeadlineExceeded,
+)
+
+
+def is_retryable(error):
+    if isinstance(error, google_exceptions.TooManyRequests):
+        return True
+    return not isinstance(error, NON_RETRYABLE_ERRORS)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, name='gemini'):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def before_call(self):
+        # 呼び出してよいか判定する。開いている間は CircuitOpenError を送出する
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = self.clock() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    raise CircuitOpenError(self.reset_timeout - elapsed)
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # 半開状態では様子見の呼び出しを1つだけ通す
+                if self._trial_in_flight:
+                    raise CircuitOpenError(1.0)
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        # 上流の状態と関係ないエラーで終わった様子見の呼び出しの枠を返す
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    metrics.incr(f'circuit.{self.name}.opened')
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._trial_in_flight = False
+
+
+class Attempt:
+    def __init__(self, number, policy, deadline_at):
+        self.number = number
+        self._policy = policy
+        self._deadline_at = deadline_at
+
+    @property
+    def timeout(self):
+        # この試行で使えるタイムアウト (試行ごとの上限とリクエスト全体の残り時間の小さいほう)
+        remaining = self._deadline_at - self._policy.clock()
+        return max(0.0, min(self._policy.attempt_timeout, remaining))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=10.0, deadline=150.0, attempt_timeout=120.0,
+                 breaker=None, retryable=is_retryable, clock=time.monotonic, sleep=None, random=random.random,
+                 name='gemini'):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.breaker = breaker
+        self.retryable = retryable
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random
+        self.name = name
+
+    def backoff(self, attempt_number):
+        # フルジッター: 0 〜 min(max_delay, base * 2^(n-1)) の一様乱数
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** (attempt_number - 1))
+
+    def call(self, func, on_retry=None):
+        # func(attempt) を再試行しながら呼び、最初に成功した結果を返す
+        # 最後の試行のエラー (または期限切れの DeadlineExceeded) はそのまま送出する
+        deadline_at = self.clock() + self.deadline
+        for number in range(1, self.max_attempts + 1):
+            attempt = Attempt(number, self, deadline_at)
+            if attempt.timeout <= 0:
+                raise DeadlineExceeded(f'deadline of {self.deadline}s exceeded')
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = func(attempt)
+            except UnusableResponse as e:
+                error = e
+                if self.breaker is not None:
+                    self.breaker.record_success()
+            except Exception as e:
+                error = e
+                if self.breaker is not None:
+                    if self.retryable(e):
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.release_trial()
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
+
+            if not self.retryable(error) or number == self.max_attempts:
+                raise error
+            delay = self.backoff(number)
+            if self.clock() + delay >= deadline_at:
+                raise error
+            metrics.incr(f'retry.{self.name}.retries')
+            if on_retry is not None:
+                on_retry(number, error, delay)
+            (self.sleep or time.sleep)(delay)
+
+
+gemini_breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'GEMINI_CIRCUIT_FAILURE_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'GEMINI_CIRCUIT_RESET_SECONDS', 30.0),
+)
+
+
+def gemini_retry_policy(max_attempts, base_delay):
+    # Gemini 呼び出し用の再試行ポリシー (サーキットブレーカーは全ビューで共有する)
+    return RetryPolicy(
+        max_attempts=max_attempts,
+        base_delay=base_delay,
+        deadline=getattr(settings, 'GEMINI_REQUEST_DEADLINE_SECONDS', 150.0),
+        attempt_timeout=getattr(settings, 'GEMINI_ATTEMPT_TIMEOUT_SECONDS', 120.0),
+        breaker=gemini_breaker,
+    )
@@ -1,12 +1,23 @@
 from rest_framework import serializers
-from .models import LogEntry
+from PIL import Image
+from .models import LogEntry, AdviceRecord, Tank
+from .species import match_species
 
 
-class LogEntrySerializer(serializers.ModelSerializer):
+class UserTankFieldMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None and 'tank' in fields:
+            # 水槽はリクエストしているユーザーのシャードから探す
+            fields['tank'].queryset = Tank.objects.for_user(request.user.id)
+        return fields
+
+
+class LogEntrySerializer(UserTankFieldMixin, serializers.ModelSerializer):
     # ユーザー名を表示するための読み取り専用フィールドを追加
-    # source='user.username' で関連するユーザーオブジェクトのusernameを参照
-    # read_only=True でこのフィールドがPOST/PUT時に送られてこないようにする
-    user_username = serializers.CharField(source='user.username', read_only=True)
+    # 自分のログであればリクエストのユーザー (トークンのクレーム) から返し、ユーザーテーブルを引かない
+    user_username = serializers.SerializerMethodField()
 
     class Meta:
         model = LogEntry
@@ -14,13 +25,103 @@ class LogEntrySerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'user_username', 'log_date',
             'water_data', 
-            'fish_type', 'tank_type','notes', 'updated_at',
+            'tank', 'fish_type', 'species', 'tank_type','notes', 'anomalies', 'updated_at',
         ]
-        read_only_fields = ['user', 'log_date', 'updated_at']
+        read_only_fields = ['user', 'log_date', 'anomalies', 'updated_at']
+        extra_kwargs = {
+            'species': {'required': False, 'allow_null': True},
+            'tank': {'required': False, 'allow_null': True},
+        }
+
+    def validate(self, attrs):
+        tank = attrs.get('tank')
+        if tank is not None:
+            request = self.context.get('request')
+            if request is not None and tank.user_id != request.user.id:
+                raise serializers.ValidationError({'tank': '指定された水槽が見つかりません。'})
+            if self.instance is None:
+                # 水槽を指定して作成した場合、指定がなければ水槽の種類・魚の種類は水槽のものを記録する
+                attrs.setdefault('tank_type', tank.tank_type)
+                if 'fish_type' not in attrs and 'species' not in attrs:
+                    attrs['fish_type'] = tank.fish_type
+                    attrs['species_id'] = tank.species_id
+
+        # 魚の種類が辞書から選ばれていなければ、自由入力の fish_type から辞書の項目を探して対応づける
+        # 辞書から選ばれて fish_type が空の場合は、辞書の表示名を入れる
+        if 'species' not in attrs and 'species_id' not in attrs and 'fish_type' in attrs:
+            attrs['species_id'] = match_species(attrs['fish_type'])
+        elif attrs.get('species') is not None and not attrs.get('fish_type', getattr(self.instance, 'fish_type', None)):
+            attrs['fish_type'] = attrs['species'].name
+        return attrs
+
+    def get_user_username(self, obj):
+        request = self.context.get('request')
+        if request is not None and request.user.id == obj.user_id:
+            return request.user.username
+        return obj.user.username
      
         
-    
-    
+
+
+# 一括更新 (PATCH /api/logs/bulk/) で変更できる項目
+class LogEntryBulkUpdateSerializer(UserTankFieldMixin, serializers.ModelSerializer):
+    class Meta:
+        model = LogEntry
+        fields = ['tank', 'fish_type', 'species', 'tank_type', 'notes']
+        extra_kwargs = {
+            'species': {'required': False, 'allow_null': True},
+            'tank': {'required': False, 'allow_null': True},
+        }
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('変更する項目を指定してください。')
+        # 魚の種類は1件ずつの更新と同じく、自由入力から辞書の項目を対応づける (辞書から選ばれた場合は表示名を入れる)
+        if 'species' not in attrs and 'fish_type' in attrs:
+            attrs['species_id'] = match_species(attrs['fish_type'])
+        elif attrs.get('species') is not None and 'fish_type' not in attrs:
+            attrs['fish_type'] = attrs['species'].name
+        return attrs
+
+
+class AdviceRecordSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AdviceRecord
+        fields = ['id', 'log_entry', 'advice', 'created_at']
+
+
 # 画像アップロード用のシリアライザー
+# ImageField は検証のためにファイル全体をメモリへ読み込み直すので使わず、
+# BoundedImageUploadHandler が受信中に読み取った画像情報で検証する
 class ImageUploadSerializer(serializers.Serializer):
-    image = serializers.ImageField() # 画像ファイルを受け取るためのフィールド    
\ No newline at end of file
+    image = serializers.FileField() # 画像ファイルを受け取るためのフィールド
+
+    def validate_image(self, value):
+        image_format = getattr(value, 'image_format', None)
+        if image_format is None:
+            # 他のアップロードハンドラーを経由した場合は、ヘッダーだけを読んで判定する
+            try:
+                with Image.open(value) as image:
+                    image_format = image.format
+                    value.image_size = image.size
+            except Exception:
+                image_format = None
+            value.seek(0)
+        if image_format is None:
+            raise serializers.ValidationError('有効な画像ファイルをアップロードしてください。')
+        value.image_format = image_format
+        return value    
+
+
+class TankSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tank
+        fields = ['id', 'name', 'tank_type', 'fish_type', 'species', 'created_at']
+        read_only_fields = ['created_at']
+        extra_kwargs = {'species': {'required': False, 'allow_null': True}}
+
+    def validate(self, attrs):
+        # 魚の種類はログと同じく、自由入力から辞書の項目を対応づける
+        if 'species' not in attrs and 'fish_type' in attrs:
+            attrs['species_id'] = match_species(attrs['fish_type'])
+        return attrs
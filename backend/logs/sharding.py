@@ -0,0 +1,208 @@
+# AQUAFLUX/backend/logs/sharding.py
+# ユーザーごとの飼育ログのデータを複数のDBに分ける (シャーディング)
+#
+# - ユーザー (users アプリ)・魚の種類の辞書・認証まわりは常に default に置き、
+#   飼育ログ・水槽・削除記録・アドバイス・画像解析結果・履歴の要約を LOG_SHARDS のいずれかに置く
+# - どのシャードに置くかはユーザーIDのハッシュだけで決まる (対応表を持たないので、DBを引かずに決められる)
+#   ジャンプ・コンシステント・ハッシュを使うので、LOG_SHARDS の末尾にシャードを足したときに
+#   移動が必要になるのは、新しいシャードに割り当てられる約 1/N のユーザーだけ (rebalance_log_shards で移す)
+# - 複数のユーザーにまたがる検索はできないので、ユーザーのデータは LogEntry.objects.for_user(user_id) のように
+#   ユーザーIDを指定して読む (ルーターへのヒントになる)。インスタンスの保存・削除・関連の読み込みも、
+#   ルーターがインスタンスのユーザーIDからシャードを決める
+# - シャード側のテーブルからユーザー・魚の種類への外部キーはDBの制約を付けない (別のDBにあるため)。
+#   同じ理由で、ユーザー・魚の種類を select_related で JOIN してはいけない (シャードの同名のテーブルは空)
+# - シャードごとに主キーの採番範囲を分けておき (SHARD_ID_SPACE)、シャード間でデータを移しても主キーが変わらないようにする
+
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
+
+# シャードに置くモデル (app_label.model_name)
+SHARDED_MODELS = {
+    'logs.logentry',
+    'logs.tank',
+    'logs.logentrytombstone',
+    'logs.advicerecord',
+    'logs.imageanalysis',
+    'logs.loghistorysummary',
+    'logs.tankhistorysummary',
+}
+
+SHARD_ID_SPACE = 1 << 40  # シャードごとの主キーの範囲 (i 番目のシャードは i * SHARD_ID_SPACE から採番する)
+
+
+def shard_aliases():
+    return list(getattr(settings, 'LOG_SHARDS', None) or [DEFAULT_DB_ALIAS])
+
+
+def jump_hash(key, buckets):
+    # Lamping & Veach "A Fast, Minimal Memory, Consistent Hash Algorithm"
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_index(user_id, count=None):
+    count = count or len(shard_aliases())
+    if count == 1:
+        return 0
+    # 連番のIDが偏らないよう、IDをハッシュしてから割り当てる (プロセスごとに変わる hash() は使わない)
+    key = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+    return jump_hash(key, count)
+
+
+def db_for_user(user_id):
+    # ユーザーのデータを置くDBの alias
+    aliases = shard_aliases()
+    return aliases[shard_index(user_id, len(aliases))]
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+class UserShardQuerySet(models.QuerySet):
+    def for_user(self, user_id):
+        # ユーザーのシャードから、そのユーザーのデータだけを読む
+        # using() で固定せずルーターへのヒントにするので、読み取りはレプリカ (logs/replicas.py)、
+        # update/delete/select_for_update は主DBに振り分けられる
+        queryset = self.filter(user_id=user_id)
+        queryset._hints = {**queryset._hints, 'user_id': user_id}
+        return queryset
+
+    def create(self, **kwargs):
+        # using() で指定されていなければ、保存するインスタンスのユーザーからシャードを決める
+        # (Manager.create は Model.save と違ってルーターにインスタンスを渡さないため)
+        if self._db is None:
+            return self.using(router.db_for_write(self.model, instance=self.model(**kwargs))).create(**kwargs)
+        return super().create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        groups = defaultdict(list)
+        for obj in objs:
+            groups[router.db_for_write(self.model, instance=obj)].append(obj)
+        for alias, group in groups.items():
+            self.using(alias).bulk_create(group, *args, **kwargs)
+        return objs
+
+
+class LogShardRouter:
+    # settings.DATABASE_ROUTERS に登録する。LOG_SHARDS が default だけのときは何もしない (None を返す)
+
+    def _db_for(self, model, hints):
+        instance = hints.get('instance')
+        if shard_aliases() == [DEFAULT_DB_ALIAS]:
+            return None
+        if hints.get('user_id') is not None and is_sharded(model):
+            return db_for_user(hints['user_id'])
+        if instance is None:
+            return None
+        if not is_sharded(model):
+            # シャードのデータからたどったユーザー・魚の種類は default から読む
+            return DEFAULT_DB_ALIAS if instance._state.db not in (None, DEFAULT_DB_ALIAS) else None
+        if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+            # user.log_entries などの逆参照
+            return db_for_user(instance.pk) if instance.pk is not None else None
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is not None:
+            return db_for_user(user_id)
+        # ユーザーIDを持たないモデル (水槽ごとの要約など) は、読み込んだ元か関連先のDB
+        return instance._state.db
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # シャードのデータからユーザー・魚の種類への参照は、DBをまたいでIDで持つ
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in shard_aliases():
+            return None
+        # 追加のシャードにも全てのテーブルを作る (過去のマイグレーションの外部キーが参照するため。中身は空のまま)
+        # データ移行 (RunPython) は、hints={'model_name': ...} で対象のモデルを指定したものだけを実行する
+        return model_name is not None
+
+
+def reserve_id_range(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # post_migrate: シャードの主キーの採番を i * SHARD_ID_SPACE から始める (既に超えていれば何もしない)
+    aliases = shard_aliases()
+    if using not in aliases or aliases.index(using) == 0:
+        return
+    start = aliases.index(using) * SHARD_ID_SPACE
+    connection = connections[using]
+    tables = [
+        model._meta.db_table for model in sender.get_models()
+        if is_sharded(model) and isinstance(model._meta.pk, models.AutoField)
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start])
+                elif row[0] < start:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))",
+                    [table, start],
+                )
+
+
+def move_user_data(user_id, source, target):
+    # ユーザーのデータを source から target へ主キーを変えずに移す (両方のDBのトランザクション内)
+    # 日付 (auto_now_add / auto_now) を付け直さないよう、フィクスチャの読み込みと同じ raw で保存する
+    # 履歴の要約は移さず、移動先で次に使うときに作り直す
+    from .models import AdviceRecord, ImageAnalysis, LogEntry, LogEntryTombstone, LogHistorySummary, Tank, TankHistorySummary
+
+    order = (Tank, LogEntry, AdviceRecord, LogEntryTombstone, ImageAnalysis)
+    moved = {}
+    with transaction.atomic(using=target), transaction.atomic(using=source):
+        for model in order:
+            count = 0
+            for obj in model.objects.using(source).filter(user_id=user_id).order_by('pk').iterator():
+                obj.save_base(using=target, raw=True, force_insert=True)
+                count += 1
+            moved[model._meta.label] = count
+        TankHistorySummary.objects.using(source).filter(tank__user_id=user_id).delete()
+        LogHistorySummary.objects.using(source).filter(user_id=user_id).delete()
+        for model in reversed(order):
+            model.objects.using(source).filter(user_id=user_id).delete()
+    return moved
+
+
+def users_on_shard(alias):
+    # そのシャードにデータがあるユーザーのID
+    from .models import AdviceRecord, ImageAnalysis, LogEntry, LogEntryTombstone, Tank
+
+    user_ids = set()
+    for model in (Tank, LogEntry, AdviceRecord, LogEntryTombstone, ImageAnalysis):
+        user_ids.update(model.objects.using(alias).order_by().values_list('user_id', flat=True).distinct())
+    return user_ids
+
+
+def delete_user_data(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # post_delete (ユーザー): default 以外のシャードにあるデータは外部キーの CASCADE では消えないので、ここで消す
+    alias = db_for_user(instance.pk)
+    if alias == using:
+        return
+    from .models import AdviceRecord, ImageAnalysis, LogEntry, LogEntryTombstone, LogHistorySummary, Tank
+
+    with transaction.atomic(using=alias):
+        for model in (AdviceRecord, LogEntryTombstone, ImageAnalysis, LogHistorySummary, LogEntry, Tank):
+            model.objects.using(alias).filter(user_id=instance.pk).delete()
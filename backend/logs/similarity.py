@@ -0,0 +1,74 @@
+# AQUAFLUX/backend/logs/similarity.py
+# 知覚ハッシュによる「ほぼ同じ写真」の解析結果の検索 (多重インデックスハッシング)
+#
+# 64ビットのハッシュを16ビットずつ4つに分けて保存しておくと、ハミング距離が3以下の
+# ハッシュ同士は鳩の巣原理により4つのうち少なくとも1つが完全一致する。
+# そこで「ユーザー + 時間窓 + いずれかの部分が一致」をインデックスで引いて候補を絞り、
+# 候補だけ実際の距離を計算する。距離の上限を4以上にした場合は時間窓内を全件比較する。
+# dHash は明暗しか見ないので、候補はマスごとの平均色の差 (imagehash.color_distance) でも絞る。
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .imagehash import BAND_COUNT, color_distance, hamming, split_bands, to_signed, to_unsigned
+from .models import ImageAnalysis
+
+
+def max_distance():
+    return getattr(settings, 'IMAGE_SIMILARITY_MAX_DISTANCE', 3)
+
+
+def max_color_difference():
+    return getattr(settings, 'IMAGE_SIMILARITY_MAX_COLOR_DIFFERENCE', 16)
+
+
+def window():
+    return timedelta(minutes=getattr(settings, 'IMAGE_SIMILARITY_WINDOW_MINUTES', 60))
+
+
+def find_similar(user_id, phash, colors, now=None):
+    # 時間窓内で最も近い解析結果を返す (距離か色の差が上限を超える場合は None)
+    # 平均色を保存していない解析結果は、色を比べられないので使わない
+    limit = max_distance()
+    color_limit = max_color_difference()
+    if limit < 0:
+        return None
+    now = now or timezone.now()
+    queryset = ImageAnalysis.objects.for_user(user_id).filter(created_at__gte=now - window())
+
+    if limit < BAND_COUNT:
+        condition = Q()
+        for i, band in enumerate(split_bands(phash)):
+            condition |= Q(**{f'phash_band{i}': band})
+        queryset = queryset.filter(condition)
+
+    best, best_distance = None, None
+    for analysis in queryset.only('id', 'phash', 'colors', 'water_data', 'created_at').order_by('-created_at'):
+        distance = hamming(phash, to_unsigned(analysis.phash))
+        if distance > limit:
+            continue
+        color_difference = color_distance(colors, analysis.colors)
+        if color_difference is None or color_difference > color_limit:
+            continue
+        if best_distance is None or distance < best_distance:
+            best, best_distance = analysis, distance
+            if distance == 0:
+                break
+    if best is not None:
+        best.distance = best_distance
+    return best
+
+
+def record_analysis(user_id, phash, colors, sha256, water_data):
+    bands = split_bands(phash)
+    return ImageAnalysis.objects.create(
+        user_id=user_id,
+        phash=to_signed(phash),
+        colors=colors,
+        sha256=sha256 or '',
+        water_data=water_data,
+        **{f'phash_band{i}': band for i, band in enumerate(bands)},
+    )
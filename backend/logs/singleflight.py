@@ -0,0 +1,130 @@
+# AQUAFLUX/backend/logs/singleflight.py
+# 同じ内容の同時リクエストを1回の上流呼び出しにまとめる (single-flight)
+#
+# ダブルクリックやフロントエンドのタイムアウト後の再送で、同じ画像・同じアドバイスの
+# リクエストが同時に届くことがある。キーが同じ呼び出しが実行中であれば、後から来た
+# リクエストは新たにモデルを呼ばずにその完了を待ち、同じ結果を受け取る。
+#
+# - プロセス内: スレッド間で threading.Event により結果を共有する
+# - プロセス間 (任意): settings.SINGLEFLIGHT_LOCK_DIR を設定すると、キーごとのファイルに
+#   排他ロック (fcntl.flock) をかけて実行し、結果を JSON でそのファイルに書き残す。
+#   ロック待ちのあとに、待ち始めてから書かれた結果があればそれを使う。
+#   (待ち始める前に終わっていた呼び出しの結果は使わないので、キャッシュにはならない)
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のまとめは行わない
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    PRUNE_EVERY = 256           # この回数ごとに古いロックファイルを掃除する
+    LOCK_FILE_MAX_AGE = 3600    # 秒
+
+    def __init__(self, name, lock_dir=None):
+        self.name = name
+        self.lock_dir = lock_dir
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._runs = 0
+
+    def do(self, key, func):
+        # func() の結果と、他のリクエストの結果を共有したかどうかを返す
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f'singleflight.{self.name}.coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run(key, func)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, shared
+
+    def _run(self, key, func):
+        lock_dir = self.lock_dir or getattr(settings, 'SINGLEFLIGHT_LOCK_DIR', None)
+        if not lock_dir or fcntl is None:
+            metrics.incr(f'singleflight.{self.name}.calls')
+            return func(), False
+
+        os.makedirs(lock_dir, exist_ok=True)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        path = os.path.join(lock_dir, f'{self.name}-{digest}.json')
+        waiting_since = time.time()
+        with open(path, 'a+b') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                stat = os.fstat(lock_file.fileno())
+                if stat.st_size and stat.st_mtime >= waiting_since:
+                    lock_file.seek(0)
+                    try:
+                        result = json.loads(lock_file.read())
+                    except ValueError:
+                        pass
+                    else:
+                        metrics.incr(f'singleflight.{self.name}.coalesced_across_processes')
+                        return result, True
+
+                metrics.incr(f'singleflight.{self.name}.calls')
+                result = func()
+                try:
+                    payload = json.dumps(result).encode()
+                except (TypeError, ValueError):
+                    payload = b''
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(payload)
+                lock_file.flush()
+                return result, False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._maybe_prune(lock_dir)
+
+    def _maybe_prune(self, lock_dir):
+        with self._lock:
+            self._runs += 1
+            if self._runs % self.PRUNE_EVERY:
+                return
+        cutoff = time.time() - self.LOCK_FILE_MAX_AGE
+        prefix = f'{self.name}-'
+        for entry in os.scandir(lock_dir):
+            if entry.name.startswith(prefix):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+analysis_flight = SingleFlight('analyze_image')
+advice_flight = SingleFlight('advice')
@@ -0,0 +1,175 @@
+# AQUAFLUX/backend/logs/species.py
+# 魚の種類の辞書 (FishSpecies) の検索
+#
+# - 別名 (カタカナ・ひらがな・漢字・ローマ字) は normalize() で表記ゆれを揃えてから登録・照合する
+# - 入力補完は、全ての別名を登録したトライ木をプロセス内に持って答える (DB を引かない)
+#   各節点には、その接頭辞で始まる候補の上位 AUTOCOMPLETE_LIMIT 件を構築時に求めておくので、
+#   検索は入力の文字数だけ木をたどるだけで済む
+# - 自由入力の魚の種類 (LogEntry.fish_type) は、別名に完全一致するか、別名を含むもののうち
+#   一番長い別名の種類に対応づける ("ネオンテトラ10匹" -> ネオンテトラ)
+
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+AUTOCOMPLETE_LIMIT = 10
+
+# 初期データ (migrations/0012 で登録する。advice_rules の魚の種類ごとの範囲もここから作る)
+#   ideal_ranges: 適した水質の範囲 {項目: (下限, 上限)}
+SPECIES = [
+    {'slug': 'neon_tetra', 'name': 'ネオンテトラ', 'tank_type': 'freshwater',
+     'aliases': ['ネオンテトラ', 'ネオン', 'neon tetra'], 'ideal_ranges': {'ph': (5.5, 7.5)}},
+    {'slug': 'cardinal_tetra', 'name': 'カージナルテトラ', 'tank_type': 'freshwater',
+     'aliases': ['カージナルテトラ', 'カーディナルテトラ', 'cardinal tetra'], 'ideal_ranges': {'ph': (5.0, 7.0)}},
+    {'slug': 'guppy', 'name': 'グッピー', 'tank_type': 'freshwater',
+     'aliases': ['グッピー', 'guppy'], 'ideal_ranges': {'ph': (6.8, 8.0), 'gh': (6.0, 20.0)}},
+    {'slug': 'platy', 'name': 'プラティ', 'tank_type': 'freshwater',
+     'aliases': ['プラティ', 'platy'], 'ideal_ranges': {'ph': (7.0, 8.0), 'gh': (8.0, 20.0)}},
+    {'slug': 'molly', 'name': 'モーリー', 'tank_type': 'freshwater',
+     'aliases': ['モーリー', 'molly'], 'ideal_ranges': {'ph': (7.0, 8.2)}},
+    {'slug': 'goldfish', 'name': '金魚', 'tank_type': 'freshwater',
+     'aliases': ['金魚', 'キンギョ', 'kingyo', 'goldfish', 'らんちゅう', '琉金', 'リュウキン', 'ryukin'],
+     'ideal_ranges': {'ph': (6.5, 8.0), 'no3': (0.0, 40.0)}},
+    {'slug': 'medaka', 'name': 'メダカ', 'tank_type': 'freshwater',
+     'aliases': ['メダカ', '目高', 'medaka'], 'ideal_ranges': {'ph': (6.5, 8.0)}},
+    {'slug': 'betta', 'name': 'ベタ', 'tank_type': 'freshwater',
+     'aliases': ['ベタ', 'betta', 'ベタ・スプレンデンス'], 'ideal_ranges': {'ph': (6.0, 7.5)}},
+    {'slug': 'corydoras', 'name': 'コリドラス', 'tank_type': 'freshwater',
+     'aliases': ['コリドラス', 'コリ', 'corydoras'], 'ideal_ranges': {'ph': (6.0, 7.5)}},
+    {'slug': 'angelfish', 'name': 'エンゼルフィッシュ', 'tank_type': 'freshwater',
+     'aliases': ['エンゼルフィッシュ', 'エンジェルフィッシュ', 'angelfish'], 'ideal_ranges': {'ph': (6.0, 7.5)}},
+    {'slug': 'cherry_shrimp', 'name': 'ミナミヌマエビ', 'tank_type': 'freshwater',
+     'aliases': ['ミナミヌマエビ', '南沼海老', 'レッドチェリーシュリンプ', 'チェリーシュリンプ', 'cherry shrimp', 'minaminumaebi'],
+     'ideal_ranges': {'ph': (6.5, 7.8), 'gh': (4.0, 12.0), 'no3': (0.0, 20.0)}},
+    {'slug': 'amano_shrimp', 'name': 'ヤマトヌマエビ', 'tank_type': 'freshwater',
+     'aliases': ['ヤマトヌマエビ', '大和沼海老', 'amano shrimp', 'yamatonumaebi'],
+     'ideal_ranges': {'ph': (6.5, 7.8), 'no3': (0.0, 20.0)}},
+    {'slug': 'clownfish', 'name': 'カクレクマノミ', 'tank_type': 'saltwater',
+     'aliases': ['カクレクマノミ', 'クマノミ', '隠隈魚', 'clownfish', 'kakurekumanomi'], 'ideal_ranges': {'ph': (8.0, 8.4)}},
+]
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+_IGNORED = str.maketrans('', '', ' ・-_')
+
+
+def normalize(text):
+    # 全角/半角・大文字/小文字・カタカナ/ひらがなの違いと、空白や中黒を無視して比べるための形にする
+    text = unicodedata.normalize('NFKC', text or '').lower().translate(_IGNORED)
+    return text.translate(_KATAKANA_TO_HIRAGANA)
+
+
+class _Node:
+    __slots__ = ('children', 'species', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.species = None  # この節点で終わる別名の種類
+        self.top = ()        # この接頭辞で始まる候補 (上位 AUTOCOMPLETE_LIMIT 件)
+
+
+class SpeciesTrie:
+    def __init__(self, species, limit=AUTOCOMPLETE_LIMIT):
+        # species: [{'id', 'slug', 'name', 'tank_type', 'aliases': [...]}, ...]
+        self.root = _Node()
+        self.limit = limit
+        for item in species:
+            info = {key: item[key] for key in ('id', 'slug', 'name', 'tank_type')}
+            for alias in [item['name'], *item['aliases']]:
+                key = normalize(alias)
+                if not key:
+                    continue
+                node = self.root
+                for char in key:
+                    node = node.children.setdefault(char, _Node())
+                # 同じ別名が複数の種類にある場合は最初のものを使う
+                if node.species is None:
+                    node.species = info
+        self._collect(self.root, 0)
+
+    def _collect(self, node, depth):
+        # 子の候補をまとめ、別名の短い (入力に近い) 順に上位だけを残す
+        candidates = [(depth, node.species['name'], node.species)] if node.species else []
+        for child in node.children.values():
+            candidates.extend(self._collect(child, depth + 1))
+        candidates.sort(key=lambda item: (item[0], item[1]))
+        top, seen = [], set()
+        for candidate in candidates:
+            if candidate[2]['id'] not in seen:
+                seen.add(candidate[2]['id'])
+                top.append(candidate)
+            if len(top) == self.limit:
+                break
+        node.top = tuple(candidate[2] for candidate in top)
+        return top
+
+    def complete(self, prefix, limit=None):
+        node = self.root
+        for char in normalize(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return list(node.top[:limit or self.limit])
+
+    def match(self, text):
+        # 別名に完全一致すればその種類、そうでなければ text に含まれる一番長い別名の種類
+        key = normalize(text)
+        best, best_length = None, 0
+        for start in range(len(key)):
+            node = self.root
+            for end in range(start, len(key)):
+                node = node.children.get(key[end])
+                if node is None:
+                    break
+                length = end - start + 1
+                if node.species is not None and length > best_length:
+                    best, best_length = node.species, length
+        return best
+
+
+_trie = None
+_trie_built_at = 0.0
+_trie_lock = threading.Lock()
+
+
+def load_trie():
+    # DB の辞書からトライ木を作り直す (辞書の変更は invalidate_trie か TTL 経過後に反映される)
+    from .models import FishSpecies
+
+    global _trie, _trie_built_at
+    species = [
+        {'id': item.id, 'slug': item.slug, 'name': item.name, 'tank_type': item.tank_type,
+         'aliases': [alias.alias for alias in item.aliases.all()]}
+        for item in FishSpecies.objects.prefetch_related('aliases')
+    ]
+    trie = SpeciesTrie(species)
+    with _trie_lock:
+        _trie, _trie_built_at = trie, time.monotonic()
+    return trie
+
+
+def get_trie():
+    ttl = getattr(settings, 'SPECIES_TRIE_TTL', 300)
+    trie = _trie
+    if trie is None or time.monotonic() - _trie_built_at > ttl:
+        trie = load_trie()
+    return trie
+
+
+def invalidate_trie():
+    global _trie
+    with _trie_lock:
+        _trie = None
+
+
+def autocomplete(prefix, limit=None):
+    return get_trie().complete(prefix, limit)
+
+
+def match_species(text):
+    # 自由入力の魚の種類に対応する種類の id (見つからなければ None)
+    if not text:
+        return None
+    species = get_trie().match(text)
+    return species['id'] if species else None
@@ -0,0 +1,23 @@
+# AQUAFLUX/backend/logs/stats.py
+# 水質データの集計
+
+
+def summarize_water_data(water_data_list):
+    # water_data のリスト (新しい順) から、項目ごとの最新値・最小・最大・平均を求める
+    summary = {}
+    for water_data in water_data_list:
+        for key, value in (water_data or {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            item = summary.get(key)
+            if item is None:
+                summary[key] = {'latest': value, 'min': value, 'max': value, 'total': value, 'samples': 1}
+                continue
+            item['min'] = min(item['min'], value)
+            item['max'] = max(item['max'], value)
+            item['total'] += value
+            item['samples'] += 1
+
+    for item in summary.values():
+        item['avg'] = round(item.pop('total') / item['samples'], 3)
+    return summary
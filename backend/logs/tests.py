@@ -1,7 +1,7 @@
 # AQUAFLUX/backend/logs/tests.py
 
 # ★変更: TestCase ではなく APITestCase をインポート
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 from django.core.files.uploadedfile import SimpleUploadedFile
 import io # ioモジュールは引き続き必要
@@ -10,7 +10,49 @@ import json
 from unittest.mock import patch, MagicMock
 import time
 
-from .views import ImageAnalyzeView
+from .views import AsyncLogEntryDetailView, AsyncLogEntryListCreateView, ImageAnalyzeView, LogEntrySyncView
+from users.serializers import ClaimsTokenObtainPairSerializer
+from django.urls import resolve
+import inspect
+from .uploads import BoundedImageUploadHandler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from PIL import Image
+import hashlib
+from .models import LogEntry, ImageAnalysis, LogHistorySummary, LogEntryTombstone, FishSpecies, FishSpeciesAlias, Tank, TankHistorySummary, AdviceRecord
+from .sharding import SHARD_ID_SPACE, db_for_user, shard_index
+from .replicas import replica_reads
+from .events import broker
+from django.core.cache import cache
+from aquaflux_backend.bench import register_database, unregister_database
+from django.core.management import call_command
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from .species import SpeciesTrie, invalidate_trie, normalize
+from .admin import EstimatedCountPaginator
+from .advice_rules import RuleEngine, rule_advice
+from .anomaly import HistoryWindow, bump_version, deviation_anomalies, get_window, history_windows
+from .extraction import PARAMETERS
+from .context import build_advice_prompt, estimate_tokens, get_summary
+from django.db import connection
+from .imagehash import color_signature, dhash, hamming
+from .similarity import find_similar, record_analysis
+from datetime import timedelta
+from .metrics import metrics
+from .singleflight import SingleFlight
+from .ratelimit import TokenBucket, UpstreamLimiter, upstream_limiter
+from rest_framework.exceptions import Throttled
+from .resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryPolicy, UnusableResponse, gemini_breaker
+from google.api_core import exceptions as google_exceptions
+import tempfile
+import threading
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from users.models import CustomUser
 
 import os
 os.environ['GEMINI_API_KEY'] = 'dummy_api_key_for_test'
@@ -19,6 +61,8 @@ os.environ['GEMINI_API_KEY'] = 'dummy_api_key_for_test'
 # ★変更: TestCase ではなく APITestCase を継承
 class ImageAnalyzeViewTest(APITestCase):
     def setUp(self):
+        upstream_limiter.reset()
+        gemini_breaker.reset()
         # APITestCase は client 属性を自動的に提供するため、factory は不要
         # self.factory = APIRequestFactory() 
         
@@ -160,4 +204,1479 @@ class ImageAnalyzeViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         # print(f"test_image_analyze_no_api_key Response Data: {response.data}")
         self.assertIn('error', response.data)
-        self.assertIn('Gemini APIキーが設定されていません。', response.data['error'])
\ No newline at end of file
+        self.assertIn('Gemini APIキーが設定されていません。', response.data['error'])
+
+class LogEntrySyncViewTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('logentry-sync')
+
+    # --- カーソルなしの場合は全件を返すか ---
+    def test_initial_sync_returns_all(self):
+        LogEntry.objects.create(user=self.user, water_data={'ph': 7.0})
+        LogEntry.objects.create(user=self.other, water_data={'ph': 6.5})
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['reset'])
+        self.assertEqual(len(response.data['changes']), 1)
+        self.assertEqual(response.data['deleted'], [])
+
+    # --- カーソル以降の変更と削除だけを返すか ---
+    @override_settings(LOG_SYNC_CURSOR_SAFETY_SECONDS=0)
+    def test_incremental_sync(self):
+        kept = LogEntry.objects.create(user=self.user, water_data={'ph': 7.0})
+        removed = LogEntry.objects.create(user=self.user, water_data={'ph': 7.2})
+        untouched = LogEntry.objects.create(user=self.user, water_data={'ph': 7.4})
+        cursor = self.client.get(self.url).data['cursor']
+
+        time.sleep(0.01)
+        self.client.patch(reverse('logentry-detail', args=[kept.id]), {'notes': '水換え'}, format='json')
+        self.client.delete(reverse('logentry-detail', args=[removed.id]))
+
+        response = self.client.get(self.url, {'since': cursor})
+        self.assertFalse(response.data['reset'])
+        self.assertEqual([log['id'] for log in response.data['changes']], [kept.id])
+        self.assertEqual(response.data['deleted'], [removed.id])
+        self.assertNotIn(untouched.id, [log['id'] for log in response.data['changes']])
+
+        # 返されたカーソルで再同期すると差分はない
+        response = self.client.get(self.url, {'since': response.data['cursor']})
+        self.assertEqual(response.data['changes'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+    # --- 同期の後に、返したログより古い updated_at でコミットされた変更も次回の同期で返すか ---
+    def test_cursor_keeps_late_commits(self):
+        synced = LogEntry.objects.create(user=self.user, water_data={'ph': 7.0})
+        response = self.client.get(self.url)
+        cursor = parse_datetime(response.data['cursor'])
+        self.assertLess(cursor, synced.updated_at)
+
+        # 同期より前に始まり、同期の後にコミットされたトランザクションの書き込み
+        late = LogEntry.objects.create(user=self.user, water_data={'ph': 6.8})
+        LogEntry.objects.filter(pk=late.pk).update(updated_at=synced.updated_at - timedelta(seconds=1))
+
+        response = self.client.get(self.url, {'since': response.data['cursor']})
+        ids = [log['id'] for log in response.data['changes']]
+        self.assertIn(late.id, ids)
+        self.assertIn(synced.id, ids)  # 直近の変更は重ねて返る
+        self.assertGreaterEqual(parse_datetime(response.data['cursor']), cursor)
+
+    # --- 不正なカーソルは400を返すか ---
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'since': 'not-a-date'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LogEntryListFilterTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('logentry-list-create')
+        for i in range(5):
+            LogEntry.objects.create(user=self.user, fish_type='ネオンテトラ' if i % 2 else 'グッピー',
+                                    tank_type='saltwater' if i == 4 else 'freshwater')
+
+    # --- page を指定しない場合は従来通りリストで返すか ---
+    def test_unpaginated_list(self):
+        response = self.client.get(self.url)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    # --- ページ単位で返すか ---
+    def test_paginated_list(self):
+        response = self.client.get(self.url, {'page': 2, 'page_size': 2, 'ordering': 'id'})
+        self.assertEqual(response.data['count'], 5)
+        ids = list(LogEntry.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual([log['id'] for log in response.data['results']], ids[2:4])
+
+    # --- 魚の種類・水槽の種類で絞り込めるか ---
+    def test_filters(self):
+        response = self.client.get(self.url, {'page': 1, 'fish_type': 'ネオン', 'tank_type': 'freshwater'})
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get(self.url, {'date_from': '2000-01-01', 'date_to': '2000-01-02'})
+        self.assertEqual(response.data, [])
+
+    # --- 不正な並び順・日付は400を返すか ---
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(self.url, {'ordering': 'notes'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'date_from': '2025/01/01'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    # --- 形式は正しいが存在しない日付も、500ではなく400を返すか ---
+    def test_impossible_date(self):
+        for params in ({'date_from': '2026-02-30'}, {'date_to': '2026-13-01'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn(next(iter(params)), response.data)
+        response = self.client.delete(reverse('logentry-bulk'), {'filter': {'date_from': '2026-02-30'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DashboardViewTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('logs-dashboard')
+
+    # --- ログがない場合 ---
+    def test_empty_dashboard(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['latest'])
+
+    # --- 最新ログ・集計・アドバイス生成の案内を1回で返すか ---
+    def test_dashboard_without_advice(self):
+        LogEntry.objects.create(user=self.user, water_data={'ph': 6.0, 'no3': 20})
+        latest = LogEntry.objects.create(user=self.user, water_data={'ph': 7.0, 'no3': 10})
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['latest']['id'], latest.id)
+        self.assertEqual(response.data['stats']['parameters']['ph'], {'latest': 7.0, 'min': 6.0, 'max': 7.0, 'samples': 2, 'avg': 6.5})
+        self.assertIsNone(response.data['advice'])
+        self.assertEqual(response.data['advice_request']['body'], {'log_id': latest.id, 'enrich': True})
+
+    # --- log_id で生成したアドバイスが保存され、ダッシュボードで返されるか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_dashboard_returns_stored_advice(self, mock_generate_content):
+        mock_response = MagicMock()
+        mock_response.text = '水換えをしましょう。'
+        mock_generate_content.return_value = mock_response
+        latest = LogEntry.objects.create(user=self.user, water_data={'ph': 7.0}, fish_type='グッピー')
+
+        response = self.client.post(reverse('generate-advice'), {'log_id': latest.id, 'enrich': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('グッピー', mock_generate_content.call_args[0][0])
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['advice']['advice'], '水換えをしましょう。')
+        self.assertIsNone(response.data['advice_request'])
+
+    # --- アドバイスの生成後にログの水質を修正すると、古いアドバイスを返さず生成を促すか ---
+    def test_dashboard_skips_outdated_advice(self):
+        latest = LogEntry.objects.create(user=self.user, water_data={'ph': 7.0, 'no2': 0.0})
+        AdviceRecord.objects.create(user=self.user, log_entry=latest, advice='問題ありません。')
+        self.assertIsNotNone(self.client.get(self.url).data['advice'])
+
+        time.sleep(0.01)
+        response = self.client.patch(reverse('logentry-detail', args=[latest.id]), {'water_data': {'ph': 7.0, 'no2': 1.0}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertIsNone(response.data['advice'])
+        self.assertEqual(response.data['advice_request']['body'], {'log_id': latest.id, 'enrich': True})
+
+
+class BoundedImageUploadTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('analyze-image')
+
+    def make_png(self, size):
+        buffer = io.BytesIO()
+        Image.new('L', size).save(buffer, format='PNG')
+        return SimpleUploadedFile('strip.png', buffer.getvalue(), content_type='image/png')
+
+    # --- サイズ超過は受信途中で413を返すか ---
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_rejects_large_body(self):
+        response = self.client.post(self.url, {'image': SimpleUploadedFile('big.png', b'\0' * 200_000)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    # --- 画素数の上限をヘッダーだけで判定して413を返すか ---
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=1_000_000)
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_rejects_too_many_pixels(self, mock_generate_content):
+        response = self.client.post(self.url, {'image': self.make_png((2000, 2000))}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        mock_generate_content.assert_not_called()
+
+    # --- 画像でないファイルは400を返すか ---
+    def test_rejects_non_image(self):
+        response = self.client.post(self.url, {'image': SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # --- 受信中にハッシュと画像情報が求められているか ---
+    def test_handler_hashes_while_streaming(self):
+        handler = BoundedImageUploadHandler()
+        content = self.make_png((40, 20)).read()
+        handler.new_file('image', 'strip.png', 'image/png', len(content))
+        for start in range(0, len(content), 100):
+            handler.receive_data_chunk(content[start:start + 100], start)
+        uploaded = handler.file_complete(len(content))
+        self.assertEqual(uploaded.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(uploaded.image_size, (40, 20))
+        self.assertEqual(uploaded.read(), content)
+
+
+class ImageSimilarityTest(APITestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        gemini_breaker.reset()
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('analyze-image')
+        # 試験紙のような色の帯が並んだ画像
+        self.strip = Image.new('RGB', (320, 240), (240, 240, 230))
+        for i, color in enumerate([(200, 120, 40), (60, 160, 90), (180, 40, 120), (40, 90, 200), (230, 200, 60)]):
+            self.strip.paste(color, (20 + i * 60, 40, 60 + i * 60, 200))
+
+    def upload(self, image, quality=90):
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        return self.client.post(self.url, {'image': SimpleUploadedFile('strip.jpg', buffer.getvalue(), content_type='image/jpeg')}, format='multipart')
+
+    def mock_response(self):
+        response = MagicMock()
+        response.text = '{"ph": 7.2, "no3": 25}'
+        return response
+
+    # --- 撮り直し程度の違いではハッシュが近く、別の画像とは遠いか ---
+    def test_dhash_distance(self):
+        original = dhash(self.strip)
+        retaken = dhash(self.strip.resize((300, 226)).rotate(0.5, fillcolor=(240, 240, 230)))
+        other = dhash(Image.linear_gradient('L').rotate(90).convert('RGB'))
+        self.assertLessEqual(hamming(original, retaken), 3)
+        self.assertGreater(hamming(original, other), 10)
+
+    # --- ほぼ同じ写真の2回目はGeminiを呼ばずに結果を返すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_near_duplicate_reuses_analysis(self, mock_generate_content):
+        mock_generate_content.return_value = self.mock_response()
+        first = self.upload(self.strip)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(ImageAnalysis.objects.count(), 1)
+
+        second = self.upload(self.strip.resize((300, 226)), quality=70)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data['water_data'], {'ph': 7.2, 'no3': 25})
+        self.assertIn('reused_analysis', second.data)
+        mock_generate_content.assert_called_once()
+
+    # --- 他のユーザーや時間窓の外の解析結果は使わないか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_scoped_by_user_and_window(self, mock_generate_content):
+        mock_generate_content.return_value = self.mock_response()
+        phash, colors = dhash(self.strip), color_signature(self.strip)
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='pass-1234-word')
+        record_analysis(other.id, phash, colors, '', {'ph': 6.0})
+        old = record_analysis(self.user.id, phash, colors, '', {'ph': 6.5})
+        ImageAnalysis.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+        self.assertIsNone(find_similar(self.user.id, phash, colors))
+        response = self.upload(self.strip)
+        self.assertNotIn('reused_analysis', response.data)
+        mock_generate_content.assert_called_once()
+
+    # --- パッドの並びが同じで色だけ違う試験紙は、別の写真として解析するか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_same_layout_with_different_colors_is_not_reused(self, mock_generate_content):
+        mock_generate_content.return_value = self.mock_response()
+        recolored = self.strip.copy()
+        recolored.paste((90, 80, 170), (200, 40, 240, 200))  # 4つ目のパッドだけ色が違う
+        self.assertEqual(hamming(dhash(self.strip), dhash(recolored)), 0)
+
+        self.upload(self.strip)
+        response = self.upload(recolored)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('reused_analysis', response.data)
+        self.assertEqual(mock_generate_content.call_count, 2)
+        self.assertEqual(ImageAnalysis.objects.count(), 2)
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def run_concurrently(self, flights, func, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda f=flights[i % len(flights)]: results.append(f.do('key', func))) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    # --- 同じキーの同時呼び出しは1回だけ実行され、全員が結果を受け取るか ---
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return {'ph': 7.0}
+
+        threads, results = self.run_concurrently([flight], upstream)
+        while metrics.counter('singleflight.test.coalesced') < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], [{'ph': 7.0}] * 5)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+
+    # --- 実行中に発生した例外は待っていた呼び出しにも伝わるか ---
+    def test_error_is_shared(self):
+        flight = SingleFlight('test')
+        release = threading.Event()
+        errors = []
+
+        def upstream():
+            release.wait(5)
+            raise RuntimeError('upstream failed')
+
+        def call():
+            try:
+                flight.do('key', upstream)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while metrics.counter('singleflight.test.coalesced') < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+
+    # --- ロックファイル経由で別のインスタンス (別プロセス相当) の結果を共有するか ---
+    def test_file_lock_shares_result_across_instances(self):
+        with tempfile.TemporaryDirectory() as lock_dir:
+            first, second = SingleFlight('test', lock_dir), SingleFlight('test', lock_dir)
+            started, release = threading.Event(), threading.Event()
+            calls = []
+
+            def upstream():
+                calls.append(1)
+                started.set()
+                release.wait(5)
+                return {'advice': 'ok'}
+
+            leader = threading.Thread(target=lambda: first.do('key', upstream))
+            leader.start()
+            started.wait(5)
+            results = []
+            follower = threading.Thread(target=lambda: results.append(second.do('key', upstream)))
+            follower.start()
+            time.sleep(0.05)
+            release.set()
+            leader.join()
+            follower.join()
+
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(results, [({'advice': 'ok'}, True)])
+            self.assertEqual(metrics.counter('singleflight.test.coalesced_across_processes'), 1)
+
+            # 完了後に来た呼び出しは結果を再利用しない
+            self.assertEqual(second.do('key', upstream), ({'advice': 'ok'}, False))
+            self.assertEqual(len(calls), 2)
+
+
+class MetricsViewTest(APITestCase):
+    # --- メトリクスは管理者だけが見られるか ---
+    def test_staff_only(self):
+        user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(reverse('logs-metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('logs-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('counters', response.data)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class UpstreamLimiterTest(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.clock = FakeClock()
+
+    def make_limiter(self, **kwargs):
+        options = dict(rate=2.0, burst=2, user_rate=1.0, user_burst=2, max_queue=3, max_wait=5.0)
+        options.update(kwargs)
+        return UpstreamLimiter(clock=self.clock, sleep=self.clock.sleep, **options)
+
+    # --- トークンはレートに応じて補充されるか ---
+    def test_token_bucket_refill(self):
+        bucket = TokenBucket(rate=2.0, capacity=1, clock=self.clock)
+        bucket.reserve(0.0)
+        self.assertAlmostEqual(bucket.wait_time(0.0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0.0)
+
+    # --- バーストを超えた呼び出しはレートの間隔で順番に待つか ---
+    def test_waits_are_spaced_at_the_rate(self):
+        limiter = self.make_limiter(user_rate=100, user_burst=100)
+        waits = [limiter.acquire(user_id=i) for i in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5)
+        self.assertAlmostEqual(waits[3], 0.5)
+        self.assertEqual(metrics.counter('upstream.admitted'), 4)
+
+    # --- 待ち時間が上限を超える場合は待たずに 429 (Retry-After) になるか ---
+    def test_rejects_when_wait_exceeds_limit(self):
+        limiter = self.make_limiter(rate=0.1, burst=1)
+        limiter.acquire(user_id=1)
+        with self.assertRaises(Throttled) as raised:
+            limiter.acquire(user_id=2)
+        self.assertEqual(raised.exception.wait, 10)
+        self.assertEqual(metrics.counter('upstream.rejected'), 1)
+
+    # --- 待ち行列が満杯なら待たずに 429 になるか ---
+    def test_rejects_when_queue_is_full(self):
+        limiter = self.make_limiter(burst=1, user_rate=100, user_burst=100, max_queue=0)
+        limiter.acquire(user_id=1)
+        with self.assertRaises(Throttled):
+            limiter.acquire(user_id=2)
+
+    # --- ユーザーごとの上限は他のユーザーに影響しないか ---
+    def test_per_user_quota(self):
+        limiter = self.make_limiter(rate=100, burst=100, user_rate=0.1, user_burst=2)
+        limiter.acquire(user_id=1)
+        limiter.acquire(user_id=1)
+        with self.assertRaises(Throttled):
+            limiter.acquire(user_id=1)
+        self.assertEqual(limiter.acquire(user_id=2), 0.0)
+        self.assertEqual(metrics.counter('upstream.rejected_user_quota'), 1)
+
+    # --- 上流の 429 のあとは全体の呼び出しが遅らされるか ---
+    def test_backoff_delays_next_call(self):
+        limiter = self.make_limiter(user_rate=100, user_burst=100)
+        limiter.backoff(2.0)
+        self.assertAlmostEqual(limiter.acquire(user_id=1), 2.5)
+        self.assertEqual(metrics.snapshot()['observations']['upstream.wait_seconds']['count'], 1)
+
+    # --- 状態ファイルを設定すると、別のプロセスの制限器とも全体のバケットを共有するか ---
+    def test_global_bucket_is_shared_through_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, 'upstream.json')
+            workers = [self.make_limiter(user_rate=100, user_burst=100, state_file=state_file) for _ in range(2)]
+            self.assertEqual([workers[0].acquire(user_id=1), workers[1].acquire(user_id=2)], [0.0, 0.0])
+            self.assertAlmostEqual(workers[1].acquire(user_id=3), 0.5)
+            self.assertAlmostEqual(workers[0].acquire(user_id=4), 0.5)
+
+            workers[1].backoff(2.0)
+            self.assertAlmostEqual(workers[0].acquire(user_id=5), 2.5)
+
+
+class UpstreamThrottleViewTest(APITestCase):
+    def setUp(self):
+        gemini_breaker.reset()
+
+    # --- 呼び出し枠が取れない場合は Gemini を呼ばずに 429 と Retry-After を返すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_analyze_image_returns_retry_after(self, mock_generate_content):
+        limiter = UpstreamLimiter(rate=0.1, burst=1, user_rate=0.1, user_burst=1, max_queue=0, max_wait=1.0)
+        limiter.acquire()
+        image = SimpleUploadedFile('strip.gif', b"GIF89a\x01\x00\x01\x00\x00\xff\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;", content_type='image/gif')
+        with patch('logs.views.upstream_limiter', limiter):
+            response = self.client.post(reverse('analyze-image'), {'image': image}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '10')
+        mock_generate_content.assert_not_called()
+
+
+
+class RetryPolicyTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_policy(self, **kwargs):
+        options = dict(max_attempts=3, base_delay=1.0, max_delay=3.0, deadline=100.0, attempt_timeout=30.0,
+                       clock=self.clock, sleep=self.clock.sleep, random=lambda: 1.0)
+        options.update(kwargs)
+        return RetryPolicy(**options)
+
+    def failing(self, errors, result='ok', elapsed=0.0):
+        calls = []
+
+        def func(attempt):
+            calls.append(attempt.timeout)
+            self.clock.now += elapsed
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return result
+        return func, calls
+
+    # --- 指数バックオフ (上限あり) で再試行し、成功した結果を返すか ---
+    def test_exponential_backoff(self):
+        func, calls = self.failing([Exception('a'), Exception('b')])
+        self.assertEqual(self.make_policy().call(func), 'ok')
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.make_policy(max_attempts=5).backoff(4), 3.0)
+
+    # --- 待ち時間は 0 〜 上限の一様乱数 (フルジッター) か ---
+    def test_full_jitter(self):
+        policy = self.make_policy(random=lambda: 0.25)
+        self.assertEqual(policy.backoff(2), 0.5)
+
+    # --- 再試行しても変わらないエラーはすぐに送出されるか ---
+    def test_non_retryable_error(self):
+        func, calls = self.failing([google_exceptions.InvalidArgument('bad request')])
+        with self.assertRaises(google_exceptions.InvalidArgument):
+            self.make_policy().call(func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    # --- 各試行のタイムアウトが全体の残り時間に収まり、期限を過ぎたら打ち切るか ---
+    def test_deadline_limits_attempts(self):
+        func, calls = self.failing([Exception('slow')] * 3, elapsed=20.0)
+        with self.assertRaises(Exception):
+            self.make_policy(deadline=45.0).call(func)
+        self.assertEqual(calls, [30.0, 24.0, 2.0])
+
+        with self.assertRaises(DeadlineExceeded):
+            self.make_policy(deadline=0).call(func)
+
+    # --- 連続した失敗でサーキットが開き、時間が経つと様子見の呼び出しを通すか ---
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0, clock=self.clock)
+        policy = self.make_policy(max_attempts=1, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                policy.call(self.failing([Exception('down')])[0])
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        func, calls = self.failing([])
+        with self.assertRaises(CircuitOpenError) as raised:
+            policy.call(func)
+        self.assertEqual(raised.exception.retry_after, 10.0)
+        self.assertEqual(calls, [])
+
+        self.clock.now += 10.0
+        self.assertEqual(policy.call(func), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    # --- 内容が使えない応答は再試行するが、サーキットの失敗には数えないか ---
+    def test_unusable_response_keeps_circuit_closed(self):
+        breaker = CircuitBreaker(failure_threshold=1, clock=self.clock)
+        func, calls = self.failing([UnusableResponse('not json')] * 3)
+        with self.assertRaises(UnusableResponse):
+            self.make_policy(breaker=breaker).call(func)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class GeminiResilienceViewTest(APITestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        gemini_breaker.reset()
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        gemini_breaker.reset()
+
+    # --- サーキットが開いている間は Gemini を呼ばずに 503 と Retry-After を返すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_open_circuit_fails_fast(self, mock_generate_content):
+        for _ in range(gemini_breaker.failure_threshold):
+            gemini_breaker.record_failure()
+        response = self.client.post(reverse('advice-generate'), {'water_data': {'ph': 7.0}, 'enrich': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+        mock_generate_content.assert_not_called()
+
+    # --- アドバイス生成も一時的なエラーを再試行するか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    @patch('time.sleep', return_value=None)
+    def test_advice_retries_transient_error(self, mock_sleep, mock_generate_content):
+        mock_response = MagicMock()
+        mock_response.text = '水質は良好です。'
+        mock_generate_content.side_effect = [google_exceptions.ServiceUnavailable('busy'), mock_response]
+        response = self.client.post(reverse('advice-generate'), {'water_data': {'ph': 7.0}, 'enrich': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['advice'], '水質は良好です。')
+        self.assertEqual(mock_generate_content.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertLessEqual(mock_generate_content.call_args.kwargs['request_options']['timeout'], 120)
+
+
+class AdvicePromptContextTest(APITestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        gemini_breaker.reset()
+        metrics.reset()
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        self.client.force_authenticate(self.user)
+
+    def create_logs(self, count):
+        today = timezone.localdate()
+        for i in range(count):
+            entry = LogEntry.objects.create(user=self.user, water_data={'ph': 6.0 + i / 10, 'no3': 5 + i}, notes='水換え' * 30)
+            LogEntry.objects.filter(pk=entry.pk).update(log_date=today - timedelta(days=count - i))
+
+    # --- ログ作成時に要約が差分で更新され、削除後は作り直されるか ---
+    def test_summary_updated_on_write(self):
+        url = reverse('logentry-list-create')
+        self.client.post(url, {'water_data': {'ph': 7.0}}, format='json')
+        log_id = self.client.post(url, {'water_data': {'ph': 6.0, 'no3': 20}}, format='json').data['id']
+        summary = LogHistorySummary.objects.get(user=self.user)
+        self.assertEqual(summary.log_count, 2)
+        self.assertEqual(summary.parameters['ph']['min'], 6.0)
+        self.assertEqual(summary.parameters['no3']['count'], 1)
+
+        self.client.delete(reverse('logentry-detail', args=[log_id]))
+        self.assertTrue(LogHistorySummary.objects.get(user=self.user).stale)
+        summary = get_summary(self.user.id)
+        self.assertEqual(summary.log_count, 1)
+        self.assertNotIn('no3', summary.parameters)
+
+    # --- 予算内に収まり、古い履歴の傾向は要約として含まれるか ---
+    def test_prompt_fits_budget(self):
+        self.create_logs(40)
+        get_summary(self.user.id)
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+            prompt = build_advice_prompt(self.user.id, '淡水', 'ネオンテトラ', {'ph': 7.0}, '', token_budget=400, recent_limit=20)
+        self.assertEqual(len(queries), 2)
+        self.assertLessEqual(prompt.tokens, 400)
+        self.assertGreater(prompt.included_logs, 0)
+        self.assertLess(prompt.included_logs, 20)
+        self.assertEqual(prompt.total_logs, 40)
+        # 最も古いログの値 (ph 6.0) が要約経由で含まれる
+        self.assertIn('全40件', prompt.text)
+        self.assertIn('=6.0 →', prompt.text)
+
+    # --- アドバイスのレスポンスとメトリクスにプロンプトのトークン数が出るか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_prompt_tokens_reported(self, mock_generate_content):
+        self.create_logs(3)
+        mock_response = MagicMock()
+        mock_response.text = '良好です。'
+        mock_generate_content.return_value = mock_response
+        response = self.client.post(reverse('advice-generate'), {'water_data': {'ph': 7.0}, 'enrich': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['prompt_tokens'], estimate_tokens(mock_generate_content.call_args.args[0]))
+        self.assertEqual(metrics.snapshot()['observations']['advice.prompt_tokens']['count'], 1)
+
+
+class StructuredExtractionTest(APITestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        gemini_breaker.reset()
+        metrics.reset()
+        gif_data = b"GIF89a\x01\x00\x01\x00\x00\xff\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+        self.image_file = SimpleUploadedFile('strip.gif', gif_data, content_type='image/gif')
+        self.url = reverse('analyze-image')
+
+    def mock_response(self, data):
+        response = MagicMock()
+        response.text = data if isinstance(data, str) else json.dumps(data)
+        return response
+
+    # --- スキーマ付きの JSON 出力を指定して呼び出すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_requests_schema_constrained_json(self, mock_generate_content):
+        mock_generate_content.return_value = self.mock_response({'ph': 7.0, 'kh': 4, 'gh': 6, 'no2': 0, 'no3': 10, 'cl2': 0})
+        response = self.client.post(self.url, {'image': self.image_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        config = mock_generate_content.call_args.kwargs['generation_config']
+        self.assertEqual(config.response_mime_type, 'application/json')
+        self.assertEqual(set(PARAMETERS) - set(config.response_schema['properties']), set())
+        self.assertEqual(metrics.counter('extraction.requests'), 1)
+
+    # --- 範囲外の値は捨てられるか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_out_of_range_values_rejected(self, mock_generate_content):
+        mock_generate_content.return_value = self.mock_response({'ph': 20, 'no3': 25, 'cl2': None})
+        response = self.client.post(self.url, {'image': self.image_file}, format='multipart')
+        self.assertEqual(response.data['water_data'], {'no3': 25})
+        self.assertEqual(response.data['rejected_values'], {'ph': 20})
+
+    # --- 読み取れなかった項目だけを、画像なしのテキストで聞き直すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_missing_fields_follow_up_text_only(self, mock_generate_content):
+        mock_generate_content.side_effect = [
+            self.mock_response({'ph': 7.0, 'kh': None, 'no3': 10, 'pad_colors': {'ph': '黄緑', 'kh': '薄い緑', 'no3': 'ピンク'}}),
+            self.mock_response({'kh': 6}),
+        ]
+        response = self.client.post(self.url, {'image': self.image_file}, format='multipart')
+        self.assertEqual(response.data['water_data'], {'ph': 7.0, 'no3': 10, 'kh': 6})
+        follow_up = mock_generate_content.call_args_list[1]
+        self.assertIsInstance(follow_up.args[0], str)
+        self.assertIn('薄い緑', follow_up.args[0])
+        self.assertEqual(list(follow_up.kwargs['generation_config'].response_schema['properties']), ['kh'])
+        self.assertEqual(metrics.counter('extraction.followups'), 1)
+
+    # --- JSON として読めなかった回数と再試行の回数が記録されるか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    @patch('time.sleep', return_value=None)
+    def test_parse_failure_metrics(self, mock_sleep, mock_generate_content):
+        mock_generate_content.side_effect = [self.mock_response('not json'), self.mock_response({'ph': 7.0})]
+        response = self.client.post(self.url, {'image': self.image_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.counter('extraction.parse_failures'), 1)
+        self.assertEqual(metrics.counter('extraction.retries'), 1)
+
+
+class LogEntryAdminTest(TestCase):
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='pass-1234-word')
+        self.client.force_login(self.admin_user)
+        self.users = [
+            CustomUser.objects.create_user(username=f'aqua{i}', email=f'aqua{i}@example.com', password='pass-1234-word')
+            for i in range(3)
+        ]
+        for i in range(30):
+            LogEntry.objects.create(user=self.users[i % 3], water_data={'ph': 7.0})
+        self.url = reverse('admin:logs_logentry_changelist')
+
+    def get_changelist(self, **params):
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    # --- 一覧の行数が増えてもクエリ数が変わらず、COUNT(*) を全件に対して実行しないか ---
+    def test_changelist_query_count_is_constant(self):
+        _, queries = self.get_changelist()
+        for i in range(30):
+            LogEntry.objects.create(user=self.users[i % 3], water_data={'ph': 7.0})
+        _, more_queries = self.get_changelist()
+        self.assertEqual(len(queries), len(more_queries))
+        self.assertFalse(any('COUNT(*)' in sql and 'LIMIT' not in sql and 'logs_logentry' in sql for sql in more_queries))
+
+    # --- 件数が閾値を超えたら数えるのをやめるか ---
+    def test_paginator_caps_count(self):
+        with patch.object(EstimatedCountPaginator, 'ESTIMATE_THRESHOLD', 10):
+            paginator = EstimatedCountPaginator(LogEntry.objects.all(), 5)
+            self.assertEqual(paginator.count, 11)
+        self.assertEqual(EstimatedCountPaginator(LogEntry.objects.filter(user=self.users[0]), 5).count, 10)
+
+    # --- 検索はIDまたはユーザー名の完全一致で行われるか ---
+    def test_indexed_search(self):
+        response, _ = self.get_changelist(q='aqua1')
+        self.assertEqual(response.context['cl'].result_count, 10)
+        response, _ = self.get_changelist(q='aqua')
+        self.assertEqual(response.context['cl'].result_count, 0)
+        log = LogEntry.objects.first()
+        response, _ = self.get_changelist(q=str(log.pk))
+        self.assertIn(log, response.context['cl'].result_list)
+
+    # --- 一括操作が UPDATE / DELETE でまとめて実行されるか ---
+    def test_bulk_actions(self):
+        ids = list(LogEntry.objects.filter(user=self.users[0]).values_list('id', flat=True))
+        self.client.post(self.url, {'action': 'mark_saltwater', '_selected_action': ids})
+        self.assertEqual(LogEntry.objects.filter(tank_type='saltwater').count(), 10)
+
+        self.client.post(self.url, {'action': 'delete_with_tombstones', '_selected_action': ids})
+        self.assertFalse(LogEntry.objects.filter(pk__in=ids).exists())
+        self.assertEqual(set(LogEntryTombstone.objects.values_list('log_id', flat=True)), set(ids))
+
+
+class AnomalyDetectionTest(APITestCase):
+    def setUp(self):
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('logentry-list-create')
+        for ph, no3 in [(7.0, 10), (7.1, 10), (6.9, 15), (7.0, 10), (7.0, 12), (7.1, 10)]:
+            LogEntry.objects.create(user=self.user, water_data={'ph': ph, 'no3': no3})
+
+    # --- いつも通りの値なら異常なしとして保存されるか ---
+    def test_normal_reading(self):
+        response = self.client.post(self.url, {'water_data': {'ph': 7.0, 'no3': 10}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['anomalies'], [])
+
+    # --- 安全な範囲外の値と、いつもの値からの急な変化を検知して保存するか ---
+    def test_flags_range_and_deviation(self):
+        response = self.client.post(self.url, {'water_data': {'ph': 6.2, 'no3': 35}}, format='json')
+        flags = {(a['parameter'], a['kind']) for a in response.data['anomalies']}
+        # pH 6.2 は淡水の安全な範囲内だが、いつもの 7.0 前後からは大きく外れている
+        self.assertEqual(flags, {('ph', 'deviation'), ('no3', 'deviation')})
+        self.assertEqual(LogEntry.objects.get(pk=response.data['id']).anomalies, response.data['anomalies'])
+
+        response = self.client.post(self.url, {'water_data': {'ph': 7.0, 'no2': 0.5}, 'tank_type': 'freshwater'}, format='json')
+        self.assertEqual(response.data['anomalies'], [
+            {'parameter': 'no2', 'kind': 'out_of_range', 'value': 0.5, 'direction': 'high', 'range': [0.0, 0.2]},
+        ])
+
+    # --- 2回目以降はキャッシュした直近のログで判定し、ログを読み直さないか ---
+    def test_window_is_cached(self):
+        self.client.post(self.url, {'water_data': {'ph': 7.0}}, format='json')
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+            self.client.post(self.url, {'water_data': {'ph': 7.0}}, format='json')
+        self.assertFalse(any(sql.startswith('SELECT "logs_logentry"."water_data"') for sql in queries))
+        self.assertEqual(len(history_windows.get((self.user.id, None))), 8)
+
+    # --- 他のワーカーでログが作成されたら、キャッシュした配列を使わずに読み直すか ---
+    def test_window_reloads_after_other_worker_change(self):
+        self.client.post(self.url, {'water_data': {'ph': 7.0}}, format='json')
+        self.assertEqual(len(get_window(self.user.id)), 7)
+
+        # 別のプロセスでの作成 (手元のキャッシュは変わらず、共有の版数だけが進む)
+        LogEntry.objects.create(user=self.user, water_data={'ph': 7.2})
+        bump_version(self.user.id, None)
+        self.assertEqual(len(history_windows.get((self.user.id, None))), 7)
+        self.assertEqual(len(get_window(self.user.id)), 8)
+
+        # 手元で作成したログは、その間に他での変更がなければ末尾に足すだけにする
+        self.client.post(self.url, {'water_data': {'ph': 7.0}}, format='json')
+        self.assertEqual(len(history_windows.get((self.user.id, None))), 9)
+
+    # --- 更新時はそのログより前のログと比べて判定し直すか ---
+    def test_update_rescores(self):
+        entry = LogEntry.objects.filter(user=self.user).latest('id')
+        response = self.client.patch(reverse('logentry-detail', args=[entry.id]), {'water_data': {'ph': 8.6}}, format='json')
+        self.assertEqual([a['kind'] for a in response.data['anomalies']], ['out_of_range', 'deviation'])
+        response = self.client.patch(reverse('logentry-detail', args=[entry.id]), {'water_data': {'ph': 7.1}}, format='json')
+        self.assertEqual(response.data['anomalies'], [])
+
+    # --- 過去の記録が少ない項目や、値がばらつく項目は過去との比較で異常にしないか ---
+    def test_requires_history(self):
+        window = HistoryWindow.from_water_data([{'ph': 7.0}, {'ph': 7.0}, {'no3': 5}] * 2, size=30)
+        self.assertEqual(deviation_anomalies({'no3': 50}, window), [])
+        window = HistoryWindow.from_water_data([{'no3': value} for value in (5, 40, 10, 25, 50, 0)], size=30)
+        self.assertEqual(deviation_anomalies({'no3': 45}, window), [])
+
+
+class RuleAdviceTest(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('advice-generate')
+
+    # --- 当てはまるルールのうち一番厳しいものを、重い順に返すか ---
+    def test_rules(self):
+        advice = rule_advice('淡水', 'ネオンテトラ', {'ph': 7.8, 'kh': 1, 'no2': 0.6, 'no3': 10, 'cl2': 0, 'gh': None})
+        self.assertEqual(advice.status, 'danger')
+        self.assertEqual([item['rule'] for item in advice.diagnosis], ['no2_toxic', 'neon_tetra_ph_high', 'kh_low'])
+        # 同じ対処は1回だけ
+        self.assertEqual(len(advice.actions), len(set(advice.actions)))
+
+        self.assertEqual(rule_advice('freshwater', None, {'ph': 7.8, 'no2': 0}).status, 'good')
+        self.assertEqual(rule_advice('saltwater', None, {'ph': 7.8, 'no2': 0}).diagnosis, [])
+        self.assertEqual([item['rule'] for item in rule_advice('海水', 'カクレクマノミ', {'ph': 7.7}).diagnosis], ['ph_low'])
+        self.assertEqual(rule_advice('freshwater', None, {}).status, 'unknown')
+
+    # --- 同じしきい値のルールは重いほうを選ぶか ---
+    def test_same_threshold_prefers_severe(self):
+        engine = RuleEngine.compile(rules=[
+            {'id': 'mild', 'tank_types': ('freshwater',), 'parameter': 'ph', 'below': 6.0, 'severity': 'caution', 'diagnosis': '', 'actions': []},
+            {'id': 'severe', 'tank_types': ('freshwater',), 'parameter': 'ph', 'below': 6.0, 'severity': 'danger', 'diagnosis': '', 'actions': []},
+        ], fish_profiles={})
+        self.assertEqual(engine.evaluate('freshwater', None, {'ph': 5.0}).diagnosis[0]['rule'], 'severe')
+        self.assertEqual(engine.evaluate('freshwater', None, {'ph': 6.0}).diagnosis, [])
+
+    # --- 通常は Gemini を呼ばずにルールの結果を返すか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_view_returns_rules_without_model_call(self, mock_generate_content):
+        response = self.client.post(self.url, {'water_data': {'no2': 1.0}, 'tank_type': 'freshwater'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['source'], 'rules')
+        self.assertEqual(response.data['status'], 'danger')
+        self.assertIn('亜硝酸', response.data['advice'])
+        mock_generate_content.assert_not_called()
+
+    # --- enrich を指定すると、診断結果を添えて Gemini に問い合わせるか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_view_enrich(self, mock_generate_content):
+        mock_generate_content.return_value.text = '水換えをしましょう。'
+        response = self.client.post(self.url, {'water_data': {'no2': 1.0}, 'enrich': True}, format='json')
+        self.assertEqual(response.data['source'], 'gemini')
+        self.assertEqual(response.data['advice'], '水換えをしましょう。')
+        self.assertEqual(response.data['diagnosis'][0]['rule'], 'no2_toxic')
+        self.assertIn('自動診断: no2=1.0', mock_generate_content.call_args[0][0])
+
+
+class FishSpeciesCatalogTest(APITestCase):
+    def setUp(self):
+        invalidate_trie()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('species-autocomplete')
+
+    # --- 表記ゆれを揃えて比べられるか ---
+    def test_normalize(self):
+        self.assertEqual(normalize('ﾈｵﾝ テトラ'), normalize('ねおんてとら'))
+        self.assertEqual(normalize('Neon-Tetra'), 'neontetra')
+
+    # --- カタカナ・ひらがな・漢字・ローマ字のどれからでも補完できるか ---
+    def test_autocomplete(self):
+        response = self.client.get(self.url, {'q': 'ねお'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['slug'], 'neon_tetra')
+        self.assertEqual(self.client.get(self.url, {'q': 'KIN'}).data[0]['name'], '金魚')
+        self.assertEqual(self.client.get(self.url, {'q': '金'}).data[0]['slug'], 'goldfish')
+        self.assertEqual(self.client.get(self.url, {'q': 'ぞ'}).data, [])
+        # 2回目以降は DB を引かない
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+            self.client.get(self.url, {'q': 'め'})
+        self.assertEqual(queries, [])
+
+    # --- 候補は種類ごとに1件、短い別名 (入力に近いもの) から順に返すか ---
+    def test_trie_ranking(self):
+        trie = SpeciesTrie([
+            {'id': 1, 'slug': 'a', 'name': 'コリドラス', 'tank_type': 'freshwater', 'aliases': ['コリ']},
+            {'id': 2, 'slug': 'b', 'name': 'コリドラス・パンダ', 'tank_type': 'freshwater', 'aliases': []},
+        ], limit=5)
+        self.assertEqual([item['id'] for item in trie.complete('こり')], [1, 2])
+        self.assertEqual(trie.match('うちのコリドラスパンダ3匹')['id'], 2)
+        self.assertIsNone(trie.match('グッピー'))
+
+    # --- 自由入力の魚の種類から辞書の項目が対応づけられ、辞書の変更がすぐ反映されるか ---
+    def test_log_species_resolution(self):
+        logs_url = reverse('logentry-list-create')
+        response = self.client.post(logs_url, {'fish_type': 'ネオンテトラ 10匹'}, format='json')
+        neon = FishSpecies.objects.get(slug='neon_tetra')
+        self.assertEqual(response.data['species'], neon.id)
+
+        species = FishSpecies.objects.create(slug='otocinclus', name='オトシンクルス')
+        FishSpeciesAlias.objects.create(species=species, alias='オトシン')
+        response = self.client.post(logs_url, {'fish_type': 'おとしん'}, format='json')
+        self.assertEqual(response.data['species'], species.id)
+
+        response = self.client.post(logs_url, {'species': neon.id}, format='json')
+        self.assertEqual(response.data['fish_type'], 'ネオンテトラ')
+        self.assertEqual(len(self.client.get(logs_url, {'species': neon.id}).data), 2)
+
+
+class TankScopeTest(APITestCase):
+    def setUp(self):
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.reef = Tank.objects.create(user=self.user, name='リーフ水槽', tank_type='saltwater', fish_type='カクレクマノミ')
+        self.planted = Tank.objects.create(user=self.user, name='水草水槽', fish_type='ネオンテトラ')
+        for i in range(6):
+            LogEntry.objects.create(user=self.user, tank=self.reef, tank_type='saltwater', water_data={'ph': 8.2, 'no3': 5})
+            LogEntry.objects.create(user=self.user, tank=self.planted, water_data={'ph': 6.5, 'no3': 10})
+        self.logs_url = reverse('logentry-list-create')
+
+    # --- 水槽の一覧と作成ができ、他のユーザーの水槽は見えないか ---
+    def test_tank_endpoints(self):
+        response = self.client.post(reverse('tank-list-create'), {'name': '金魚水槽', 'fish_type': 'らんちゅう'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['species'], FishSpecies.objects.get(slug='goldfish').id)
+        self.assertEqual(len(self.client.get(reverse('tank-list-create')).data), 3)
+
+        other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        other_tank = Tank.objects.create(user=other, name='他人の水槽')
+        self.assertEqual(self.client.get(reverse('tank-detail', args=[other_tank.id])).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(self.logs_url, {'tank': other_tank.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # --- 一覧・ダッシュボードを水槽ごとに絞り込めるか ---
+    def test_scoped_list_and_dashboard(self):
+        response = self.client.get(self.logs_url, {'tank': self.reef.id})
+        self.assertEqual(len(response.data), 6)
+        self.assertTrue(all(log['tank'] == self.reef.id for log in response.data))
+        self.assertEqual(self.client.get(self.logs_url, {'tank': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('logs-dashboard'), {'tank': self.planted.id})
+        self.assertEqual(response.data['latest']['tank'], self.planted.id)
+        self.assertEqual(response.data['stats']['count'], 6)
+        self.assertEqual(response.data['stats']['parameters']['ph']['max'], 6.5)
+
+    # --- 水槽を指定したログは、水槽の種類・魚の種類を引き継ぎ、同じ水槽のログとだけ比べるか ---
+    def test_log_inherits_tank_and_scopes_anomalies(self):
+        # 海水の水槽では pH 8.2 はいつも通り (淡水の水槽のログと混ぜると外れ値になる)
+        response = self.client.post(self.logs_url, {'tank': self.reef.id, 'water_data': {'ph': 8.2}}, format='json')
+        self.assertEqual(response.data['tank_type'], 'saltwater')
+        self.assertEqual(response.data['fish_type'], 'カクレクマノミ')
+        self.assertEqual(response.data['anomalies'], [])
+        self.assertEqual(TankHistorySummary.objects.get(tank=self.reef).log_count, 7)
+
+    # --- アドバイスのプロンプトにはその水槽の履歴だけを含めるか ---
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_advice_scoped_to_tank(self, mock_generate_content):
+        mock_generate_content.return_value.text = 'ok'
+        response = self.client.post(reverse('advice-generate'), {'tank': self.reef.id, 'water_data': {'ph': 8.2}, 'enrich': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        prompt = mock_generate_content.call_args[0][0]
+        self.assertIn('水槽の種類: 海水', prompt)
+        self.assertIn('全6件', prompt)
+        self.assertNotIn('ph=6.5', prompt)
+
+    # --- 水槽を削除してもログは残り、差分同期で付け替えが伝わるか ---
+    def test_delete_tank_keeps_logs(self):
+        self.client.delete(reverse('tank-detail', args=[self.reef.id]))
+        self.assertEqual(LogEntry.objects.filter(user=self.user, tank__isnull=True).count(), 6)
+
+
+class LogEntryBulkTest(APITestCase):
+    def setUp(self):
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.tank = Tank.objects.create(user=self.user, name='水草水槽')
+        self.logs = [LogEntry.objects.create(user=self.user, water_data={'ph': 7.0}) for _ in range(5)]
+        self.url = reverse('logentry-bulk')
+
+    # --- 指定したログだけを1回の UPDATE で更新し、他のユーザーのログや存在しないログは not_found になるか ---
+    def test_bulk_update_by_ids(self):
+        foreign = LogEntry.objects.create(user=self.other, fish_type='グッピー', water_data={'ph': 7.0})
+        ids = [self.logs[0].id, self.logs[1].id, foreign.id, 999999]
+        changes = {'fish_type': 'ねおんてとら', 'tank': self.tank.id}
+        self.client.patch(self.url, {'ids': [self.logs[4].id], 'changes': changes}, format='json')  # 魚の種類の辞書を読み込んでおく
+        # 水槽の確認・対象の読み取り・UPDATE・履歴の要約2つ (+ セーブポイント2つ) と、
+        # 異常の判定し直し (ログの読み取り・1件ごとの直近のログ・まとめての UPDATE)
+        with self.assertNumQueries(11):
+            response = self.client.patch(self.url, {'ids': ids, 'changes': changes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['updated', 'updated', 'not_found', 'not_found'],
+        )
+        neon = FishSpecies.objects.get(slug='neon_tetra')
+        self.assertEqual(LogEntry.objects.filter(species=neon, tank=self.tank).count(), 3)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.fish_type, 'グッピー')
+
+    # --- 水槽や水槽の種類を一括で変えると、変更後の水槽の過去のログと安全な範囲で異常を判定し直すか ---
+    def test_bulk_tank_change_rescores_anomalies(self):
+        reef = Tank.objects.create(user=self.user, name='サンゴ水槽', tank_type='saltwater')
+        history = [LogEntry.objects.create(user=self.user, tank=reef, tank_type='saltwater', water_data={'ph': 8.2}) for _ in range(5)]
+        LogEntry.objects.filter(pk__in=[log.id for log in history]).update(log_date=timezone.localdate() - timedelta(days=1))
+        moved = self.logs[:2]
+        self.assertEqual(LogEntry.objects.get(pk=moved[0].id).anomalies, [])
+
+        response = self.client.patch(self.url, {'ids': [log.id for log in moved], 'changes': {'tank': reef.id, 'tank_type': 'saltwater'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for log in moved:
+            anomalies = LogEntry.objects.get(pk=log.id).anomalies
+            self.assertEqual(sorted(a['kind'] for a in anomalies), ['deviation', 'out_of_range'])
+
+        # 淡水に戻すと pH 7.0 は範囲内になる (水槽なしのログはユーザーの全てのログと比べるので、ずれは残る)
+        self.client.patch(self.url, {'ids': [log.id for log in moved], 'changes': {'tank': None, 'tank_type': 'freshwater'}}, format='json')
+        for log in moved:
+            self.assertEqual([a['kind'] for a in LogEntry.objects.get(pk=log.id).anomalies], ['deviation'])
+
+    # --- 絞り込み条件に当てはまるログを削除し、差分同期に削除が伝わるか ---
+    def test_bulk_delete_by_filter(self):
+        today = timezone.localdate()
+        LogEntry.objects.filter(pk__in=[log.id for log in self.logs[:3]]).update(log_date=today - timedelta(days=3))
+        cursor = self.client.get(reverse('logentry-sync')).data['cursor']
+        get_summary(self.user.id)
+
+        time.sleep(0.01)
+        week = {'date_from': str(today - timedelta(days=7)), 'date_to': str(today - timedelta(days=1))}
+        response = self.client.delete(self.url, {'filter': week}, format='json')
+        self.assertEqual(response.data['deleted'], 3)
+        self.assertEqual(LogEntry.objects.filter(user=self.user).count(), 2)
+        self.assertTrue(LogHistorySummary.objects.get(user=self.user).stale)
+
+        response = self.client.get(reverse('logentry-sync'), {'since': cursor})
+        self.assertEqual(sorted(response.data['deleted']), sorted(log.id for log in self.logs[:3]))
+
+    # --- 対象や変更の指定が不正な場合は何も変えずに400を返すか ---
+    def test_bulk_validation(self):
+        ids = [self.logs[0].id]
+        for body in (
+            {},
+            {'ids': 'all'},
+            {'ids': [True]},
+            {'ids': list(range(1001))},
+            {'filter': ['tank']},
+            {'filter': {'date_from': 'yesterday'}},
+            {'ids': ids, 'changes': {}},
+            {'ids': ids, 'changes': {'tank_type': 'pond'}},
+        ):
+            response = self.client.patch(self.url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        with patch('logs.views.LogEntryBulkView.MAX_ROWS', 3):
+            response = self.client.delete(self.url, {'filter': {'date_to': str(timezone.localdate())}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(LogEntry.objects.filter(user=self.user).count(), 5)
+
+
+class LogEventStreamTest(APITestCase):
+    def setUp(self):
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('logentry-events')
+
+    def open_stream(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 3000\n\n')  # ここで購読が始まる
+        return response, events
+
+    def read_event(self, events):
+        chunk = next(events).decode()
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+    # --- 自分のログの作成・更新・削除が、コミット後に届くか (他のユーザーの変更は届かないか) ---
+    @override_settings(LOG_EVENTS_KEEPALIVE_SECONDS=0.01)
+    def test_stream_delivers_own_changes(self):
+        response, events = self.open_stream()
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = self.client.post(reverse('logentry-list-create'), {'water_data': {'ph': 7.0}}, format='json').data
+        self.client.force_authenticate(user=self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('logentry-list-create'), {'water_data': {'ph': 6.5}}, format='json')
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('logentry-detail', args=[entry['id']]), {'notes': '水換え'}, format='json')
+            self.client.delete(reverse('logentry-detail', args=[entry['id']]))
+
+        self.assertEqual(self.read_event(events), ('log.saved', {'log': entry}))
+        event_type, data = self.read_event(events)
+        self.assertEqual((event_type, data['log']['notes']), ('log.saved', '水換え'))
+        self.assertEqual(self.read_event(events), ('log.deleted', {'ids': [entry['id']]}))
+        self.assertEqual(next(events), b': keepalive\n\n')
+        response.close()
+        self.assertEqual(broker.subscriber_count(self.user.id), 0)
+
+    # --- 読み出しが追いつかない購読者には読み直しを指示し、接続は一定時間で閉じるか ---
+    @override_settings(LOG_EVENTS_QUEUE_SIZE=2, LOG_EVENTS_MAX_SECONDS=0.05, LOG_EVENTS_KEEPALIVE_SECONDS=0.01)
+    def test_overflow_and_max_duration(self):
+        response, events = self.open_stream()
+        for log_id in range(3):
+            broker.publish(self.user.id, 'log.deleted', {'ids': [log_id]})
+        self.assertEqual(self.read_event(events), ('logs.reset', {}))
+        self.assertTrue(all(chunk == b': keepalive\n\n' for chunk in events))  # 期限が来ると終わる
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    # --- 認証なしでは購読できないか ---
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # --- ASGI では、接続を閉じる前に通知が1件ずつ届き、切断すると購読をやめるか ---
+    @override_settings(LOG_EVENTS_MAX_SECONDS=5)
+    async def test_asgi_stream_delivers_before_close(self):
+        access = await sync_to_async(lambda: str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token))()
+        async with ASGIStream(self.url, {'Authorization': f'Bearer {access}', 'Accept': 'text/event-stream'}) as stream:
+            start = await stream.receive()
+            self.assertEqual((start['type'], start['status']), ('http.response.start', 200))
+            self.assertEqual((await stream.receive())['body'], b'retry: 3000\n\n')
+            self.assertEqual(broker.subscriber_count(self.user.id), 1)
+
+            broker.publish(self.user.id, 'log.deleted', {'ids': [1]})
+            self.assertIn(b'event: log.deleted', (await stream.receive(timeout=1))['body'])
+            self.assertFalse(stream.server.done())  # 接続は開いたまま
+
+            await stream.disconnect()
+            self.assertEqual(broker.subscriber_count(self.user.id), 0)
+
+
+class ASGIStream:
+    # get_asgi_application() に GET リクエストを1つ送り、送られてくるメッセージを順に受け取る (ASGI サーバーの代わり)
+    # テスト用のクライアントと違い、レスポンスの本文を読み切らずに受け取れる
+
+    def __init__(self, path, headers):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.server = None
+
+    async def __aenter__(self):
+        # テストのトランザクションの接続を閉じさせない (テスト用のクライアントと同じ)
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        await self.incoming.put({'type': 'http.request', 'body': b'', 'more_body': False})
+        self.server = asyncio.create_task(get_asgi_application()(self.scope, self.incoming.get, self.outgoing.put))
+        return self
+
+    async def receive(self, timeout=2):
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.server, 2)
+
+    async def __aexit__(self, *exc_info):
+        try:
+            if not self.server.done():
+                await self.disconnect()
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+
+@override_settings(ROOT_URLCONF='aquaflux_backend.asgi_urls')
+class AsyncLogViewTest(TestCase):
+    def setUp(self):
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        self.tank = Tank.objects.create(user=self.user, name='水草水槽')
+        for ph in (6.8, 7.0, 7.2):
+            LogEntry.objects.create(user=self.user, tank=self.tank, water_data={'ph': ph})
+        self.foreign = LogEntry.objects.create(user=self.other, water_data={'ph': 7.0})
+        access = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.headers = {'Authorization': f'Bearer {access}'}
+
+    # --- ASGI の URL 設定では、一覧・作成・詳細が非同期のビューで処理されるか ---
+    def test_async_views_are_routed(self):
+        self.assertIs(resolve('/api/logs/').func.view_class, AsyncLogEntryListCreateView)
+        self.assertIs(resolve('/api/logs/1/').func.view_class, AsyncLogEntryDetailView)
+        self.assertTrue(inspect.iscoroutinefunction(resolve('/api/logs/').func))
+        self.assertIs(resolve('/api/logs/sync/').func.view_class, LogEntrySyncView)
+
+    # --- 非同期のビューでも一覧・作成・詳細・更新・削除が同期のビューと同じように動くか ---
+    async def test_async_crud(self):
+        response = await self.async_client.get('/api/logs/', {'page': 1, 'page_size': 2, 'tank': self.tank.id}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(len((await self.async_client.get('/api/logs/', headers=self.headers)).json()), 3)
+
+        response = await self.async_client.post('/api/logs/', {'tank': self.tank.id, 'water_data': {'ph': 7.1}}, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.json()
+        self.assertEqual(created['tank'], self.tank.id)
+        self.assertEqual(created['anomalies'], [])
+
+        url = f"/api/logs/{created['id']}/"
+        self.assertEqual((await self.async_client.get(url, headers=self.headers)).json()['water_data'], {'ph': 7.1})
+        response = await self.async_client.patch(url, {'notes': '水換え'}, content_type='application/json', headers=self.headers)
+        self.assertEqual(response.json()['notes'], '水換え')
+        response = await self.async_client.delete(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(await LogEntryTombstone.objects.filter(log_id=created['id']).aexists())
+
+        # 他のユーザーのログ・存在しないログは404、トークンがなければ401
+        response = await self.async_client.get(f'/api/logs/{self.foreign.id}/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get('/api/logs/', {'page': 9}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get('/api/logs/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get('/api/logs/', headers={'Authorization': 'Bearer broken'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # --- ASGI の URL 設定でも、変更の通知は接続を閉じる前に1件ずつ届くか ---
+    @override_settings(LOG_EVENTS_MAX_SECONDS=5)
+    async def test_event_stream_is_not_buffered(self):
+        async with ASGIStream('/api/logs/events/', {**self.headers, 'Accept': 'text/event-stream'}) as stream:
+            self.assertEqual((await stream.receive())['status'], status.HTTP_200_OK)
+            self.assertEqual((await stream.receive())['body'], b'retry: 3000\n\n')
+            broker.publish(self.user.id, 'log.deleted', {'ids': [self.foreign.id]})
+            self.assertIn(b'event: log.deleted', (await stream.receive(timeout=1))['body'])
+        self.assertEqual(broker.subscriber_count(self.user.id), 0)
+
+
+class LogShardingTest(APITestCase):
+    # 手元の SQLite (メモリ上) のシャードを3つ使う
+    SHARDS = ['default', 'logs_1', 'logs_2']
+
+    @classmethod
+    def setUpClass(cls):
+        # テストランナーは起動時の DATABASES のDBしか作らないので、シャードはここで追加して作る
+        cls.databases = set(cls.SHARDS)
+        cls.shard_settings = override_settings(LOG_SHARDS=cls.SHARDS)
+        cls.shard_settings.enable()
+        cls.old_names = {}
+        for alias in cls.SHARDS[1:]:
+            register_database(alias)
+            cls.old_names[alias] = connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias, old_name in cls.old_names.items():
+            connections[alias].creation.destroy_test_db(old_name, verbosity=0)
+            unregister_database(alias)
+        cls.shard_settings.disable()
+
+    def setUp(self):
+        history_windows.clear()
+
+    def user_on(self, alias):
+        # 指定したシャードに割り当てられるユーザーができるまで作る
+        for i in range(100):
+            user = CustomUser.objects.create_user(username=f'{alias}-{i}', password='pass-1234-word')
+            if db_for_user(user.id) == alias:
+                return user
+        self.fail(f'no user for {alias}')
+
+    # --- ユーザーIDのハッシュで決まるシャードは毎回同じで、シャードを足したときは新しいシャードへの移動だけになるか ---
+    def test_placement_is_stable_and_consistent(self):
+        placements = {user_id: shard_index(user_id, 3) for user_id in range(1, 301)}
+        self.assertEqual(placements, {user_id: shard_index(user_id, 3) for user_id in range(1, 301)})
+        self.assertEqual(set(placements.values()), {0, 1, 2})
+        for user_id, index in placements.items():
+            self.assertIn(shard_index(user_id, 4), (index, 3))
+
+    # --- API で作成・一覧・更新・削除したデータが、ユーザーのシャードだけに置かれるか ---
+    def test_api_uses_user_shard(self):
+        user = self.user_on('logs_1')
+        other = self.user_on('logs_2')
+        LogEntry.objects.create(user=other, water_data={'ph': 7.0})
+        self.client.force_authenticate(user=user)
+
+        tank = self.client.post(reverse('tank-list-create'), {'name': '水草水槽', 'fish_type': 'ネオンテトラ'}, format='json').data
+        response = self.client.post(reverse('logentry-list-create'), {'tank': tank['id'], 'water_data': {'ph': 6.8}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        log_id = response.data['id']
+        # 主キーはシャードごとの範囲から採番される
+        self.assertGreaterEqual(log_id, SHARD_ID_SPACE)
+        self.assertTrue(LogEntry.objects.using('logs_1').filter(pk=log_id, user_id=user.id).exists())
+        self.assertFalse(LogEntry.objects.using('default').filter(user_id=user.id).exists())
+        self.assertEqual(TankHistorySummary.objects.using('logs_1').get(tank_id=tank['id']).log_count, 1)
+
+        self.assertEqual([log['id'] for log in self.client.get(reverse('logentry-list-create')).data], [log_id])
+        dashboard = self.client.get(reverse('logs-dashboard')).data
+        self.assertEqual(dashboard['latest']['species'], FishSpecies.objects.get(slug='neon_tetra').id)
+        self.assertEqual(dashboard['rule_advice']['status'], 'good')
+
+        detail = reverse('logentry-detail', args=[log_id])
+        self.assertEqual(self.client.patch(detail, {'notes': '水換え'}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(detail).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(LogEntryTombstone.objects.using('logs_1').filter(log_id=log_id).exists())
+        self.assertEqual(self.client.get(reverse('logentry-sync')).data['changes'], [])
+
+    # --- シャードを追加した後、rebalance_log_shards が主キーと日付を変えずにデータを移すか ---
+    def test_rebalance_moves_user_data(self):
+        user = self.user_on('logs_2')
+        with override_settings(LOG_SHARDS=['default']):
+            tank = Tank.objects.create(user=user, name='金魚水槽')
+            log = LogEntry.objects.create(user=user, tank=tank, water_data={'ph': 7.2})
+            LogEntry.objects.filter(pk=log.pk).update(log_date=timezone.localdate() - timedelta(days=10))
+            AdviceRecord.objects.create(user=user, log_entry=log, advice='水換えをしましょう')
+        self.assertEqual(LogEntry.objects.using('default').filter(user=user).count(), 1)
+
+        out = io.StringIO()
+        call_command('rebalance_log_shards', '--dry-run', stdout=out)
+        self.assertIn(f'user {user.id}: default -> logs_2', out.getvalue())
+        self.assertTrue(LogEntry.objects.using('default').filter(pk=log.pk).exists())
+
+        call_command('rebalance_log_shards', stdout=io.StringIO())
+        self.assertFalse(LogEntry.objects.using('default').filter(user=user).exists())
+        moved = LogEntry.objects.for_user(user.id).get()
+        self.assertEqual((moved.pk, moved.tank_id), (log.pk, tank.pk))
+        self.assertEqual(moved.log_date, timezone.localdate() - timedelta(days=10))
+        self.assertEqual(AdviceRecord.objects.for_user(user.id).get().log_entry_id, log.pk)
+
+    # --- ユーザーを削除すると、default 以外のシャードのデータも消えるか ---
+    def test_user_delete_removes_shard_data(self):
+        user = self.user_on('logs_1')
+        tank = Tank.objects.create(user=user, name='水槽')
+        LogEntry.objects.create(user=user, tank=tank, water_data={'ph': 7.0})
+        user_id = user.id
+        user.delete()
+        self.assertFalse(LogEntry.objects.using('logs_1').filter(user_id=user_id).exists())
+        self.assertFalse(Tank.objects.using('logs_1').filter(user_id=user_id).exists())
+
+
+class ReplicaReadTest(APITransactionTestCase):
+    # 主DBをコピーしたレプリカ (メモリ上の SQLite)。コピーの後の書き込みはレプリカに届いていない状態にする
+
+    @classmethod
+    def setUpClass(cls):
+        cls.databases = {'default', 'replica'}
+        cls.replica_settings = override_settings(LOG_REPLICAS={'default': ['replica']})
+        cls.replica_settings.enable()
+        register_database('replica')
+        cls.old_name = connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].creation.destroy_test_db(cls.old_name, verbosity=0)
+        unregister_database('replica')
+        cls.replica_settings.disable()
+
+    def setUp(self):
+        cache.clear()
+        history_windows.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', password='pass-1234-word')
+        self.client.force_authenticate(user=self.user)
+        LogEntry.objects.create(user=self.user, water_data={'ph': 7.0})
+        call_command('sync_sqlite_replicas', stdout=io.StringIO())
+        LogEntry.objects.create(user=self.user, water_data={'ph': 7.2})
+
+    # --- 一覧はレプリカから読み、書き込んだユーザーはしばらく主DBから読むか ---
+    def test_reads_use_replica_until_user_writes(self):
+        url = reverse('logentry-list-create')
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+        response = self.client.post(url, {'water_data': {'ph': 7.1}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.client.get(url).data), 3)
+        self.assertEqual(self.client.get(reverse('logs-dashboard')).data['latest']['id'], response.data['id'])
+
+        cache.clear()  # 固定の期間が過ぎた
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+    # --- レプリカから読む範囲でも、更新・ロックを伴う読み取りは主DBに送られるか ---
+    def test_writes_go_to_primary(self):
+        with replica_reads():
+            self.assertEqual(LogEntry.objects.for_user(self.user.id).db, 'replica')
+            self.assertEqual(LogEntry.objects.for_user(self.user.id).select_for_update().db, 'default')
+            self.assertEqual(LogEntry.objects.for_user(self.user.id).update(notes='水換え'), 2)
+        self.assertEqual(LogEntry.objects.for_user(self.user.id).db, 'default')
+
+
+class GroupLogsIntoTanksMigrationTest(TransactionTestCase):
+    # 0013 の状態のDBにログを作り、0014 でどの水槽にまとめられるかを見る
+    serialized_rollback = True  # 0012 で入れた魚の種類の辞書を、テストの後に戻す
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate([('logs', '0013_tank')])
+        self.executor.loader.build_graph()
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    # --- 辞書で同じ種類に対応づけた表記の違いは1つの水槽に、辞書にない表記は正規化した形でまとめるか ---
+    def test_groups_spellings_of_same_species(self):
+        apps = self.executor.loader.project_state([('logs', '0013_tank')]).apps
+        user = apps.get_model('users', 'CustomUser').objects.create(username='aqua')
+        FishSpecies = apps.get_model('logs', 'FishSpecies')
+        LogEntry = apps.get_model('logs', 'LogEntry')
+        neon = FishSpecies.objects.get(slug='neon_tetra')
+        for fish_type, species in (
+            ('neon tetra', neon), ('ネオンテトラ', neon), ('ネオンテトラ', neon),
+            ('ベタ', None), ('ベタ', None), ('べた', None), ('ﾍﾞﾀ', None), (None, None), ('', None), ('', None),
+        ):
+            LogEntry.objects.create(user_id=user.id, water_data={}, fish_type=fish_type, species=species)
+        LogEntry.objects.create(user_id=user.id, water_data={}, fish_type='ネオンテトラ', species=neon, tank_type='saltwater')
+
+        self.executor.migrate([('logs', '0014_group_logs_into_tanks')])
+        apps = self.executor.loader.project_state([('logs', '0014_group_logs_into_tanks')]).apps
+        Tank = apps.get_model('logs', 'Tank')
+        LogEntry = apps.get_model('logs', 'LogEntry')
+
+        self.assertFalse(LogEntry.objects.filter(tank__isnull=True).exists())
+        tanks = {
+            (tank.tank_type, tank.species_id, tank.fish_type): sorted(
+                LogEntry.objects.filter(tank_id=tank.id).values_list('fish_type', flat=True), key=str,
+            )
+            for tank in Tank.objects.all()
+        }
+        self.assertEqual(tanks, {
+            ('freshwater', neon.id, 'ネオンテトラ'): ['neon tetra', 'ネオンテトラ', 'ネオンテトラ'],
+            ('freshwater', None, 'ベタ'): ['べた', 'ベタ', 'ベタ', 'ﾍﾞﾀ'],
+            ('freshwater', None, ''): ['', '', None],
+            ('saltwater', neon.id, 'ネオンテトラ'): ['ネオンテトラ'],
+        })
@@ -0,0 +1,132 @@
+# AQUAFLUX/backend/logs/uploads.py
+# 画像アップロード用のメモリ上限付きアップロードハンドラー
+#
+# Django標準のハンドラー + ImageField では、アップロードをメモリに溜めたうえで検証のために
+# もう一度丸ごと読み込むため、同時アップロード数に比例してワーカーのメモリが膨らむ。
+# このハンドラーは
+#   - Content-Length と受信済みバイト数で、本文を溜め込む前にサイズ超過を拒否する
+#   - 先頭のヘッダー部分だけで画像の縦横サイズを読み取り、画素数の上限を超えたらその時点で拒否する
+#   - SPOOL_THRESHOLD を超えた分はディスクに書き出す (SpooledTemporaryFile)
+#   - 受信しながら SHA-256 を計算する (後段で再読み込みしない)
+# を行い、検証済みの情報を持った HashedUploadedFile を後段に渡す。
+
+import hashlib
+import io
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'アップロードされた画像が大きすぎます。'
+    default_code = 'upload_too_large'
+
+
+class HashedUploadedFile(UploadedFile):
+    # 受信中に計算したハッシュと画像情報を持つアップロードファイル
+    def __init__(self, file, name, content_type, size, charset, content_type_extra=None,
+                 sha256=None, image_format=None, image_size=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+        self.image_format = image_format
+        self.image_size = image_size
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass
+
+
+class BoundedImageUploadHandler(FileUploadHandler):
+    HEADER_PROBE_LIMIT = 512 * 1024  # 縦横サイズの読み取りに使う先頭部分の上限
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = getattr(settings, 'IMAGE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+        self.max_pixels = getattr(settings, 'IMAGE_UPLOAD_MAX_PIXELS', 40_000_000)
+        self.spool_threshold = getattr(settings, 'IMAGE_UPLOAD_SPOOL_THRESHOLD', 512 * 1024)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 本文を読み始める前に、申告されたサイズで拒否する
+        if content_length and content_length > self.max_bytes + 64 * 1024:
+            raise UploadTooLarge()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.spool = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, suffix='.upload')
+        self.received = 0
+        self.header = bytearray()
+        self.image_format = None
+        self.image_size = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.spool.close()
+            raise UploadTooLarge()
+
+        self.hasher.update(raw_data)
+        self.spool.write(raw_data)
+        if self.image_size is None and len(self.header) < self.HEADER_PROBE_LIMIT:
+            self.header += raw_data
+            self._probe_header()
+        return None
+
+    def file_complete(self, file_size):
+        self.spool.seek(0)
+        if self.image_size is None:
+            # ヘッダーが大きく先頭だけでは判定できなかった場合は、ファイルから遅延的に開いて判定する
+            self._probe(self.spool)
+            self.spool.seek(0)
+        return HashedUploadedFile(
+            file=self.spool,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+            sha256=self.hasher.hexdigest(),
+            image_format=self.image_format,
+            image_size=self.image_size,
+        )
+
+    def _probe_header(self):
+        self._probe(io.BytesIO(self.header))
+
+    def _probe(self, fp):
+        # Image.open はヘッダーだけを読む (画素データは展開しない)
+        try:
+            with Image.open(fp) as image:
+                self.image_format = image.format
+                self.image_size = image.size
+        except Image.DecompressionBombError:
+            self.spool.close()
+            raise UploadTooLarge('画像の画素数が大きすぎます。')
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            return
+        width, height = self.image_size
+        if width * height > self.max_pixels:
+            self.spool.close()
+            raise UploadTooLarge('画像の画素数が大きすぎます。')
+
+
+def upload_sha256(file):
+    # アップロードファイルの SHA-256 (BoundedImageUploadHandler を経由していれば計算済みの値を使う)
+    sha256 = getattr(file, 'sha256', None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
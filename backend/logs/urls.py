@@ -4,8 +4,16 @@ from django.urls import path
 from .views import (
     LogEntryListCreateView,
     LogEntryRetrieveUpdateDestroyView,
+    LogEntryBulkView,
+    LogEventStreamView,
+    LogEntrySyncView,
+    DashboardView,
     ImageAnalyzeView,
-    AdviceGenerateView
+    AdviceGenerateView,
+    MetricsView,
+    SpeciesAutocompleteView,
+    TankListCreateView,
+    TankDetailView,
 )
 
 
@@ -14,7 +22,22 @@ urlpatterns = [
     path('', LogEntryListCreateView.as_view(), name='logentry-list-create'),
     # 特定の飼育ログの詳細、更新、削除 (GET/PUT/PATCH/DELETE /api/logs/1/)
     path('<int:pk>/', LogEntryRetrieveUpdateDestroyView.as_view(), name='logentry-detail'),
+    # 一括更新・一括削除 (PATCH/DELETE /api/logs/bulk/)
+    path('bulk/', LogEntryBulkView.as_view(), name='logentry-bulk'),
+    # 変更の通知 (GET /api/logs/events/、Server-Sent Events)
+    path('events/', LogEventStreamView.as_view(), name='logentry-events'),
+    # 差分同期 (GET /api/logs/sync/?since=<cursor>)
+    path('sync/', LogEntrySyncView.as_view(), name='logentry-sync'),
+    # 最新ログ・集計・保存済みアドバイスをまとめて返す
+    path('dashboard/', DashboardView.as_view(), name='logs-dashboard'),
     # 画像分析用のAPIエンドポイント
     path('analyze-image/', ImageAnalyzeView.as_view(), name='analyze-image'),
     path('advice/', AdviceGenerateView.as_view(), name='advice-generate'),
+    # 水槽の一覧・作成と、詳細・更新・削除
+    path('tanks/', TankListCreateView.as_view(), name='tank-list-create'),
+    path('tanks/<int:pk>/', TankDetailView.as_view(), name='tank-detail'),
+    # 魚の種類の入力補完 (GET /api/logs/species/?q=ねお)
+    path('species/', SpeciesAutocompleteView.as_view(), name='species-autocomplete'),
+    # プロセス内メトリクス (管理者のみ)
+    path('metrics/', MetricsView.as_view(), name='logs-metrics'),
 ]
\ No newline at end of file
@@ -5,59 +5,482 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
-from .models import LogEntry
-from .serializers import LogEntrySerializer, ImageUploadSerializer
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.reverse import reverse
+from rest_framework.renderers import JSONRenderer
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import timedelta, timezone as dt_timezone
+from .models import LogEntry, LogEntryTombstone, AdviceRecord, Tank
+from .serializers import LogEntrySerializer, LogEntryBulkUpdateSerializer, ImageUploadSerializer, AdviceRecordSerializer, TankSerializer
+from .stats import summarize_water_data
+from .pagination import LogEntryPagination
+from users.permissions import IsStaffUser
+from aquaflux_backend.async_api import AsyncAPIViewMixin
+from .uploads import BoundedImageUploadHandler, upload_sha256
+from .singleflight import advice_flight, analysis_flight
+from .metrics import metrics
+from .ratelimit import upstream_limiter
+from .extraction import (
+    EXTRACTION_PROMPT, clean_water_data, follow_up_prompt, missing_with_colors, parse_model_json,
+    generation_config as extraction_config,
+)
+from .context import build_advice_prompt, invalidate_summary, record_log_created
+from .advice_rules import render_markdown, rule_advice
+from .species import autocomplete
+from .replicas import ReplicaReadMixin
+from .events import EventStreamRenderer, blocking_event_stream, event_stream, publish_log_event
+from .sharding import db_for_user
+from .anomaly import detect_anomalies, get_window, invalidate_window, load_window, record_created
+from .resilience import CircuitOpenError, UnusableResponse, UpstreamUnavailable, gemini_retry_policy
+from .imagehash import fingerprint_file
+from .similarity import find_similar, record_analysis
 from PIL import Image
 import io
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import os
 import json
-import time
+import hashlib
+
+
+def get_user_tank(request, tank_id):
+    # リクエストしているユーザーの水槽 (tank_id が空なら None)
+    if tank_id in (None, ''):
+        return None
+    if not str(tank_id).isdigit():
+        raise ValidationError({'tank': '水槽の id を指定してください。'})
+    return generics.get_object_or_404(Tank.objects.for_user(request.user.id), pk=tank_id)
+
+
+def _parse_date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(str(value))
+    except ValueError:
+        parsed = None  # 2026-02-30 のように、形式は正しいが存在しない日付
+    if parsed is None:
+        raise ValidationError({name: '日付は YYYY-MM-DD 形式で指定してください。'})
+    return parsed
+
+
+def filter_logs(request, queryset, params):
+    # 一覧のクエリパラメータ (一括更新・削除では filter の中身) でユーザーのログを絞り込む
+    tank = get_user_tank(request, params.get('tank'))
+    if tank is not None:
+        queryset = queryset.filter(tank_id=tank.id)
+
+    date_from = _parse_date(params, 'date_from')
+    date_to = _parse_date(params, 'date_to')
+    if date_from:
+        queryset = queryset.filter(log_date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(log_date__lte=date_to)
+    if params.get('tank_type'):
+        queryset = queryset.filter(tank_type=params['tank_type'])
+    if params.get('fish_type'):
+        queryset = queryset.filter(fish_type__icontains=params['fish_type'])
+    if params.get('species'):
+        if not str(params['species']).isdigit():
+            raise ValidationError({'species': '魚の種類の id を指定してください。'})
+        queryset = queryset.filter(species_id=params['species'])
+    return queryset
 
 
 # 飼育ログの一覧表示と新規作成
-class LogEntryListCreateView(generics.ListCreateAPIView):
+# クエリパラメータ:
+#   page / page_size        : ページング (page を指定した場合のみ {count, next, previous, results} 形式)
+#   ordering                : 並び順 (例: -log_date, fish_type)
+#   date_from / date_to     : 日付範囲 (YYYY-MM-DD)
+#   tank_type / fish_type   : 水槽の種類 (完全一致) / 魚の種類 (部分一致)
+#   species                 : 魚の種類の辞書の id
+#   tank                    : 水槽の id (その水槽のログだけを (tank, log_date, id) のインデックスで読む)
+# レプリカがあれば GET はレプリカから読む (直前に書き込んだユーザーは主DBから。logs/replicas.py)
+class LogEntryListCreateView(ReplicaReadMixin, generics.ListCreateAPIView):
     serializer_class = LogEntrySerializer
     permission_classes = [IsAuthenticated] # 認証済みユーザーのみアクセス許可
+    pagination_class = LogEntryPagination
+
+    ORDERING_FIELDS = ('id', 'log_date', 'fish_type', 'tank_type', 'updated_at')
 
     def get_queryset(self):
         # リクエストしているユーザーが作成したログのみを返す
-        return LogEntry.objects.filter(user=self.request.user).order_by('-log_date', '-id')
+        # (request.user はトークン由来の軽量ユーザーの場合があるため user_id で絞り込む)
+        params = self.request.query_params
+        queryset = filter_logs(self.request, LogEntry.objects.for_user(self.request.user.id), params)
+
+        ordering = params.get('ordering', '-log_date')
+        if ordering.lstrip('-') not in self.ORDERING_FIELDS:
+            raise ValidationError({'ordering': f'並び替えに使える項目: {", ".join(self.ORDERING_FIELDS)}'})
+        # 同じ値が並んだときもページ間で順序が揺れないよう、id を最後のキーにする
+        direction = '-' if ordering.startswith('-') else ''
+        order_by = [ordering] if ordering.lstrip('-') == 'id' else [ordering, f'{direction}id']
+        return queryset.order_by(*order_by)
 
     def perform_create(self, serializer):
         # ログ作成時に、リクエストしているユーザーを自動的に設定する
-
-        serializer.save(user=self.request.user)
+        user_id = self.request.user.id
+        data = serializer.validated_data
+        tank_id = data['tank'].id if data.get('tank') else None
+        # 同じ水槽の直近のログと比べて水質の異常を判定し、ログと一緒に保存する
+        anomalies = detect_anomalies(data.get('water_data', {}), data.get('tank_type', 'freshwater'), get_window(user_id, tank_id))
+        entry = serializer.save(user_id=user_id, anomalies=anomalies)
+        record_created(user_id, entry.water_data, tank_id)
+        # AIアドバイス用の履歴の要約に差分で反映する
+        record_log_created(entry)
+        # 他の端末・タブで開いている一覧に追加を通知する
+        publish_log_event(user_id, 'log.saved', log=serializer.data)
          
 
 
 # 飼育ログの詳細表示、更新、削除
-class LogEntryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class LogEntryRetrieveUpdateDestroyView(ReplicaReadMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = LogEntrySerializer
     permission_classes = [IsAuthenticated] # 認証済みユーザーのみアクセス許可
     queryset = LogEntry.objects.all() # 全てのログから対象を見つける
 
     def get_queryset(self):
         # リクエストしているユーザーが所有するログのみを対象とする
-        return LogEntry.objects.filter(user=self.request.user)
+        return LogEntry.objects.for_user(self.request.user.id)
+
+    def perform_update(self, serializer):
+        instance, data = serializer.instance, serializer.validated_data
+        if not {'water_data', 'tank_type', 'tank'} & data.keys():
+            serializer.save()
+            publish_log_event(instance.user_id, 'log.saved', log=serializer.data)
+            return
+        # 水質・水槽が変わった場合は、同じ水槽のこのログより前のログと比べて異常を判定し直す
+        old_tank_id = instance.tank_id
+        new_tank_id = old_tank_id
+        if 'tank' in data:
+            new_tank_id = data['tank'].id if data['tank'] else None
+        anomalies = detect_anomalies(
+            data.get('water_data', instance.water_data),
+            data.get('tank_type', instance.tank_type),
+            load_window(instance.user_id, before=instance, tank_id=new_tank_id),
+        )
+        serializer.save(anomalies=anomalies)
+        if 'water_data' in data or new_tank_id != old_tank_id:
+            # 履歴の要約と異常検知用の直近のログは、次に使うときに作り直す
+            invalidate_summary(instance.user_id, old_tank_id, new_tank_id)
+            invalidate_window(instance.user_id, old_tank_id, new_tank_id)
+        publish_log_event(instance.user_id, 'log.saved', log=serializer.data)
+
+    def perform_destroy(self, instance):
+        # 差分同期のため、削除と同じトランザクションで削除記録を残す (ログと同じシャードに置く)
+        log_id = instance.id  # delete() の後は None になる
+        with transaction.atomic(using=instance._state.db):
+            LogEntryTombstone.objects.create(user_id=instance.user_id, log_id=instance.id)
+            instance.delete()
+            invalidate_summary(instance.user_id, instance.tank_id)
+        invalidate_window(instance.user_id, instance.tank_id)
+        publish_log_event(instance.user_id, 'log.deleted', ids=[log_id])
+
+
+# 一覧・作成・詳細の非同期版 (ASGI で動かす場合に使う。aquaflux_backend/asgi_urls.py)
+# 読み取りは非同期のORMで行い、トランザクションや異常検知のキャッシュを使う検証・保存・削除は
+# 上の同期のビューの処理をそのまま sync_to_async でまとめて呼ぶ
+class AsyncLogEntryListCreateView(AsyncAPIViewMixin, LogEntryListCreateView):
+    async def get(self, request, *args, **kwargs):
+        # 水槽での絞り込みは水槽の持ち主を確かめるので、クエリセットの組み立ても同期のコードとして呼ぶ
+        queryset = self.filter_queryset(await sync_to_async(self.get_queryset)())
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer([entry async for entry in queryset], many=True).data)
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        await sync_to_async(self._create)(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+    def _create(self, serializer):
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+
+
+class AsyncLogEntryDetailView(AsyncAPIViewMixin, LogEntryRetrieveUpdateDestroyView):
+    async def get(self, request, *args, **kwargs):
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+    async def put(self, request, *args, **kwargs):
+        return await self._update(request, partial=False)
+
+    async def patch(self, request, *args, **kwargs):
+        return await self._update(request, partial=True)
+
+    async def delete(self, request, *args, **kwargs):
+        await sync_to_async(self.perform_destroy)(await self.aget_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    async def _update(self, request, partial):
+        serializer = self.get_serializer(await self.aget_object(), data=request.data, partial=partial)
+        await sync_to_async(self._save)(serializer)
+        return Response(serializer.data)
+
+    def _save(self, serializer):
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+
+
+# 飼育ログの一括更新・一括削除 (PATCH/DELETE /api/logs/bulk/)
+# 本文:
+#   ids     : 対象のログの id のリスト
+#   filter  : 一覧と同じ絞り込み条件 {"date_from": "2026-10-01", "date_to": "2026-10-07", "fish_type": ..., "tank": ...}
+#             (ids と両方を指定した場合は、両方に当てはまるログ)
+#   changes : 変更する項目 (PATCH のみ) {"fish_type", "species", "tank", "tank_type", "notes"}
+# リクエストしているユーザーのログだけを、1つのトランザクションの中で UPDATE / DELETE 文でまとめて処理し、
+# ログごとの結果 ({"id", "status": "updated" | "deleted" | "not_found"}) を返す
+# 水質は変えられないが、水槽 (tank) や水槽の種類 (tank_type) を変えた場合は比べる相手と安全な範囲が変わるので、
+# 対象のログの異常 (anomalies) を同じトランザクションの中で1件ずつ判定し直す (件数は MAX_ROWS まで)
+class LogEntryBulkView(ReplicaReadMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    MAX_ROWS = 1000   # 1回のリクエストで処理できるログの件数
+    BATCH_SIZE = 500  # 1文の IN 句に入れる id の数
+
+    def patch(self, request, *args, **kwargs):
+        serializer = LogEntryBulkUpdateSerializer(data=request.data.get('changes') or {}, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        changes = serializer.validated_data
+        queryset, requested = self._target(request)
+        user_id = request.user.id
+        tank_ids = set()
+        with transaction.atomic(using=db_for_user(user_id)):
+            rows = self._lock_rows(queryset)
+            ids = [log_id for log_id, _ in rows]
+            # auto_now は効かないので、差分同期のため updated_at も更新する
+            now = timezone.now()
+            for batch in self._batches(ids):
+                LogEntry.objects.for_user(user_id).filter(pk__in=batch).update(**changes, updated_at=now)
+                if {'tank', 'tank_type'} & changes.keys():
+                    self._rescore(user_id, batch)
+            if 'tank' in changes and rows:
+                # 水槽が変わったログの履歴の要約と異常検知用の直近のログは、次に使うときに作り直す
+                tank_ids = {tank_id for _, tank_id in rows} | {changes['tank'].id if changes['tank'] else None}
+                invalidate_summary(user_id, *tank_ids)
+        if tank_ids:
+            invalidate_window(user_id, *tank_ids)
+        if ids:
+            publish_log_event(user_id, 'log.changed', ids=ids)
+        return Response({'updated': len(ids), 'results': self._results(requested, ids, 'updated')}, status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        queryset, requested = self._target(request)
+        user_id = request.user.id
+        with transaction.atomic(using=db_for_user(user_id)):
+            rows = self._lock_rows(queryset)
+            ids = [log_id for log_id, _ in rows]
+            # 差分同期のため、削除と同じトランザクションで削除記録を残す
+            for batch in self._batches(ids):
+                LogEntryTombstone.objects.bulk_create([LogEntryTombstone(user_id=user_id, log_id=log_id) for log_id in batch])
+                LogEntry.objects.for_user(user_id).filter(pk__in=batch).delete()
+            tank_ids = {tank_id for _, tank_id in rows}
+            if rows:
+                invalidate_summary(user_id, *tank_ids)
+        if rows:
+            invalidate_window(user_id, *tank_ids)
+            publish_log_event(user_id, 'log.deleted', ids=ids)
+        return Response({'deleted': len(ids), 'results': self._results(requested, ids, 'deleted')}, status=status.HTTP_200_OK)
+
+    def _target(self, request):
+        # 対象のログのクエリセットと、ids で指定された id (重複を除いた指定順) を返す
+        ids = request.data.get('ids')
+        filters = request.data.get('filter')
+        if ids is None and not filters:
+            raise ValidationError({'ids': 'ids または filter を指定してください。'})
+        queryset = LogEntry.objects.for_user(request.user.id)
+        requested = None
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(log_id, int) and not isinstance(log_id, bool) for log_id in ids):
+                raise ValidationError({'ids': 'ログの id のリストを指定してください。'})
+            if len(ids) > self.MAX_ROWS:
+                raise ValidationError({'ids': f'一度に指定できるのは{self.MAX_ROWS}件までです。'})
+            requested = list(dict.fromkeys(ids))
+            queryset = queryset.filter(pk__in=requested)
+        if filters:
+            if not isinstance(filters, dict):
+                raise ValidationError({'filter': '絞り込み条件をオブジェクトで指定してください。'})
+            queryset = filter_logs(request, queryset, filters)
+        return queryset, requested
+
+    def _lock_rows(self, queryset):
+        # 対象のログの id と水槽を行ロックを取って読む (上限を超える場合は何もせずにエラーにする)
+        rows = list(queryset.select_for_update().order_by('id').values_list('id', 'tank_id')[:self.MAX_ROWS + 1])
+        if len(rows) > self.MAX_ROWS:
+            raise ValidationError({'filter': f'対象のログが{self.MAX_ROWS}件を超えています。条件を絞り込んでください。'})
+        return rows
+
+    def _rescore(self, user_id, ids):
+        # 更新後の水槽のこのログより前のログと比べて、異常を判定し直す (単体の更新と同じ判定)
+        entries = list(LogEntry.objects.for_user(user_id).filter(pk__in=ids).only('id', 'log_date', 'water_data', 'tank_type', 'tank_id'))
+        for entry in entries:
+            entry.anomalies = detect_anomalies(
+                entry.water_data, entry.tank_type, load_window(user_id, before=entry, tank_id=entry.tank_id),
+            )
+        LogEntry.objects.for_user(user_id).bulk_update(entries, ['anomalies'])
+
+    def _batches(self, ids):
+        for start in range(0, len(ids), self.BATCH_SIZE):
+            yield ids[start:start + self.BATCH_SIZE]
+
+    def _results(self, requested, ids, status_name):
+        if requested is None:
+            return [{'id': log_id, 'status': status_name} for log_id in ids]
+        found = set(ids)
+        return [{'id': log_id, 'status': status_name if log_id in found else 'not_found'} for log_id in requested]
+
+
+# 飼育ログの変更の通知 (GET /api/logs/events/、Accept: text/event-stream)
+# 他の端末・タブでの作成・更新・削除を Server-Sent Events で送る (logs/events.py)
+# ASGI では非同期のジェネレーターで送る (接続ごとにスレッドを使わず、通知を1件ずつすぐに送る)
+class LogEventStreamView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request, *args, **kwargs):
+        stream = event_stream if isinstance(request._request, ASGIRequest) else blocking_event_stream
+        response = StreamingHttpResponse(stream(request.user.id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx にバッファさせない
+        return response
+
+
+# 飼育ログの差分同期 (GET /api/logs/sync/?since=<cursor>)
+# since 以降に更新されたログと、削除されたログのIDを返す。
+# クライアントは返された cursor を保存しておき、次回の since に渡す。
+# updated_at はコミットより前に決まるので、この読み取りの後にコミットされる書き込みが、返したログより
+# 古い updated_at を持つことがある。カーソルは LOG_SYNC_CURSOR_SAFETY_SECONDS 秒前より新しくしないので、
+# 直近の変更は次回の同期でも重ねて返る (クライアントは id で上書き・削除して重複を吸収する)
+class LogEntrySyncView(ReplicaReadMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        user_id = request.user.id
+        started = timezone.now()
+        since_param = request.query_params.get('since')
+        since = None
+        if since_param:
+            # URLエンコードされずに送られた '+00:00' の '+' は空白になるので戻す
+            since = parse_datetime(since_param.replace(' ', '+'))
+            if since is None:
+                raise ValidationError({'since': '不正なカーソルです。'})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, dt_timezone.utc)
+
+        # 削除記録の保持期間より古いカーソルは削除を取りこぼすので、全件を返して作り直させる
+        retention = timedelta(days=getattr(settings, 'LOG_TOMBSTONE_RETENTION_DAYS', 30))
+        reset = since is None or since < started - retention
+
+        logs = LogEntry.objects.for_user(user_id)
+        tombstones = LogEntryTombstone.objects.none()
+        if not reset:
+            logs = logs.filter(updated_at__gt=since)
+            tombstones = LogEntryTombstone.objects.for_user(user_id).filter(deleted_at__gt=since)
+        logs = list(logs.order_by('updated_at', 'id'))
+        deleted = list(tombstones.order_by('deleted_at').values_list('log_id', 'deleted_at'))
+
+        # 新しいカーソルは今回返したデータの最新時刻。ただし、まだコミットされていない書き込みを飛ばさないよう
+        # 読み取りの開始時刻から余裕を取った時刻までにする (前回のカーソルより戻すことはしない)
+        safe_until = started - timedelta(seconds=getattr(settings, 'LOG_SYNC_CURSOR_SAFETY_SECONDS', 5))
+        candidates = [log.updated_at for log in logs] + [deleted_at for _, deleted_at in deleted]
+        cursor = min(max(candidates), safe_until) if candidates else safe_until
+        if not reset:
+            cursor = max(cursor, since)
+
+        return Response({
+            'reset': reset,
+            'changes': LogEntrySerializer(logs, many=True, context={'request': request}).data,
+            'deleted': [log_id for log_id, _ in deleted],
+            'cursor': cursor.isoformat(),
+        }, status=status.HTTP_200_OK)
     
 
 
 
+UPSTREAM_BACKOFF_SECONDS = 2  # 上流が 429 を返したときに、全体の呼び出しを遅らせる秒数
+
+
+def call_gemini(model, contents, attempt, **kwargs):
+    # 試行ごとのタイムアウト (リクエスト全体の残り時間以内) を付けて Gemini を呼ぶ
+    try:
+        response = model.generate_content(contents, request_options={'timeout': attempt.timeout}, **kwargs)
+        response.resolve()
+        return response
+    except google_exceptions.TooManyRequests:
+        # 上流が混んでいるので、全体の呼び出しを間引く
+        upstream_limiter.backoff(UPSTREAM_BACKOFF_SECONDS)
+        raise
+
+
+def log_retry(attempt_number, error, delay):
+    print(f"Attempt {attempt_number}: Gemini API呼び出しが失敗しました ({delay:.1f}秒後に再試行します): {error}")
+
+
+def shareable(response):
+    # 同時リクエスト間で共有できる形 (ステータスコードとJSONにできるデータ) に変換する
+    return {'status': response.status_code, 'data': response.data}
+
+
 # 画像アップロード・解析API (Gemini Vision)
 class ImageAnalyzeView(APIView):
     permission_classes = [AllowAny]
     serializer_class = ImageUploadSerializer
 
-    DEFAULT_RETRIES = 3  # デフォルトの再試行回数
-    RETRY_DELAY_SECONDS = 2  # 再試行間の遅延時間（秒）
+    DEFAULT_RETRIES = 3  # デフォルトの試行回数
+    RETRY_DELAY_SECONDS = 2  # 再試行の待ち時間の基準値（秒, 指数バックオフ + ジッター）
+
+    def initialize_request(self, request, *args, **kwargs):
+        # 本文をパースする前に、メモリ上限付きのアップロードハンドラーに差し替える
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         
         image_file = serializer.validated_data['image']
-        
+
+        # ログイン中のユーザーが最近解析したほぼ同じ写真があれば、その結果を返す (Gemini を呼ばない)
+        fingerprint = None
+        if request.user.is_authenticated:
+            try:
+                fingerprint = fingerprint_file(image_file)
+            except (OSError, ValueError):
+                fingerprint = None
+        if fingerprint is not None:
+            similar = find_similar(request.user.id, *fingerprint)
+            if similar is not None:
+                return Response({
+                    "message": "最近解析したほぼ同じ画像の結果を再利用しました。",
+                    "water_data": similar.water_data,
+                    "image_filename": image_file.name,
+                    "image_size": image_file.size,
+                    "reused_analysis": {
+                        "id": similar.id,
+                        "distance": similar.distance,
+                        "created_at": similar.created_at,
+                    },
+                }, status=status.HTTP_200_OK)
+
+        # 同じ画像の同時リクエスト (ダブルクリックや再送) は1回のモデル呼び出しにまとめる
+        user_id = request.user.id if request.user.is_authenticated else None
+        key = f"{user_id or 'anonymous'}:{upload_sha256(image_file)}"
+        result, shared = analysis_flight.do(key, lambda: shareable(self.analyze(image_file, fingerprint, user_id)))
+        data = dict(result['data'])
+        if shared and 'image_filename' in data:
+            data['image_filename'] = image_file.name
+        return Response(data, status=result['status'])
+
+    def analyze(self, image_file, fingerprint=None, user_id=None):
+        # Gemini で画像から水質データを抽出する
         try:
             gemini_api_key = os.environ.get("GEMINI_API_KEY")
             if not gemini_api_key:
@@ -69,82 +492,89 @@ class ImageAnalyzeView(APIView):
             genai.configure(api_key=gemini_api_key)
             model = genai.GenerativeModel('gemini-2.0-flash-lite')
 
+            # モデルに渡すバイト列を読み込むのはここだけ (検証・ハッシュ計算は受信中に済んでいる)
             image_file.seek(0)
             img_data = image_file.read()
 
-            extraction_prompt = (
-                "これは水質試験紙の画像です。写真から、pH、KH、GH、NO2、NO3、Cl2の値を検出してJSON形式で出力してください。"
-                "例: {\"ph\": 7.0, \"kh\": 6, \"gh\": 8, \"no2\": 0.1, \"no3\": 10.0, \"cl2\": 0.0}"
-                "値が検出できない場合は、その項目をJSONに含めないでください。"
-            )
-            
-            
-            for attempt in range(self.DEFAULT_RETRIES):
+            def extract(attempt):
+                # 上流の呼び出し枠が空くまで待つ (待てない場合は 429 を返す)
+                upstream_limiter.acquire(user_id)
+                response_gemini = call_gemini(
+                    model,
+                    [
+                        EXTRACTION_PROMPT,
+                        {"mime_type": image_file.content_type, "data": img_data}
+                    ],
+                    attempt,
+                    generation_config=extraction_config(),
+                )
+                raw_text_response = response_gemini.text.strip()
                 try:
-                    response_gemini = model.generate_content(
-                        [
-                            extraction_prompt,
-                            {"mime_type": image_file.content_type, "data": img_data}
-                        ],
-                        request_options={'timeout': 120} # タイムアウト時間を設定
-                    )
-                    response_gemini.resolve()
-
-                    extracted_data = {}
-                    raw_text_response = response_gemini.text.strip()
-                    
-                    # Geminiからの応答が '```json' と '```' で囲まれている場合を考慮
-                    if raw_text_response.startswith('```json') and raw_text_response.endswith('```'):
-                        # '```json' と '```' を取り除き、その間のJSON文字列を抽出
-                        raw_text_response = raw_text_response[7:-3].strip()
-                    
-                    # ★JSONパースエラーのハンドリングを強化
-                    try:
-                        extracted_data = json.loads(raw_text_response)
-                        # JSONが正常にパースされたらループを抜ける
-                        break 
-                    except json.JSONDecodeError as e:
-                        # JSON形式が不正だった場合
-                        print(f"Attempt {attempt + 1}: Geminiからの応答が有効なJSONではありませんでした: {e}")
-                        print(f"Raw Gemini response: {raw_text_response}")
-                        if attempt < self.DEFAULT_RETRIES - 1:
-                            # 最後の試行でなければ再試行のために待機
-                            time.sleep(self.RETRY_DELAY_SECONDS) 
-                        else:
-                            # 全ての試行が失敗したらエラーを返す
-                            return Response(
-                                {"error": "Geminiが有効な水質データをJSON形式で抽出できませんでした。", "details": str(e), "raw_gemini_response": raw_text_response},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-                except Exception as e:
-                    # Gemini API呼び出し自体に問題があった場合（ネットワークエラー、タイムアウトなど）
-                    print(f"Attempt {attempt + 1}: Gemini API呼び出し中にエラーが発生しました: {e}")
-                    if attempt < self.DEFAULT_RETRIES - 1:
-                        # 最後の試行でなければ再試行のために待機
-                        time.sleep(self.RETRY_DELAY_SECONDS)
-                    else:
-                        # 全ての試行が失敗したらエラーを返す
-                        return Response(
-                            {"error": "Gemini APIとの通信中に問題が発生しました。時間をおいて再試行してください。", "details": str(e)},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
-      
-
-            # 全ての試行が失敗した場合（return文が呼ばれない場合）は、ここには到達しないが念のため
+                    return parse_model_json(raw_text_response)
+                except ValueError as e:
+                    # スキーマを指定していても JSON として読めなかった場合は再試行する (上流の障害としては扱わない)
+                    metrics.incr('extraction.parse_failures')
+                    raise UnusableResponse(str(e), raw_response=raw_text_response) from e
+
+            def on_retry(attempt_number, error, delay):
+                metrics.incr('extraction.retries')
+                log_retry(attempt_number, error, delay)
+
+            metrics.incr('extraction.requests')
+            try:
+                raw_data = gemini_retry_policy(self.DEFAULT_RETRIES, self.RETRY_DELAY_SECONDS).call(
+                    extract, on_retry=on_retry
+                )
+            except UnusableResponse as e:
+                # 全ての試行で有効なJSONが返らなかった
+                return Response(
+                    {"error": "Geminiが有効な水質データをJSON形式で抽出できませんでした。", "details": str(e), "raw_gemini_response": e.raw_response},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            except CircuitOpenError as e:
+                # Gemini の障害が続いているので呼び出さずにすぐ返す
+                raise UpstreamUnavailable(wait=e.retry_after)
+            except APIException:
+                raise
+            except Exception as e:
+                # 再試行しても Gemini API の呼び出しが成功しなかった (期限切れ・再試行できないエラーを含む)
+                print(f"Gemini API呼び出し中にエラーが発生しました: {e}")
+                return Response(
+                    {"error": "Gemini APIとの通信中に問題が発生しました。時間をおいて再試行してください。", "details": str(e)},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+            # 範囲外の値は捨て、一部の項目だけ読み取れなかった場合はその項目だけテキストで聞き直す
+            extracted_data, rejected = clean_water_data(raw_data)
+            missing = missing_with_colors(extracted_data, raw_data)
+            if extracted_data and missing:
+                recovered, recovered_rejected = self.follow_up(model, missing, user_id)
+                extracted_data.update(recovered)
+                rejected.update(recovered_rejected)
+            if rejected:
+                metrics.incr('extraction.out_of_range', len(rejected))
+
             if not extracted_data:
                 return Response(
                     {"error": "すべての試行が失敗しました。水質データを抽出できませんでした。"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
-            
-            return Response({
+
+            if fingerprint is not None:
+                record_analysis(user_id, *fingerprint, getattr(image_file, 'sha256', None), extracted_data)
+
+            response_data = {
                 "message": "画像から水質データを抽出しました。",
                 "water_data": extracted_data,
                 "image_filename": image_file.name,
                 "image_size": image_file.size,
-            }, status=status.HTTP_200_OK)
-
+            }
+            if rejected:
+                response_data["rejected_values"] = rejected
+            return Response(response_data, status=status.HTTP_200_OK)
 
+        except APIException:
+            raise
         except Exception as e:
             print(f"画像解析API処理中にエラーが発生しました: {e}")
             return Response(
@@ -152,20 +582,92 @@ class ImageAnalyzeView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def follow_up(self, model, pad_colors, user_id=None):
+        # 読み取れなかった項目だけを、パッドの色の説明からテキストのみで推定させる
+        # 失敗しても最初の結果は返せるので、エラーにはせずに空の結果を返す
+        metrics.incr('extraction.followups')
+        keys = tuple(pad_colors)
+
+        def ask(attempt):
+            upstream_limiter.acquire(user_id)
+            response_gemini = call_gemini(
+                model, follow_up_prompt(pad_colors), attempt,
+                generation_config=extraction_config(keys, with_colors=False),
+            )
+            try:
+                return parse_model_json(response_gemini.text)
+            except ValueError as e:
+                metrics.incr('extraction.parse_failures')
+                raise UnusableResponse(str(e), raw_response=response_gemini.text) from e
+
+        try:
+            data = gemini_retry_policy(2, self.RETRY_DELAY_SECONDS).call(ask, on_retry=log_retry)
+        except APIException:
+            raise
+        except Exception as e:
+            print(f"不足項目の再問い合わせに失敗しました: {e}")
+            return {}, {}
+        water_data, rejected = clean_water_data({key: data.get(key) for key in keys})
+        metrics.incr('extraction.followup_recovered', len(water_data))
+        return water_data, rejected
+
 
 # AIアドバイス生成API
-class AdviceGenerateView(APIView):
+# 通常はルールによる診断 (diagnosis) と対処 (actions) をすぐに返す。
+# enrich=true を指定した場合は、それを踏まえた文章でのアドバイスを Gemini で生成して保存する
+class AdviceGenerateView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
+
+    DEFAULT_RETRIES = 3  # デフォルトの試行回数
+    RETRY_DELAY_SECONDS = 2  # 再試行の待ち時間の基準値（秒, 指数バックオフ + ジッター）
     
     def post(self, request, *args, **kwargs):
-        water_data = request.data.get('water_data', {}) 
-        notes = request.data.get('notes', '')
-        fish_type = request.data.get('fish_type', '一般的な熱帯魚')
-        tank_type = request.data.get('tank_type', '淡水') # 淡水/海水など
+        # log_id が指定された場合は、そのログの内容でアドバイスを生成して保存する
+        # (クライアントはログの中身を送り返す必要がない)
+        log_entry = None
+        log_id = request.data.get('log_id')
+        if log_id is not None:
+            log_entry = generics.get_object_or_404(LogEntry.objects.for_user(request.user.id).select_related('tank'), pk=log_id)
+        # tank が指定された場合 (またはログが水槽に属する場合) は、その水槽の履歴だけを参考にする
+        tank = get_user_tank(request, request.data.get('tank'))
+        if tank is None and log_entry is not None:
+            tank = log_entry.tank
+        source = log_entry or tank
 
-        # ユーザーの過去の飼育ログを取得（最新5件）
-        recent_logs = LogEntry.objects.filter(user=request.user).order_by('-log_date')[:5]
-        
+        water_data = request.data.get('water_data', log_entry.water_data if log_entry else {}) 
+        notes = request.data.get('notes', (log_entry.notes or '') if log_entry else '')
+        fish_type = request.data.get('fish_type', (source.fish_type if source else None) or '一般的な熱帯魚')
+        tank_type = request.data.get('tank_type', source.get_tank_type_display() if source else '淡水') # 淡水/海水など
+
+        # まずルールで診断と対処を作る (Gemini を呼ばないのですぐに返せる)
+        species = source.species.slug if source and source.species_id and 'fish_type' not in request.data else None
+        advice = rule_advice(tank_type, fish_type, water_data, species)
+        metrics.incr('advice.rules')
+        if not self._enrich_requested(request):
+            return Response({
+                "message": "水質データからアドバイスを作成しました。",
+                "source": "rules",
+                "advice": render_markdown(advice),
+                **advice.as_dict(),
+            }, status=status.HTTP_200_OK)
+
+        # enrich を指定された場合だけ、診断結果を添えて Gemini に文章でのアドバイスを書いてもらう
+        # 同じ内容の同時リクエストは1回のモデル呼び出しにまとめ、全員に同じアドバイスを返す
+        inputs = json.dumps(
+            [log_id, tank.id if tank else None, water_data, notes, fish_type, tank_type],
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        key = f"{request.user.id}:{hashlib.sha256(inputs.encode()).hexdigest()}"
+        result, shared = advice_flight.do(
+            key, lambda: shareable(self.generate(request.user.id, log_entry, water_data, notes, fish_type, tank_type, advice, tank))
+        )
+        return Response(result['data'], status=result['status'])
+
+    def _enrich_requested(self, request):
+        value = request.data.get('enrich', request.query_params.get('enrich', False))
+        return str(value).lower() in ('1', 'true', 'yes')
+
+    def generate(self, user_id, log_entry, water_data, notes, fish_type, tank_type, advice, tank=None):
         try:
             gemini_api_key = os.environ.get("GEMINI_API_KEY")
             if not gemini_api_key:
@@ -178,60 +680,137 @@ class AdviceGenerateView(APIView):
             # テキストを扱うモデル 'gemini-2.0-flash-lite' を使う
             model = genai.GenerativeModel('gemini-2.0-flash-lite')
 
-            # ★★★ プロンプトテンプレートの構築 (f-stringを利用) ★★★
-            water_data_str_parts = []
-            if water_data: 
-                for key, value in water_data.items():
-                    if value is not None:
-                        water_data_str_parts.append(f"{key}: {value}")
-            
-            water_data_for_prompt = ", ".join(water_data_str_parts) if water_data_str_parts else "（データなし）"
-
-            # 過去のログ情報をプロンプトに追加
-            log_history_text = ""
-            if recent_logs.exists():
-                log_history_text = "\n\n【参考：過去の飼育ログ履歴】\n"
-                for i, log in enumerate(recent_logs, 1):
-                    log_data_parts = []
-                    if log.water_data:
-                        for key, value in log.water_data.items():
-                            if value is not None:
-                                log_data_parts.append(f"{key}: {value}")
-                    log_data_str = ", ".join(log_data_parts) if log_data_parts else "データなし"
-                    log_history_text += f"{i}. {log.log_date} - 水質: {log_data_str}"
-                    if log.notes:
-                        log_history_text += f" (メモ: {log.notes[:50]}{'...' if len(log.notes) > 50 else ''})"
-                    log_history_text += "\n"
-                log_history_text += "\n上記の過去データも踏まえて、水質の変化傾向や改善点があれば言及してください。"
-            
-            prompt_template = (
-                f"あなたは水槽の専門家です。以下の水槽のデータに基づいて、具体的で分かりやすいアドバイスをしてください。\n\n"
-                f"【現在の状況】\n"
-                f"水槽の種類: {tank_type}\n"
-                f"主な魚の種類: {fish_type}\n"
-                f"水質データ: {water_data_for_prompt}\n"
-                f"その他メモ: {notes}"
-                f"{log_history_text}\n\n"
-                f"診断結果と、魚が快適に過ごせるように、具体的にどうすれば良いか教えてください。改善策は箇条書きで、専門用語は避け、初心者にも理解できるように説明してください。"
-                f"現在の水質が良い場合は、それを維持するためのアドバイスをしてください。"
-                f"過去のデータがある場合は、変化の傾向についてもコメントしてください。"
+            # 現在の状況 + 履歴の要約 + 最近のログを、トークン数の上限内に収めたプロンプト
+            prompt = build_advice_prompt(
+                user_id, tank_type, fish_type, water_data, notes, diagnosis=advice.diagnosis, tank_id=tank.id if tank else None,
             )
-            
-            # Geminiにプロンプトを送信
-            response_gemini = model.generate_content(prompt_template)
-            # テキストモデルなので resolve() は必須ではないが、安全のため付けておく
-            response_gemini.resolve() 
+            metrics.observe('advice.prompt_tokens', prompt.tokens)
 
-            advice_text = response_gemini.text
+            # Geminiにプロンプトを送信 (上流の呼び出し枠が空くまで待ち、失敗したら再試行する)
+            def generate(attempt):
+                upstream_limiter.acquire(user_id)
+                return call_gemini(model, prompt.text, attempt).text
+
+            try:
+                advice_text = gemini_retry_policy(self.DEFAULT_RETRIES, self.RETRY_DELAY_SECONDS).call(
+                    generate, on_retry=log_retry
+                )
+            except CircuitOpenError as e:
+                raise UpstreamUnavailable(wait=e.retry_after)
+            record = AdviceRecord.objects.create(user_id=user_id, log_entry=log_entry, advice=advice_text)
 
             return Response({
                 "message": "AIによるアドバイスを生成しました。",
+                "source": "gemini",
                 "advice": advice_text,
+                "advice_id": record.id,
+                "prompt_tokens": prompt.tokens,
+                **advice.as_dict(),
             }, status=status.HTTP_200_OK)
 
+        except APIException:
+            raise
         except Exception as e:
             print(f"AIアドバイス生成API処理中にエラーが発生しました: {e}")
             return Response(
                 {"error": "AIアドバイス生成API処理中にエラーが発生しました。", "details": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+# 水槽の一覧と新規作成 (GET/POST /api/logs/tanks/)
+class TankListCreateView(ReplicaReadMixin, generics.ListCreateAPIView):
+    serializer_class = TankSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Tank.objects.for_user(self.request.user.id)
+
+    def perform_create(self, serializer):
+        serializer.save(user_id=self.request.user.id)
+
+
+# 水槽の詳細表示、更新、削除 (削除してもログは残し、どの水槽にも属さないログにする)
+class TankDetailView(ReplicaReadMixin, generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = TankSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Tank.objects.for_user(self.request.user.id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=instance._state.db):
+            # 差分同期でクライアントに水槽の付け替えが伝わるよう、updated_at も更新する
+            LogEntry.objects.for_user(instance.user_id).filter(tank_id=instance.id).update(tank=None, updated_at=timezone.now())
+            instance.delete()
+        invalidate_window(instance.user_id, instance.id)
+
+
+# ダッシュボードAPI (GET /api/logs/dashboard/?tank=<id>)
+# 最新のログ・項目ごとの集計・そのログに対する保存済みアドバイスを1回のレスポンスで返す
+# アドバイスが未生成の場合 (生成した後にログが編集された場合も) は、生成するためのリクエスト内容 (advice_request) を返す
+class DashboardView(ReplicaReadMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    STATS_WINDOW = 30  # 集計に使う直近のログ件数
+
+    def get(self, request, *args, **kwargs):
+        # ?tank=<id> を指定した場合は、その水槽のログだけを集計する
+        logs = LogEntry.objects.for_user(request.user.id)
+        tank = get_user_tank(request, request.query_params.get('tank'))
+        if tank is not None:
+            logs = logs.filter(tank_id=tank.id)
+        # 魚の種類の辞書は default にあるので JOIN せず、最新のログの分だけ後から読む
+        recent_logs = list(logs.order_by('-log_date', '-id')[:self.STATS_WINDOW])
+        if not recent_logs:
+            return Response({'latest': None, 'stats': {'count': 0, 'parameters': {}}, 'rule_advice': None, 'advice': None, 'advice_request': None})
+
+        latest = recent_logs[0]
+        # ログの更新 (水質の数値の修正など) より前に生成したアドバイスは、古い内容に対するものなので返さない
+        advice = AdviceRecord.objects.for_user(request.user.id).filter(
+            log_entry_id=latest.id, created_at__gte=latest.updated_at,
+        ).order_by('-created_at').first()
+        rules = rule_advice(latest.tank_type, latest.fish_type, latest.water_data, latest.species.slug if latest.species else None)
+
+        return Response({
+            'latest': LogEntrySerializer(latest, context={'request': request}).data,
+            'stats': {
+                'count': len(recent_logs),
+                'parameters': summarize_water_data(log.water_data for log in recent_logs),
+            },
+            # ルールによる診断はその場で返し、AIの文章でのアドバイスは保存済みのものか、生成するためのリクエストを返す
+            'rule_advice': {'advice': render_markdown(rules), **rules.as_dict()},
+            'advice': AdviceRecordSerializer(advice).data if advice else None,
+            'advice_request': None if advice else {
+                'method': 'POST',
+                'url': reverse('generate-advice', request=request),
+                'body': {'log_id': latest.id, 'enrich': True},
+            },
+        }, status=status.HTTP_200_OK)
+
+
+# 魚の種類の入力補完 (GET /api/logs/species/?q=ねお)
+# プロセス内のトライ木で答えるので DB は引かない
+class SpeciesAutocompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    MAX_LIMIT = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': '整数で指定してください。'})
+        if not query or limit < 1:
+            return Response([])
+        return Response(autocomplete(query, limit))
+
+
+# メトリクスAPI (GET /api/logs/metrics/) 管理者のみ
+# このプロセス内のカウンター (同時リクエストのまとめ数など) を返す
+class MetricsView(APIView):
+    permission_classes = [IsStaffUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
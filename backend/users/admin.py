@@ -1,6 +1,14 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from .models import AccountPurgeJob, CustomUser
 
 admin.site.register(CustomUser, UserAdmin)
 # Register your models here.
+
+
+@admin.register(AccountPurgeJob)
+class AccountPurgeJobAdmin(admin.ModelAdmin):
+    list_display = ('username', 'user_id', 'status', 'deleted', 'total', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('username',)
+    readonly_fields = ('id', 'user_id', 'username', 'total', 'deleted', 'error', 'created_at', 'started_at', 'updated_at', 'finished_at')
@@ -0,0 +1,136 @@
+# AQUAFLUX/backend/users/authentication.py
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password, verify_password
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from aquaflux_backend.cache import TTLCache
+
+
+class ClaimsUser(TokenUser):
+    # トークンのクレーム (user_id / username / is_active) だけで組み立てる軽量ユーザー
+    # CustomUser の行を読まないので、リクエストごとのユーザーテーブル参照が発生しない
+
+    @property
+    def is_active(self):
+        return self.token.get('is_active', True)
+
+
+# フルのユーザーが必要な場面向けのプロセス内キャッシュ
+user_cache = TTLCache(ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 30))
+
+
+# 削除を依頼した (無効にした) ユーザーの記録
+# クレームのあるアクセストークンは DB を引かずに受け付けるので、無効にした後も有効期限までは使えてしまう。
+# そこで Django のキャッシュに「このユーザーのアクセストークンは拒否する」印をアクセストークンの有効期限の間だけ置き、
+# 認証のたびに確認する (複数のプロセスで動かす場合は、CACHES に共有のキャッシュ (Redis など) を設定する)
+def _revoked_key(user_id):
+    return f'users:access-revoked:{user_id}'
+
+
+def revoke_user_access(user_id):
+    # それまでに発行したアクセストークンが期限切れになるまで印を残す
+    timeout = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()) + 60
+    cache.set(_revoked_key(user_id), True, timeout=timeout)
+
+
+def is_access_revoked(user_id):
+    return cache.get(_revoked_key(user_id), False)
+
+
+async def ais_access_revoked(user_id):
+    return await cache.aget(_revoked_key(user_id), False)
+
+
+def get_full_user(user):
+    # ClaimsUser から CustomUser のインスタンスを取得する (TTLキャッシュ経由)
+    # すでにモデルのインスタンスであればそのまま返す
+    user_model = get_user_model()
+    if isinstance(user, user_model):
+        return user
+
+    user_id = user.id if hasattr(user, 'id') else user
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    try:
+        full_user = user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except user_model.DoesNotExist:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+    user_cache.set(user_id, full_user)
+    return full_user
+
+
+async def aauthenticate_credentials(username, password):
+    # ModelBackend.authenticate の非同期版 (非同期のログイン用)
+    # パスワードの照合は CPU を使うので、イベントループの外のスレッドで行う
+    user_model = get_user_model()
+    try:
+        user = await user_model._default_manager.aget(**{user_model.USERNAME_FIELD: username})
+    except user_model.DoesNotExist:
+        # ユーザーの有無で応答時間が変わらないよう、存在しない場合もハッシュを計算する
+        await sync_to_async(make_password, thread_sensitive=False)(password)
+        return None
+    is_correct, must_update = await sync_to_async(verify_password, thread_sensitive=False)(password, user.password)
+    if not is_correct or not user.is_active:
+        return None
+    if must_update:
+        # ハッシュのアルゴリズム・反復回数が変わっていれば、新しい設定でハッシュし直して保存する
+        user.password = await sync_to_async(make_password, thread_sensitive=False)(password)
+        await user.asave(update_fields=['password'])
+    return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    # トークンに username / is_active が埋め込まれていれば DB を引かずに ClaimsUser を返す
+    # 古いトークン (クレームなし) の場合は TTL キャッシュ経由でフルのユーザーを読む
+    # どちらの場合も、削除を依頼したユーザー (revoke_user_access) のトークンは拒否する
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        if is_access_revoked(user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return self._user_for(validated_token, user_id)
+
+    def _user_id(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return validated_token[api_settings.USER_ID_CLAIM]
+
+    def _user_for(self, validated_token, user_id):
+        if 'username' not in validated_token:
+            user = get_full_user(user_id)
+            if not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return user
+
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    async def aauthenticate(self, request):
+        # 非同期のビュー用 (aquaflux_backend/async_api.py)
+        # クレームのあるトークンは DB を引かないので、イベントループの上でそのまま検証する
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if 'username' not in validated_token:
+            return await sync_to_async(self.get_user)(validated_token), validated_token
+        user_id = self._user_id(validated_token)
+        if await ais_access_revoked(user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return self._user_for(validated_token, user_id), validated_token
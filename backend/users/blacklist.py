@@ -0,0 +1,135 @@
+# AQUAFLUX/backend/users/blacklist.py
+# リフレッシュトークンのローテーションと失効 (ブラックリスト) の管理
+#
+# 標準の token_blacklist アプリはリフレッシュのたびに OutstandingToken / BlacklistedToken の
+# 参照と作成で複数クエリを発行する。ここでは
+#   - jti の一意インデックスに対する条件付き UPDATE 1本で「未使用なら使用済みにする」を原子的に行い
+#   - 失効済みと分かった jti をプロセス内のスナップショットに保持して、再利用の試みはDBを引かずに弾く
+# ことで、通常のリフレッシュを 2 クエリ (消費の UPDATE + 新トークンの INSERT) に抑える。
+# 無効になった (削除中の) ユーザーのトークンは、UPDATE の条件で弾き、新しいアクセストークンを発行させない。
+
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import OutstandingRefreshToken
+
+
+class RevokedTokenFilter:
+    # 失効済み jti のプロセス内スナップショット (jti -> 有効期限のUNIX時刻)
+    # 含まれていれば確実に失効済みなのでDBを引かずに拒否できる。含まれていなくてもDBが最終判断する。
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, jti):
+        with self._lock:
+            exp = self._entries.get(jti)
+            if exp is None:
+                return False
+            if exp <= timezone.now().timestamp():
+                # 期限切れのトークンは署名検証の段階で弾かれるので保持しておく必要はない
+                del self._entries[jti]
+                return False
+            return True
+
+    def add(self, jti, exp):
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                self._prune_locked()
+            if len(self._entries) >= self.maxsize:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[jti] = exp
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked()
+
+    def _prune_locked(self):
+        now = timezone.now().timestamp()
+        for jti in [jti for jti, exp in self._entries.items() if exp <= now]:
+            del self._entries[jti]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+revoked_tokens = RevokedTokenFilter()
+
+
+def _expires_at(token):
+    return datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+
+
+def record_outstanding(token, user_id):
+    # 新しく発行したリフレッシュトークンを記録する
+    OutstandingRefreshToken.objects.create(
+        user_id=user_id,
+        jti=token[api_settings.JTI_CLAIM],
+        expires_at=_expires_at(token),
+    )
+
+
+async def arecord_outstanding(token, user_id):
+    await OutstandingRefreshToken.objects.acreate(
+        user_id=user_id,
+        jti=token[api_settings.JTI_CLAIM],
+        expires_at=_expires_at(token),
+    )
+
+
+def consume(token):
+    # リフレッシュトークンを使用済みにする。すでに使用済みなら TokenError を送出する
+    jti = token[api_settings.JTI_CLAIM]
+    if jti in revoked_tokens:
+        raise TokenError(_('Token is blacklisted'))
+
+    now = timezone.now()
+    updated = OutstandingRefreshToken.objects.filter(
+        jti=jti, blacklisted_at__isnull=True, user__is_active=True,
+    ).update(blacklisted_at=now)
+    if updated:
+        revoked_tokens.add(jti, token['exp'])
+        return
+
+    # 更新できなかった場合のみ、ユーザーが無効・削除済みか、使用済みか、
+    # 未記録 (この仕組みの導入前に発行されたトークン) かを確認する
+    user_id = token[api_settings.USER_ID_CLAIM]
+    if not get_user_model().objects.filter(pk=user_id, is_active=True).exists():
+        raise TokenError(_('User is inactive'))
+    try:
+        outstanding, created = OutstandingRefreshToken.objects.get_or_create(
+            jti=jti,
+            defaults={'user_id': user_id, 'expires_at': _expires_at(token), 'blacklisted_at': now},
+        )
+    except IntegrityError:
+        # 確認の直後にユーザーが削除された
+        raise TokenError(_('User is inactive'))
+    revoked_tokens.add(jti, token['exp'])
+    if not created:
+        raise TokenError(_('Token is blacklisted'))
+
+
+def revoke_user_tokens(user_id):
+    # ユーザーの未使用リフレッシュトークンをすべて失効させる (アカウント無効化時など)
+    return OutstandingRefreshToken.objects.filter(user_id=user_id, blacklisted_at__isnull=True).update(blacklisted_at=timezone.now())
+
+
+def prune_expired(now=None):
+    # 期限切れのトークン行を削除する (expires_at のインデックスを使う)
+    now = now or timezone.now()
+    revoked_tokens.prune()
+    deleted, _rows = OutstandingRefreshToken.objects.filter(expires_at__lte=now).delete()
+    return deleted
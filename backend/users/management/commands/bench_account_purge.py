@@ -0,0 +1,54 @@
+# AQUAFLUX/backend/users/management/commands/bench_account_purge.py
+# アカウント削除で書き込みのロックを取り続ける時間 (トランザクションの長さ) を、
+# ユーザーの delete() (CASCADE) とチャンクごとの削除 (users/purge.py) で比べる
+#   python manage.py bench_account_purge --logs 20000 --chunk-size 500
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from aquaflux_backend.bench import isolated_test_database
+from logs.models import AdviceRecord, LogEntry, LogEntryTombstone
+from users.models import AccountPurgeJob, CustomUser
+from users.purge import run_purge
+
+
+class Command(BaseCommand):
+    help = 'Compare write-lock hold time of a cascading user delete with the chunked background purge.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logs', type=int, default=20000, help='number of log entries owned by the user')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with isolated_test_database():
+            user = self.create_user('cascade', options['logs'])
+            started = time.perf_counter()
+            with transaction.atomic():
+                user.delete()
+            held = time.perf_counter() - started
+            self.stdout.write(f'cascade delete : 1 transaction, lock held {held * 1000:9.1f} ms')
+
+            user = self.create_user('chunked', options['logs'])
+            job = AccountPurgeJob.objects.create(user_id=user.pk, username=user.username)
+            transactions = []
+            started = time.perf_counter()
+            run_purge(job.pk, chunk_size=options['chunk_size'], on_chunk=lambda model, rows, seconds: transactions.append(seconds))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'chunked purge  : {len(transactions)} transactions, lock held at most {max(transactions) * 1000:9.1f} ms '
+                f'(mean {sum(transactions) / len(transactions) * 1000:.1f} ms, total {elapsed * 1000:.1f} ms)'
+            )
+
+    def create_user(self, username, logs):
+        # ログ・ログへのアドバイス・同期用の削除記録を持つユーザー
+        user = CustomUser.objects.create_user(username=username, password='bench-pass')
+        entries = LogEntry.objects.bulk_create(
+            LogEntry(user=user, water_data={'ph': 7.0, 'no3': 10}) for _ in range(logs)
+        )
+        AdviceRecord.objects.bulk_create(
+            AdviceRecord(user=user, log_entry=entry, advice='ok') for entry in entries[::10]
+        )
+        LogEntryTombstone.objects.bulk_create(LogEntryTombstone(user=user, log_id=i) for i in range(logs // 10))
+        return user
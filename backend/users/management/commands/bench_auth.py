@@ -0,0 +1,54 @@
+# AQUAFLUX/backend/users/management/commands/bench_auth.py
+# /api/logs/ のスループットを JWT 認証モード別に計測する
+#   python manage.py bench_auth --duration 5
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from aquaflux_backend.bench import isolated_test_database, measure_rps
+from logs.models import LogEntry
+from logs.views import LogEntryListCreateView
+from users.authentication import StatelessJWTAuthentication
+from users.models import CustomUser
+from users.serializers import ClaimsTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark /api/logs/ requests per second with the database and stateless JWT authentication modes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=3.0)
+        parser.add_argument('--logs', type=int, default=20, help='number of log entries owned by the user')
+
+    def handle(self, *args, **options):
+        modes = [
+            ('database', JWTAuthentication),
+            ('stateless', StatelessJWTAuthentication),
+        ]
+        with isolated_test_database():
+            user = CustomUser.objects.create_user(username='bench', email='bench@example.com', password='bench-pass')
+            LogEntry.objects.bulk_create(
+                LogEntry(user=user, water_data={'ph': 7.0, 'no3': 10}) for _ in range(options['logs'])
+            )
+            access = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+            original = LogEntryListCreateView.authentication_classes
+            try:
+                for name, auth_class in modes:
+                    LogEntryListCreateView.authentication_classes = [auth_class]
+
+                    # request_started で queries_log がリセットされるため、execute_wrapper で数える
+                    queries = []
+                    with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+                        response = client.get('/api/logs/')
+                    assert response.status_code == 200, response.content
+
+                    rps = measure_rps(lambda: client.get('/api/logs/'), duration=options['duration'])
+                    self.stdout.write(f'{name:10s} {rps:8.1f} req/s  ({len(queries)} queries/request)')
+            finally:
+                LogEntryListCreateView.authentication_classes = original
@@ -0,0 +1,51 @@
+# AQUAFLUX/backend/users/management/commands/bench_token_refresh.py
+# /api/users/token/refresh/ のスループットを計測する
+#   python manage.py bench_token_refresh --duration 5
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+
+from aquaflux_backend.bench import isolated_test_database, measure_rps
+from users.blacklist import revoked_tokens
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Benchmark refresh-token rotation throughput and the cost of rejecting a reused token.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=3.0)
+
+    def handle(self, *args, **options):
+        # 再利用トークンの 401 が大量にログ出力されないようにする
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with isolated_test_database():
+            CustomUser.objects.create_user(username='bench', email='bench@example.com', password='bench-pass')
+            client = APIClient()
+            response = client.post('/api/users/token/', {'username': 'bench', 'password': 'bench-pass'})
+            state = {'refresh': response.data['refresh']}
+
+            def rotate():
+                response = client.post('/api/users/token/refresh/', {'refresh': state['refresh']})
+                assert response.status_code == 200, response.content
+                state['refresh'] = response.data['refresh']
+
+            stale = state['refresh']
+            rotate()
+
+            def replay():
+                response = client.post('/api/users/token/refresh/', {'refresh': stale})
+                assert response.status_code == 401, response.content
+
+            for name, func in (('rotate', rotate), ('replay', replay)):
+                # request_started で queries_log がリセットされるため、execute_wrapper で数える
+                queries = []
+                with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+                    func()
+                rps = measure_rps(func, duration=options['duration'])
+                self.stdout.write(f'{name:8s} {rps:8.1f} req/s  ({len(queries)} queries/request)')
+
+            self.stdout.write(f'revoked jti snapshot size: {len(revoked_tokens)}')
@@ -0,0 +1,15 @@
+# AQUAFLUX/backend/users/management/commands/prune_refresh_tokens.py
+# 期限切れのリフレッシュトークン行を削除する (cron などで定期実行する想定)
+#   python manage.py prune_refresh_tokens
+
+from django.core.management.base import BaseCommand
+
+from users.blacklist import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired rows from the outstanding refresh token table.'
+
+    def handle(self, *args, **options):
+        deleted = prune_expired()
+        self.stdout.write(f'{deleted} expired refresh tokens deleted')
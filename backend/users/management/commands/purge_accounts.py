@@ -0,0 +1,34 @@
+# AQUAFLUX/backend/users/management/commands/purge_accounts.py
+# 削除を依頼されたアカウントのデータを削除する (ACCOUNT_PURGE_IN_PROCESS=0 の場合や、止まったジョブの引き継ぎに cron などで実行する)
+#   python manage.py purge_accounts
+#   python manage.py purge_accounts --retry-failed --chunk-size 1000
+
+from django.core.management.base import BaseCommand
+
+from users.models import AccountPurgeJob
+from users.purge import run_purge
+
+
+class Command(BaseCommand):
+    help = 'Run pending (or stalled) account purge jobs in bounded chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='rows per delete transaction (default: ACCOUNT_PURGE_CHUNK_SIZE)')
+        parser.add_argument('--retry-failed', action='store_true', help='also resume jobs that failed')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            AccountPurgeJob.objects.filter(status='failed').update(status='pending', error='')
+        finished = 0
+        for job_id in AccountPurgeJob.objects.exclude(status='done').values_list('pk', flat=True):
+            # 他のワーカーが処理中のジョブは run_purge が飛ばす
+            try:
+                job = run_purge(job_id, chunk_size=options['chunk_size'])
+            except Exception as e:
+                # ジョブは failed になる (--retry-failed で続きから再開できる)
+                self.stderr.write(f'job {job_id} failed: {e}')
+                continue
+            if job is not None:
+                self.stdout.write(f'{job.username} (user {job.user_id}): {job.deleted} rows deleted')
+                finished += 1
+        self.stdout.write(f'{finished} accounts purged')
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-19 12:42
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_outstandingrefreshtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountPurgeJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('user_id', models.BigIntegerField(unique=True)),
+                ('username', models.CharField(max_length=150)),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '削除中'), ('done', '完了'), ('failed', '失敗')], db_index=True, default='pending', max_length=20)),
+                ('total', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('deleted', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'アカウント削除',
+                'verbose_name_plural': 'アカウント削除',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 
 class CustomUser(AbstractUser):
@@ -9,4 +12,64 @@ class CustomUser(AbstractUser):
 
     def __str__(self):
         return self.username
-# Create your models here.
+
+
+# 発行済みのリフレッシュトークン (ローテーション時の失効管理に使う)
+class OutstandingRefreshToken(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='refresh_tokens')
+    # トークンの一意なID (jtiクレーム)。失効チェックはこの一意インデックスだけで完結する
+    jti = models.CharField(max_length=255, unique=True)
+    # 期限切れの行は prune_refresh_tokens でまとめて削除する
+    expires_at = models.DateTimeField(db_index=True)
+    # 使用済み (ブラックリスト入り) になった日時。NULL なら未使用
+    blacklisted_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'リフレッシュトークン'
+        verbose_name_plural = 'リフレッシュトークン'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.jti}"
+
+
+# アカウント削除のバックグラウンド処理 (users/purge.py)
+# ユーザーを削除した後も進捗を返せるよう、ユーザーへの外部キーではなくIDを持つ
+class AccountPurgeJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', '待機中'),
+        ('running', '削除中'),
+        ('done', '完了'),
+        ('failed', '失敗'),
+    ]
+
+    # 進捗の確認用のURLに使う (ログインできなくなった本人が確認するため、推測できないIDにする)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_id = models.BigIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    total = models.PositiveBigIntegerField(blank=True, null=True)  # 削除を始めた時点の対象の行数
+    deleted = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # 削除中は1チャンクごとに更新する (止まったままのジョブを purge_accounts で引き継ぐ目安)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'アカウント削除'
+        verbose_name_plural = 'アカウント削除'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.username} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        # 0.0〜1.0 (対象の行数を数える前は None)
+        if self.status == 'done':
+            return 1.0
+        if not self.total:
+            return None if self.total is None else 0.0
+        return min(self.deleted / self.total, 1.0)
@@ -0,0 +1,14 @@
+# AQUAFLUX/backend/users/permissions.py
+
+from rest_framework.permissions import BasePermission
+
+from .authentication import get_full_user
+
+
+class IsStaffUser(BasePermission):
+    # 管理者 (is_staff) のみ許可する
+    # トークンのクレームだけの ClaimsUser は is_staff を持たないので、フルのユーザーで判定する
+    def has_permission(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return False
+        return bool(get_full_user(request.user).is_staff)
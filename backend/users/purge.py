@@ -0,0 +1,147 @@
+# AQUAFLUX/backend/users/purge.py
+# アカウント削除を、ユーザーの無効化 (すぐ) とデータの削除 (バックグラウンド) に分ける
+#
+# ユーザーを delete() すると、Django は CASCADE でたどれる全ての行 (飼育ログなど) を読み込んでから
+# 1つのトランザクションで削除するので、ログの多いユーザーでは長い時間書き込みのロックを取り続ける。
+# ここでは
+#   - 削除の依頼時は、ユーザーを無効にしてリフレッシュトークンを失効させ、AccountPurgeJob を作るだけにし
+#   - ユーザーを参照する行を ACCOUNT_PURGE_CHUNK_SIZE 件ずつ、チャンクごとの短いトランザクションで削除してから
+#   - 参照する行がほぼ残っていないユーザーを最後に削除する
+# 削除はリクエストを処理したプロセスのスレッドで始める。プロセスが止まった場合などは purge_accounts で引き継ぐ
+# (チャンクごとにコミットするので、途中から再開しても同じ行を二重に数えない)
+#
+# 発行済みのアクセストークンはDBを引かずに受け付けられる (users/authentication.py) ので、削除の依頼時に
+# revoke_user_access で「このユーザーのトークンは拒否する」印をアクセストークンの有効期限の間だけ置く。
+# 依頼の後やユーザーの削除の後に古いアクセストークンでログを作ることはできない
+
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, models, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .authentication import revoke_user_access, user_cache
+from .blacklist import revoke_user_tokens
+from .models import AccountPurgeJob
+
+
+def request_account_deletion(user):
+    # ユーザーを無効にして削除のジョブを登録する (同じユーザーの2回目以降の依頼は、既存のジョブを返す)
+    with transaction.atomic():
+        get_user_model().objects.filter(pk=user.pk).update(is_active=False)
+        revoke_user_tokens(user.pk)
+        job, created = AccountPurgeJob.objects.get_or_create(user_id=user.pk, defaults={'username': user.username})
+        if created:
+            transaction.on_commit(lambda: start_purge(job.pk))
+    revoke_user_access(user.pk)
+    user_cache.delete(user.pk)
+    return job
+
+
+def start_purge(job_id):
+    if not getattr(settings, 'ACCOUNT_PURGE_IN_PROCESS', True):
+        return
+    threading.Thread(target=_purge_in_thread, args=(job_id,), name=f'account-purge-{job_id}', daemon=True).start()
+
+
+def _purge_in_thread(job_id):
+    try:
+        run_purge(job_id)
+    finally:
+        connections.close_all()  # このスレッドのDB接続を閉じる
+
+
+def purge_plan(user_id):
+    # ユーザーを CASCADE で参照するモデルと、その行を置くDB (シャードなど) の組を、削除する順に返す
+    # 他の削除対象を参照するモデル (ログを参照するアドバイスなど) を先にし、チャンクの削除で CASCADE が起きないようにする
+    user_model = get_user_model()
+    relations = [
+        rel for rel in user_model._meta.related_objects
+        if not rel.many_to_many and rel.on_delete is models.CASCADE
+    ]
+    targets = {rel.related_model for rel in relations}
+    depends = {
+        model: {
+            field.related_model for field in model._meta.concrete_fields
+            if field.is_relation and field.related_model in targets and field.related_model is not model
+        }
+        for model in targets
+    }
+    ordered = []
+    while depends:
+        # 残りのどのモデルからも参照されていないものから順に取り出す
+        ready = [model for model in depends if not any(model in refs for other, refs in depends.items() if other is not model)]
+        if not ready:
+            ready = list(depends)  # 循環している場合は、残りを CASCADE に任せる
+        for model in sorted(ready, key=lambda model: model._meta.label):
+            ordered.append(model)
+            del depends[model]
+    fields = {rel.related_model: rel.field for rel in relations}
+    return [
+        (model, fields[model], router.db_for_write(model, user_id=user_id))
+        for model in ordered
+    ]
+
+
+def _targets(model, field, using, user_id):
+    return model._base_manager.using(using).filter(**{field.attname: user_id})
+
+
+def claim_job(job_id):
+    # 待機中のジョブか、更新が ACCOUNT_PURGE_STALE_SECONDS 秒以上止まっている削除中のジョブを、条件付き UPDATE で引き受ける
+    # (複数のワーカーが同じジョブを処理しないようにする)
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'ACCOUNT_PURGE_STALE_SECONDS', 300))
+    return AccountPurgeJob.objects.filter(
+        Q(status='pending') | Q(status='running', updated_at__lt=stale),
+        pk=job_id,
+    ).update(status='running', updated_at=now) == 1
+
+
+def run_purge(job_id, chunk_size=None, on_chunk=None):
+    # ジョブのユーザーのデータをチャンクごとに削除する
+    # on_chunk(model, rows, seconds) はチャンクのトランザクションごとに呼ばれる (計測用)
+    # 他のワーカーが処理中・処理済みのジョブであれば何もしない (None を返す)
+    if not claim_job(job_id):
+        return None
+    chunk_size = chunk_size or getattr(settings, 'ACCOUNT_PURGE_CHUNK_SIZE', 500)
+    job = AccountPurgeJob.objects.get(pk=job_id)
+    plan = purge_plan(job.user_id)
+    try:
+        if job.total is None:
+            total = sum(_targets(model, field, using, job.user_id).count() for model, field, using in plan)
+            AccountPurgeJob.objects.filter(pk=job.pk).update(total=total, started_at=timezone.now())
+
+        for model, field, using in plan:
+            queryset = _targets(model, field, using, job.user_id).order_by('pk')
+            while True:
+                pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+                if not pks:
+                    break
+                started = time.perf_counter()
+                with transaction.atomic(using=using):
+                    model._base_manager.using(using).filter(pk__in=pks).delete()
+                if on_chunk is not None:
+                    on_chunk(model, len(pks), time.perf_counter() - started)
+                AccountPurgeJob.objects.filter(pk=job.pk).update(deleted=F('deleted') + len(pks), updated_at=timezone.now())
+
+        # 参照する行を消した後なので、ユーザーの削除 (と残りの CASCADE) は短く終わる
+        started = time.perf_counter()
+        with transaction.atomic():
+            user = get_user_model().objects.filter(pk=job.user_id).first()
+            if user is not None:
+                user.delete()
+        revoke_user_access(job.user_id)  # purge_accounts で引き継いだ場合も、期限内のトークンを拒否し続ける
+        if on_chunk is not None:
+            on_chunk(get_user_model(), 1, time.perf_counter() - started)
+        user_cache.delete(job.user_id)
+    except Exception as e:
+        AccountPurgeJob.objects.filter(pk=job.pk).update(status='failed', error=f'{type(e).__name__}: {e}')
+        raise
+    AccountPurgeJob.objects.filter(pk=job.pk).update(status='done', finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
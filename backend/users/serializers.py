@@ -1,7 +1,13 @@
 # AQUAFLUX/backend/users/serializers.py
 
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
 from rest_framework import serializers 
-from .models import CustomUser
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .models import AccountPurgeJob, CustomUser
+from . import blacklist
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,3 +23,74 @@ class UserSerializer(serializers.ModelSerializer):
             password=validated_data['password']
         )
         return user
+
+    async def acreate(self, validated_data):
+        # 非同期のビュー用 (create_user と同じ内容)。パスワードのハッシュ化は CPU を使うので、イベントループの外のスレッドで行う
+        user = CustomUser(
+            username=CustomUser.normalize_username(validated_data['username']),
+            email=CustomUser.objects.normalize_email(validated_data['email']),
+        )
+        user.password = await sync_to_async(make_password, thread_sensitive=False)(validated_data['password'])
+        await user.asave()
+        return user
+
+
+# ログイン時に発行するトークンにユーザー名と有効フラグを埋め込む
+# (StatelessJWTAuthentication がDBを引かずにユーザーを組み立てるために使う)
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = cls.build_token(user)
+        # ローテーション時に失効させられるよう、発行したリフレッシュトークンを記録する
+        blacklist.record_outstanding(token, user.pk)
+        return token
+
+    @classmethod
+    def build_token(cls, user):
+        # 記録はしない (非同期のビューは arecord_outstanding で記録する)
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_active'] = user.is_active
+        return token
+
+
+# リフレッシュトークンのローテーション
+# 使用したトークンを失効させ (条件付きUPDATE 1本)、新しいトークンを記録する
+class RotatingTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        try:
+            refresh = self.token_class(attrs['refresh'])
+            if api_settings.ROTATE_REFRESH_TOKENS and api_settings.BLACKLIST_AFTER_ROTATION:
+                blacklist.consume(refresh)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                blacklist.record_outstanding(refresh, refresh[api_settings.USER_ID_CLAIM])
+
+            data['refresh'] = str(refresh)
+
+        return data
+
+
+# アカウント削除の進捗 (GET /api/users/deletion/<id>/)
+class AccountPurgeJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = AccountPurgeJob
+        fields = ('id', 'status', 'total', 'deleted', 'progress', 'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
+
+
+# ログインの入力 (非同期のログイン用。検証でDBを引かない)
+class CredentialsSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(trim_whitespace=False)
+
@@ -1,3 +1,276 @@
-from django.test import TestCase
+# AQUAFLUX/backend/users/tests.py
+
+from django.db import connection
+from django.urls import reverse
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from datetime import timedelta
+from django.utils import timezone
+from unittest.mock import patch
+
+from .authentication import ClaimsUser, StatelessJWTAuthentication, get_full_user, user_cache
+from .blacklist import prune_expired, revoked_tokens
+from .models import AccountPurgeJob, CustomUser, OutstandingRefreshToken
+from .purge import purge_plan, run_purge
+from django.core.management import call_command
+from django.core.cache import cache
+from asgiref.sync import async_to_sync
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from logs.models import AdviceRecord, LogEntry, Tank
+import io
+
+
+class StatelessJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'aqua', 'password': 'pass-1234-word'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.access = response.data['access']
+
+    def authenticate(self, raw_token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {raw_token}')
+        return StatelessJWTAuthentication().authenticate(request)
+
+    # --- トークンにユーザー名と有効フラグが埋め込まれているか ---
+    def test_access_token_contains_claims(self):
+        token = AccessToken(self.access)
+        self.assertEqual(token['username'], 'aqua')
+        self.assertTrue(token['is_active'])
+
+    # --- DBを引かずに軽量ユーザーが組み立てられるか ---
+    def test_authenticate_without_user_query(self):
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(self.access)
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user.username, 'aqua')
+
+    # --- 無効化されたユーザーのトークンは拒否されるか ---
+    def test_inactive_claim_rejected(self):
+        token = AccessToken.for_user(self.user)
+        token['username'] = 'aqua'
+        token['is_active'] = False
+        with self.assertRaises(Exception):
+            self.authenticate(str(token))
+
+    # --- クレームのない古いトークンはフルのユーザーにフォールバックするか ---
+    def test_legacy_token_falls_back_to_cached_user(self):
+        legacy = str(AccessToken.for_user(self.user))
+        user, _ = self.authenticate(legacy)
+        self.assertIsInstance(user, CustomUser)
+        with self.assertNumQueries(0):
+            self.authenticate(legacy)
+
+    # --- フルのユーザーはTTLキャッシュから返されるか ---
+    def test_get_full_user_is_cached(self):
+        claims_user, _ = self.authenticate(self.access)
+        self.assertEqual(get_full_user(claims_user).email, 'aqua@example.com')
+        with self.assertNumQueries(0):
+            get_full_user(claims_user)
+
+    # --- /api/logs/ の一覧取得でユーザーテーブルを読まないか ---
+    def test_logs_list_skips_user_lookup(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        # request_started で queries_log がリセットされるため、execute_wrapper で記録する
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+            response = self.client.get('/api/logs/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(queries)
+        self.assertFalse(any('users_customuser' in sql for sql in queries))
+
+
+class RefreshTokenBlacklistTest(APITestCase):
+    def setUp(self):
+        revoked_tokens.clear()
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'aqua', 'password': 'pass-1234-word'})
+        self.refresh = response.data['refresh']
+        self.url = reverse('token_refresh')
+
+    # --- ログイン時にリフレッシュトークンが記録されるか ---
+    def test_obtain_records_outstanding_token(self):
+        jti = RefreshToken(self.refresh)['jti']
+        self.assertTrue(OutstandingRefreshToken.objects.filter(jti=jti, blacklisted_at__isnull=True).exists())
+
+    # --- ローテーション後、古いトークンは使えなくなるか ---
+    def test_rotation_revokes_old_token(self):
+        response = self.client.post(self.url, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh', response.data)
+
+        # プロセス内スナップショットに載っていればDBを引かずに拒否する
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # 別プロセス (スナップショットなし) でもDBで拒否される
+        revoked_tokens.clear()
+        response = self.client.post(self.url, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # --- 新しいトークンは続けて使えるか ---
+    def test_rotated_token_can_be_used(self):
+        first = self.client.post(self.url, {'refresh': self.refresh}).data['refresh']
+        response = self.client.post(self.url, {'refresh': first})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # --- 導入前に発行された (未記録の) トークンは1回だけ使えるか ---
+    def test_unrecorded_token_is_consumed_once(self):
+        legacy = str(RefreshToken.for_user(self.user))
+        self.assertEqual(self.client.post(self.url, {'refresh': legacy}).status_code, status.HTTP_200_OK)
+        revoked_tokens.clear()
+        self.assertEqual(self.client.post(self.url, {'refresh': legacy}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # --- 無効になったユーザー・削除済みのユーザーのトークンでは、新しいトークンを発行せず401を返すか ---
+    def test_inactive_or_deleted_user_cannot_refresh(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post(self.url, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(OutstandingRefreshToken.objects.filter(blacklisted_at__isnull=False).exists())
+
+        # 未記録のトークンを、ユーザーの削除後にスナップショットのないプロセスへ送る
+        gone = CustomUser.objects.create_user(username='gone', password='pass-1234-word')
+        legacy = str(RefreshToken.for_user(gone))
+        gone.delete()
+        revoked_tokens.clear()
+        response = self.client.post(self.url, {'refresh': legacy})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(OutstandingRefreshToken.objects.filter(jti=RefreshToken(legacy, verify=False)['jti']).count(), 0)
+
+    # --- 期限切れの行が削除されるか ---
+    def test_prune_expired(self):
+        OutstandingRefreshToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(prune_expired(), 1)
+        self.assertFalse(OutstandingRefreshToken.objects.exists())
+
+
+class AccountDeletionTest(APITestCase):
+    def setUp(self):
+        revoked_tokens.clear()
+        user_cache.clear()
+        cache.clear()
+        self.addCleanup(cache.clear)  # 拒否の印を後のテストの (同じ id の) ユーザーに残さない
+        self.user = CustomUser.objects.create_user(username='aqua', email='aqua@example.com', password='pass-1234-word')
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'aqua', 'password': 'pass-1234-word'})
+        self.refresh = response.data['refresh']
+        self.access = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        tank = Tank.objects.create(user=self.user, name='水草水槽')
+        logs = [LogEntry.objects.create(user=self.user, tank=tank, water_data={'ph': 7.0}) for _ in range(5)]
+        AdviceRecord.objects.create(user=self.user, log_entry=logs[0], advice='ok')
+        self.other = CustomUser.objects.create_user(username='other', password='pass-1234-word')
+        LogEntry.objects.create(user=self.other, water_data={'ph': 7.0})
+
+    # --- 削除を依頼するとすぐに無効になり、ログイン・トークンの更新ができなくなるか ---
+    def test_request_deactivates_immediately(self):
+        response = self.client.delete(reverse('account-delete'), {'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with patch('users.purge.start_purge') as start_purge, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.delete(reverse('account-delete'), {'password': 'pass-1234-word'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.data['status_url'].endswith(f"/api/users/deletion/{response.data['id']}/"))
+        self.assertEqual(len(callbacks), 1)
+        start_purge.assert_called_once()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(LogEntry.objects.filter(user=self.user).count(), 5)  # データの削除はバックグラウンド
+
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': self.refresh}).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'aqua', 'password': 'pass-1234-word'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # 進捗はログインせずに確認できる
+        self.client.credentials()
+        response = self.client.get(reverse('account-deletion-status', args=[AccountPurgeJob.objects.get().pk]))
+        self.assertEqual(response.data['status'], 'pending')
+
+    # --- 削除の依頼後とユーザーの削除後は、古いアクセストークンでログを読み書きできないか ---
+    def test_old_access_token_rejected_after_deletion(self):
+        logs_url = reverse('logentry-list-create')
+        self.assertEqual(self.client.get(logs_url).status_code, status.HTTP_200_OK)
+        with patch('users.purge.start_purge'):
+            self.client.delete(reverse('account-delete'), {'password': 'pass-1234-word'}, format='json')
+        self.assertEqual(self.client.get(logs_url).status_code, status.HTTP_401_UNAUTHORIZED)
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        with self.assertRaises(AuthenticationFailed):
+            async_to_sync(StatelessJWTAuthentication().aauthenticate)(request)
+
+        run_purge(AccountPurgeJob.objects.get().pk)
+        self.assertEqual(self.client.get(logs_url).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(logs_url, {'water_data': {'ph': 7.0}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(LogEntry.objects.filter(user_id=self.user.pk).exists())
+
+    # --- 参照する行から順に、チャンクごとのトランザクションで削除し、進捗を記録するか ---
+    def test_chunked_purge(self):
+        models = [model for model, _, _ in purge_plan(self.user.pk)]
+        self.assertLess(models.index(AdviceRecord), models.index(LogEntry))
+        self.assertLess(models.index(LogEntry), models.index(Tank))
+
+        job = AccountPurgeJob.objects.create(user_id=self.user.pk, username=self.user.username)
+        chunks = []
+        job = run_purge(job.pk, chunk_size=2, on_chunk=lambda model, rows, seconds: chunks.append((model, rows)))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.deleted, job.total)
+        self.assertTrue(all(rows <= 2 for _, rows in chunks))
+        self.assertEqual(chunks[-1], (CustomUser, 1))
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(LogEntry.objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(LogEntry.objects.filter(user=self.other).count(), 1)
+        # 完了したジョブをもう一度処理しない
+        self.assertIsNone(run_purge(job.pk))
+
+    # --- purge_accounts は待機中と止まったジョブを処理し、他のワーカーが処理中のジョブは飛ばすか ---
+    def test_purge_accounts_command(self):
+        AccountPurgeJob.objects.create(user_id=self.user.pk, username='aqua')
+        busy = AccountPurgeJob.objects.create(user_id=self.other.pk, username='other', status='running')
+        call_command('purge_accounts', stdout=io.StringIO())
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertTrue(CustomUser.objects.filter(pk=self.other.pk).exists())
+
+        AccountPurgeJob.objects.filter(pk=busy.pk).update(updated_at=timezone.now() - timedelta(minutes=10))
+        call_command('purge_accounts', stdout=io.StringIO())
+        self.assertFalse(CustomUser.objects.filter(pk=self.other.pk).exists())
+
+
+@override_settings(ROOT_URLCONF='aquaflux_backend.asgi_urls')
+class AsyncUserViewTest(TestCase):
+    # --- 非同期のユーザー登録とログインで、同期のビューと同じトークンが発行されるか ---
+    async def test_register_and_obtain_token(self):
+        response = await self.async_client.post('/api/users/register/', {'username': 'aqua', 'email': 'Aqua@EXAMPLE.com', 'password': 'pass-1234-word'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('password', response.json())
+        user = await CustomUser.objects.aget(username='aqua')
+        self.assertEqual(user.email, 'Aqua@example.com')
+        self.assertTrue(await user.acheck_password('pass-1234-word'))
+
+        response = await self.async_client.post('/api/users/register/', {'username': 'aqua', 'email': 'aqua@example.com', 'password': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = await self.async_client.post('/api/users/token/', {'username': 'aqua', 'password': 'pass-1234-word'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = AccessToken(response.json()['access'])
+        self.assertEqual((access['username'], access['is_active']), ('aqua', True))
+        jti = RefreshToken(response.json()['refresh'])['jti']
+        self.assertTrue(await OutstandingRefreshToken.objects.filter(jti=jti, user=user).aexists())
+
+    # --- パスワードの誤り・存在しないユーザー・無効なユーザーは401、入力の不足は400になるか ---
+    async def test_obtain_token_rejects(self):
+        user = await CustomUser.objects.acreate(username='aqua', password=make_password('pass-1234-word'))
+        for username, password in (('aqua', 'wrong'), ('nobody', 'pass-1234-word')):
+            response = await self.async_client.post('/api/users/token/', {'username': username, 'password': password}, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        user.is_active = False
+        await user.asave()
+        response = await self.async_client.post('/api/users/token/', {'username': 'aqua', 'password': 'pass-1234-word'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.post('/api/users/token/', {'username': 'aqua'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-# Create your tests here.
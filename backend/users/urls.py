@@ -3,12 +3,14 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,    # ユーザー名とパスワードからトークンを取得するビュー（ログイン用）
     TokenRefreshView,       # リフレッシュトークンを使ってアクセストークンを更新するビュー
 )
-from .views import UserRegisterView, ProtectedView
+from .views import UserRegisterView, ProtectedView, AccountDeleteView, AccountDeletionStatusView
 
 urlpatterns = [
     path('register/', UserRegisterView.as_view(), name='register'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('me/', AccountDeleteView.as_view(), name='account-delete'),
+    path('deletion/<uuid:pk>/', AccountDeletionStatusView.as_view(), name='account-deletion-status'),
 
     path('protected/', ProtectedView.as_view(), name='protected_test'),
 ]
\ No newline at end of file
@@ -1,10 +1,20 @@
 from django.shortcuts import render
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import update_last_login
 from rest_framework import generics, status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .serializers import UserSerializer
-from .models import CustomUser
+from rest_framework.reverse import reverse
+from rest_framework_simplejwt.serializers import TokenObtainSerializer
+from rest_framework_simplejwt.settings import api_settings
+from aquaflux_backend.async_api import AsyncAPIViewMixin
+from .serializers import AccountPurgeJobSerializer, ClaimsTokenObtainPairSerializer, CredentialsSerializer, UserSerializer
+from .models import AccountPurgeJob, CustomUser
+from .authentication import aauthenticate_credentials, get_full_user
+from . import blacklist
+from .purge import request_account_deletion
 
 
 class UserRegisterView(generics.CreateAPIView):
@@ -13,6 +23,39 @@ class UserRegisterView(generics.CreateAPIView):
     permission_classes = [AllowAny]
 
 
+# ユーザー登録・ログインの非同期版 (ASGI で動かす場合に使う。aquaflux_backend/asgi_urls.py)
+class AsyncUserRegisterView(AsyncAPIViewMixin, UserRegisterView):
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # ユーザー名の重複の確認は DB を引くので、検証は同期のコードとして呼ぶ
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        serializer.instance = await serializer.acreate(serializer.validated_data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+
+# POST /api/users/token/ の非同期版 (TokenObtainPairView + ClaimsTokenObtainPairSerializer と同じトークンを返す)
+class AsyncTokenObtainPairView(AsyncAPIViewMixin, APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    www_authenticate_realm = 'api'
+
+    def get_authenticate_header(self, request):
+        # TokenViewBase と同じく、ログインの失敗を 403 ではなく 401 で返す
+        return f'{api_settings.AUTH_HEADER_TYPES[0]} realm="{self.www_authenticate_realm}"'
+
+    async def post(self, request, *args, **kwargs):
+        credentials = CredentialsSerializer(data=request.data)
+        credentials.is_valid(raise_exception=True)
+        user = await aauthenticate_credentials(**credentials.validated_data)
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(TokenObtainSerializer.default_error_messages['no_active_account'], 'no_active_account')
+        refresh = ClaimsTokenObtainPairSerializer.build_token(user)
+        await blacklist.arecord_outstanding(refresh, user.pk)
+        if api_settings.UPDATE_LAST_LOGIN:
+            await sync_to_async(update_last_login)(None, user)
+        return Response({'refresh': str(refresh), 'access': str(refresh.access_token)}, status=status.HTTP_200_OK)
+
+
 # ユーザーログインAPI
 #class LoginView(ObtainAuthToken):
     #serializer_class = LoginSerializer
@@ -38,9 +81,35 @@ class ProtectedView(APIView):
 
     def get(self, request):
         # 認証されたユーザーの情報を使ってレスポンスを返す
+        # email はトークンに含まれないため、TTLキャッシュ経由でフルのユーザーを取得する
+        user = get_full_user(request.user)
         return Response({
             "message": "このメッセージは認証済みユーザーのみ見れます！",
-            "user_id": request.user.id,
-            "username": request.user.username,
-            "email": request.user.email,
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            "user_id": user.id,
+            "username": user.username,
+            "email": user.email,
+        }, status=status.HTTP_200_OK)
+
+
+# アカウント削除 (DELETE /api/users/me/ 本文: {"password": "..."})
+# ユーザーをすぐに無効にし (以降はログイン・トークンの更新ができない)、データの削除はバックグラウンドで行う (users/purge.py)
+# 進捗は返される status_url で、ログインせずに確認できる
+class AccountDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request):
+        user = get_full_user(request.user)
+        if not user.check_password(request.data.get('password') or ''):
+            return Response({'password': ['パスワードが正しくありません。']}, status=status.HTTP_400_BAD_REQUEST)
+        job = request_account_deletion(user)
+        data = AccountPurgeJobSerializer(job).data
+        data['status_url'] = reverse('account-deletion-status', args=[job.pk], request=request)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+# アカウント削除の進捗 (GET /api/users/deletion/<id>/)
+class AccountDeletionStatusView(generics.RetrieveAPIView):
+    queryset = AccountPurgeJob.objects.all()
+    serializer_class = AccountPurgeJobSerializer
+    permission_classes = [AllowAny]  # ジョブのIDは推測できない UUID
+
@@ -0,0 +1,221 @@
+# AquaFlux/frontend/api_client.py
+# Django API 用のアプリ共通の非同期HTTPクライアント
+#
+# - httpx.AsyncClient を1つだけ使い回し、keep-alive でコネクションをプールする
+# - すべてのリクエストにタイムアウトを設定する (イベントループを塞がない)
+# - app.storage.user のアクセストークンを Bearer ヘッダーとして自動で付与する
+# - 401 はここでまとめて処理する (リフレッシュトークンで1回だけ再取得し、だめならログイン画面へ)
+#   同時に 401 になったリクエスト (一覧の取得と変更通知の購読など) がそれぞれリフレッシュすると、
+#   ローテーション済みのリフレッシュトークンを2回目に送って失効させてしまうので、リフレッシュは1つずつ行う
+# - Server-Sent Events の購読 (events) は接続を張ったままにするので、コネクションプールを分ける
+
+import asyncio
+import json
+import weakref
+
+import httpx
+from nicegui import app, ui
+
+
+class ApiError(Exception):
+    # APIの呼び出しに失敗したときの例外
+    # status_code は接続エラーなどレスポンスがない場合 None になる
+    def __init__(self, message, status_code=None, data=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.data = data if isinstance(data, dict) else {}
+
+    @property
+    def detail(self):
+        return self.data.get('detail', str(self))
+
+
+class AuthenticationRequired(ApiError):
+    # ログインしていない、またはトークンの再取得に失敗した
+    pass
+
+
+class ApiClient:
+    DEFAULT_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+    LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+    # サーバーは通知がない間も15秒ごとにコメントを送るので、読み取りがそれより長く止まれば切れたとみなす
+    STREAM_TIMEOUT = httpx.Timeout(5.0, read=45.0)
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._client = None
+        self._stream_client = None
+        # リフレッシュトークンごとのロック (待っているリクエストがなくなれば消える)
+        self._refresh_locks = weakref.WeakValueDictionary()
+
+    @property
+    def client(self):
+        # 最初の呼び出し時に作成する (イベントループの起動後に作る必要があるため)
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.DEFAULT_TIMEOUT,
+                limits=self.LIMITS,
+            )
+        return self._client
+
+    @property
+    def stream_client(self):
+        # 開いているページの数だけ接続を張るので、上限を設けない
+        if self._stream_client is None or self._stream_client.is_closed:
+            self._stream_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.STREAM_TIMEOUT,
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=0),
+            )
+        return self._stream_client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._stream_client is not None:
+            await self._stream_client.aclose()
+            self._stream_client = None
+
+    async def request(self, method, path, *, auth=True, **kwargs):
+        headers = dict(kwargs.pop('headers', None) or {})
+        if auth:
+            access_token = app.storage.user.get('access_token')
+            if not access_token:
+                self.handle_unauthorized()
+                raise AuthenticationRequired('ログインしていません。', status_code=401)
+            headers['Authorization'] = f'Bearer {access_token}'
+
+        response = await self._send(method, path, headers=headers, **kwargs)
+
+        if response.status_code == 401 and auth:
+            # アクセストークンの期限切れであれば、リフレッシュして1回だけ再送する
+            if await self.refresh_access_token(access_token):
+                headers['Authorization'] = f"Bearer {app.storage.user.get('access_token')}"
+                response = await self._send(method, path, headers=headers, **kwargs)
+            if response.status_code == 401:
+                self.handle_unauthorized()
+                raise AuthenticationRequired('認証エラー: ログインし直してください。', status_code=401, data=_json_or_empty(response))
+
+        return response
+
+    async def request_json(self, method, path, **kwargs):
+        # 2xx 以外は ApiError に変換し、レスポンスのJSONを返す
+        response = await self.request(method, path, **kwargs)
+        data = _json_or_empty(response)
+        if response.is_error:
+            raise ApiError(f'HTTP {response.status_code}', status_code=response.status_code, data=data)
+        return data
+
+    async def get(self, path, **kwargs):
+        return await self.request_json('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request_json('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request_json('PUT', path, **kwargs)
+
+    async def patch(self, path, **kwargs):
+        return await self.request_json('PATCH', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request_json('DELETE', path, **kwargs)
+
+    async def events(self, path):
+        # Server-Sent Events を購読し、(イベント名, データ) を順に返す
+        # 最初の行 (サーバーが購読を始めてから送る retry) を受け取ったら ('open', None) を返す
+        # サーバーが接続を閉じると終わるので、呼び出し側でつなぎ直す
+        for retry in (True, False):
+            access_token = app.storage.user.get('access_token')
+            if not access_token:
+                self.handle_unauthorized()
+                raise AuthenticationRequired('ログインしていません。', status_code=401)
+            headers = {'Authorization': f'Bearer {access_token}', 'Accept': 'text/event-stream'}
+            try:
+                async with self.stream_client.stream('GET', path, headers=headers) as response:
+                    if response.status_code == 401:
+                        if retry and await self.refresh_access_token(access_token):
+                            continue
+                        self.handle_unauthorized()
+                        raise AuthenticationRequired('認証エラー: ログインし直してください。', status_code=401)
+                    if response.is_error:
+                        raise ApiError(f'HTTP {response.status_code}', status_code=response.status_code)
+                    event, data = 'message', []
+                    opened = False
+                    async for line in response.aiter_lines():
+                        if not opened:
+                            opened = True
+                            yield 'open', None
+                        if not line:
+                            # 空行でイベントが区切られる
+                            if data:
+                                yield event, json.loads('\n'.join(data))
+                            event, data = 'message', []
+                        elif not line.startswith(':'):  # ':' で始まる行は接続維持用のコメント
+                            field, _, value = line.partition(':')
+                            value = value[1:] if value.startswith(' ') else value
+                            if field == 'event':
+                                event = value
+                            elif field == 'data':
+                                data.append(value)
+                    return
+            except httpx.TimeoutException as e:
+                raise ApiError('APIサーバーからの応答がタイムアウトしました。') from e
+            except httpx.TransportError as e:
+                raise ApiError('APIサーバーに接続できません。') from e
+
+    async def refresh_access_token(self, stale_access_token=None):
+        # stale_access_token は 401 になったリクエストで送ったアクセストークン
+        refresh_token = app.storage.user.get('refresh_token')
+        if not refresh_token:
+            return False
+        lock = self._refresh_locks.get(refresh_token)
+        if lock is None:
+            lock = self._refresh_locks[refresh_token] = asyncio.Lock()
+        async with lock:
+            access_token = app.storage.user.get('access_token')
+            if stale_access_token is not None and access_token and access_token != stale_access_token:
+                # 待っている間に他のリクエストがリフレッシュを済ませた (新しいアクセストークンで再送する)
+                return True
+            return await self._refresh(app.storage.user.get('refresh_token'))
+
+    async def _refresh(self, refresh_token):
+        if not refresh_token:
+            return False
+        try:
+            response = await self._send('POST', '/users/token/refresh/', json={'refresh': refresh_token})
+        except ApiError:
+            return False
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        app.storage.user['access_token'] = data['access']
+        if 'refresh' in data:
+            # ローテーションされた新しいリフレッシュトークンを保存する
+            app.storage.user['refresh_token'] = data['refresh']
+        return True
+
+    def handle_unauthorized(self):
+        for key in ('access_token', 'refresh_token', 'username'):
+            app.storage.user.pop(key, None)
+        ui.notify('ログインしてください。', type='negative')
+        ui.navigate.to('/login')
+
+    async def _send(self, method, path, **kwargs):
+        try:
+            return await self.client.request(method, path, **kwargs)
+        except httpx.TimeoutException as e:
+            raise ApiError('APIサーバーからの応答がタイムアウトしました。') from e
+        except httpx.TransportError as e:
+            raise ApiError('APIサーバーに接続できません。') from e
+
+
+def _json_or_empty(response):
+    if not response.content:
+        return {}
+    try:
+        return response.json()
+    except ValueError:
+        return {}
@@ -1,12 +1,63 @@
-from nicegui import ui, app
-import requests
+from nicegui import ui, app, background_tasks
+import asyncio
 import os
 import json # water_data の表示のために追加
 import functools
+from api_client import ApiClient, ApiError, AuthenticationRequired
 
 # DjangoバックエンドのAPIベースURL
 DJANGO_API_BASE_URL = os.environ.get("DJANGO_API_BASE_URL", "http://web:8000/api")
 
+# アプリ共通の非同期APIクライアント (コネクションプール / タイムアウト / Bearer付与 / 401処理)
+api = ApiClient(DJANGO_API_BASE_URL)
+app.on_shutdown(api.close)
+
+# AIを使うエンドポイントは応答に時間がかかるため、個別にタイムアウトを長くする
+AI_REQUEST_TIMEOUT = 120.0
+
+
+def species_input(label):
+    # 魚種の入力欄 (入力に合わせて魚の種類の辞書から候補を出す)
+    async def suggest(e):
+        if not e.value:
+            return
+        try:
+            suggestions = await api.get("/logs/species/", params={"q": e.value})
+        except (AuthenticationRequired, ApiError):
+            return
+        field.set_autocomplete([item['name'] for item in suggestions])
+
+    field = ui.input(label, autocomplete=[], on_change=suggest)
+    return field
+
+
+def open_advice_dialog(advice_result, advice_data):
+    # ルールによる診断をすぐに表示し、必要ならAIに文章でのくわしいアドバイスを書いてもらう
+    with ui.dialog() as advice_dialog:
+        with ui.card().classes('w-full max-w-2xl q-pa-md'):
+            title = ui.label('水質の診断').classes('text-h6 text-primary mb-4')
+            advice_markdown = ui.markdown(advice_result.get('advice', 'アドバイスを生成できませんでした。')).classes('whitespace-pre-wrap q-mb-md')
+
+            async def enrich():
+                enrich_button.disable()
+                enrich_button.props('loading')
+                try:
+                    enriched = await api.post("/generate-advice/", json={**advice_data, "enrich": True}, timeout=AI_REQUEST_TIMEOUT)
+                    title.set_text('AIアドバイス')
+                    advice_markdown.set_content(enriched.get('advice', 'アドバイスを生成できませんでした。'))
+                    enrich_button.set_visibility(False)
+                except AuthenticationRequired:
+                    pass
+                except ApiError as e:
+                    ui.notify(f'❌ AIアドバイス生成失敗: {e.detail}', type='negative')
+                    enrich_button.enable()
+                finally:
+                    enrich_button.props(remove='loading')
+
+            enrich_button = ui.button('AIにくわしく聞く', icon='psychology', on_click=enrich).classes('w-full mb-2 bg-purple-600 text-white')
+            ui.button('閉じる', on_click=advice_dialog.close).classes('w-full')
+    advice_dialog.open()
+
 def auth_protected(func):
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
@@ -51,25 +102,82 @@ def create_common_layout():
     with ui.footer().classes('bg-grey-8 text-white q-pa-sm text-center'):
         ui.label('© 2025 AQUAFLUX. All rights reserved.').classes('text-caption')
 
+# 水質試験紙の画像をブラウザ側で縮小・再エンコードしてからアップロードする
+# スマートフォンの写真 (5〜10MB) をそのまま送らず、長辺 IMAGE_MAX_SIDE px の WebP (非対応なら JPEG) にする
+IMAGE_MAX_SIDE = 1600
+IMAGE_QUALITY = 0.85
+IMAGE_RESIZE_SCRIPT = """
+<script>
+window.aquafluxResizedFiles = window.aquafluxResizedFiles || new WeakSet();
+
+window.aquafluxResizeImage = async (file, maxSide, quality) => {
+  const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+  const scale = Math.min(1, maxSide / Math.max(bitmap.width, bitmap.height));
+  const canvas = document.createElement('canvas');
+  canvas.width = Math.round(bitmap.width * scale);
+  canvas.height = Math.round(bitmap.height * scale);
+  canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+  bitmap.close();
+  const encode = (type) => new Promise((resolve) => canvas.toBlob(resolve, type, quality));
+  let blob = await encode('image/webp');
+  if (!blob || blob.type !== 'image/webp') blob = await encode('image/jpeg');
+  // 縮小も圧縮も効かない場合は元のファイルを使う
+  if (!blob || (scale === 1 && blob.size >= file.size)) return file;
+  const ext = blob.type === 'image/webp' ? 'webp' : 'jpg';
+  return new File([blob], file.name.replace(/\\.[^.]+$/, '') + '.' + ext, { type: blob.type });
+};
+
+window.aquafluxPrepareUpload = async (uploader, files, maxSide, quality) => {
+  let replaced = false;
+  for (const file of files) {
+    if (window.aquafluxResizedFiles.has(file)) continue;
+    let prepared = file;
+    if (file.type.startsWith('image/')) {
+      try {
+        prepared = await window.aquafluxResizeImage(file, maxSide, quality);
+      } catch (err) {
+        console.warn('画像の縮小に失敗したため元の画像を送信します', err);
+      }
+    }
+    window.aquafluxResizedFiles.add(prepared);
+    if (prepared !== file) {
+      uploader.removeFile(file);
+      uploader.addFiles([prepared]);  // 'added' が再度発火し、そちらでアップロードされる
+      replaced = true;
+    }
+  }
+  if (!replaced) uploader.upload();
+};
+</script>
+"""
+
+
+def create_strip_image_upload(on_upload):
+    ui.add_head_html(IMAGE_RESIZE_SCRIPT)
+    # 選択直後の元画像は大きくてもよい (送信前に縮小される) ため、上限は緩めにしておく
+    upload = ui.upload(label='画像をアップロード', on_upload=on_upload, auto_upload=False, max_file_size=25_000_000, max_files=1).classes('w-full')
+    upload.on('added', js_handler=f"""async (files) => {{
+        await window.aquafluxPrepareUpload(getElement({upload.id}).$refs.qRef, files, {IMAGE_MAX_SIDE}, {IMAGE_QUALITY});
+    }}""")
+    return upload
+
 # ログイン処理
 async def login_user(username, password):
     try:
-        response = requests.post(f"{DJANGO_API_BASE_URL}/users/token/", json={
+        data = await api.post("/users/token/", auth=False, json={
             "username": username,
             "password": password
         })
-        if response.status_code == 200:
-            data = response.json()
-            app.storage.user['access_token'] = data['access']
-            app.storage.user['refresh_token'] = data['refresh']
-            app.storage.user['username'] = username
-            ui.notify('ログインしました！', type='positive')
-            ui.navigate.to('/')
+        app.storage.user['access_token'] = data['access']
+        app.storage.user['refresh_token'] = data['refresh']
+        app.storage.user['username'] = username
+        ui.notify('ログインしました！', type='positive')
+        ui.navigate.to('/')
+    except ApiError as e:
+        if e.status_code is None:
+            ui.notify(str(e), type='negative')
         else:
-            error_detail = response.json().get('detail', '不明なエラー')
-            ui.notify(f'ログイン失敗: {error_detail}', type='negative')
-    except requests.exceptions.ConnectionError:
-        ui.notify('APIサーバーに接続できません。', type='negative')
+            ui.notify(f"ログイン失敗: {e.data.get('detail', '不明なエラー')}", type='negative')
     except Exception as e:
         ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
 
@@ -91,26 +199,25 @@ async def register_user(username, password, password_confirm, email):
         return
 
     try:
-        response = requests.post(f"{DJANGO_API_BASE_URL}/users/register/", json={
+        await api.post("/users/register/", auth=False, json={
             "username": username,
             "password": password,
             "email": email
         })
-        if response.status_code == 201:
-            ui.notify('ユーザー登録が完了しました！ログインしてください。', type='positive')
-            ui.navigate.to('/login')
-        else:
-            error_detail = response.json()
-            # Djangoからのエラー詳細をより分かりやすく表示
-            error_messages = []
-            for field, errors in error_detail.items():
-                if isinstance(errors, list):
-                    error_messages.append(f"{field}: {', '.join(errors)}")
-                else:
-                    error_messages.append(f"{field}: {errors}")
-            ui.notify(f'登録失敗: {"; ".join(error_messages)}', type='negative')
-    except requests.exceptions.ConnectionError:
-        ui.notify('APIサーバーに接続できません。', type='negative')
+        ui.notify('ユーザー登録が完了しました！ログインしてください。', type='positive')
+        ui.navigate.to('/login')
+    except ApiError as e:
+        if e.status_code is None:
+            ui.notify(str(e), type='negative')
+            return
+        # Djangoからのエラー詳細をより分かりやすく表示
+        error_messages = []
+        for field, errors in e.data.items():
+            if isinstance(errors, list):
+                error_messages.append(f"{field}: {', '.join(errors)}")
+            else:
+                error_messages.append(f"{field}: {errors}")
+        ui.notify(f'登録失敗: {"; ".join(error_messages)}', type='negative')
     except Exception as e:
         ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
 
@@ -130,6 +237,28 @@ async def index_page():
             ui.button('ログイン', on_click=lambda: ui.navigate.to('/login')).classes('px-6 py-3 bg-green-600 text-white rounded-lg shadow-md hover:bg-green-700 mr-2')
             ui.button('新規登録', on_click=lambda: ui.navigate.to('/register')).classes('px-6 py-3 bg-indigo-600 text-white rounded-lg shadow-md hover:bg-indigo-700')
 
+# 飼育ログ1件をテーブルの行に整形する
+def format_log_row(log):
+    # water_data をより見やすく整形
+    water_data_str = "未記録"
+    if log['water_data']:
+        data_parts = []
+        for k, v in log['water_data'].items():
+            if k == 'ph' and v is not None:
+                data_parts.append(f"pH: {v:.1f}")
+            elif v is not None:
+                data_parts.append(f"{k.upper()}: {int(v)}")
+        water_data_str = ", ".join(data_parts) if data_parts else "未記録"
+
+    return {
+        'id': log['id'],
+        'log_date': log['log_date'],
+        'fish_type': log['fish_type'] if log['fish_type'] else '未設定',
+        'tank_type': log['tank_type'],
+        'water_data': water_data_str,
+        'notes': (log['notes'][:50] + '...') if log['notes'] and len(log['notes']) > 50 else (log['notes'] if log['notes'] else 'なし'),
+    }
+
 # 飼育ログ一覧ページ
 @ui.page('/logs')
 async def logs_page():
@@ -147,93 +276,174 @@ async def logs_page():
     # 新規ログ作成ボタン (これは /logs/new ページに遷移)
     ui.button('新しい飼育ログを作成', on_click=lambda: ui.navigate.to('/logs/new')).classes('px-6 py-3 bg-purple-600 text-white rounded-lg shadow-md hover:bg-purple-700 mb-6')
 
-    log_data_container = ui.column().classes('w-full items-center')
-
-    async def fetch_logs():
-        # ローディングスピナー表示
-        with log_data_container:
-            ui.spinner(size='lg').classes('absolute-center')
-            ui.label('ログデータをロード中...').classes('text-lg text-gray-500 mt-4')
+    # 絞り込み条件 (サーバー側で絞り込む)
+    with ui.row().classes('w-full items-end gap-4 mb-4'):
+        date_from_input = ui.input('開始日').props('type=date clearable').classes('w-40')
+        date_to_input = ui.input('終了日').props('type=date clearable').classes('w-40')
+        tank_type_filter = ui.select(options={'': 'すべて', 'freshwater': '淡水', 'saltwater': '海水'}, value='', label='水槽の種類').classes('w-32')
+        fish_type_filter = ui.input('魚の種類').props('clearable').classes('w-48')
+        ui.button('絞り込み', icon='filter_alt', on_click=lambda: fetch_logs({'page': 1})).classes('bg-blue-600 text-white')
+
+    # テーブルでログを表示 (ページング・並び替え・絞り込みはすべてAPI側で行い、表示中のページだけを受け取る)
+    columns = [
+        {'name': 'id', 'label': 'ID', 'field': 'id', 'sortable': True},
+        {'name': 'log_date', 'label': '日付', 'field': 'log_date', 'sortable': True},
+        {'name': 'fish_type', 'label': '魚の種類', 'field': 'fish_type', 'sortable': True},
+        {'name': 'tank_type', 'label': '水槽の種類', 'field': 'tank_type', 'sortable': True},
+        {'name': 'water_data', 'label': '水質データ', 'field': 'water_data'},
+        {'name': 'notes', 'label': 'メモ', 'field': 'notes'},
+    ]
+    log_table = ui.table(
+        columns=columns,
+        rows=[],
+        row_key='id',
+        selection='multiple',
+        pagination={'page': 1, 'rowsPerPage': 20, 'sortBy': 'log_date', 'descending': True, 'rowsNumber': 0},
+    ).classes('w-full shadow-lg rounded-lg')
+    log_table.props(':rows-per-page-options="[10, 20, 50, 100]" no-data-label="まだ飼育ログがありません。新しいログを作成しましょう！"')
+
+    def handle_row_click(e):
+        row = e.args[1]  # The row upon which user has clicked/tapped
+        ui.navigate.to(f"/logs/{row['id']}")
+
+    log_table.on('rowClick', handle_row_click)
+
+    async def fetch_logs(pagination=None):
+        # テーブルの現在のページ設定に、変更された項目 (ページ・件数・並び順) を重ねる
+        pagination = {**log_table.pagination, **(pagination or {})}
+        sort_by = pagination.get('sortBy') or 'log_date'
+        params = {
+            'page': pagination['page'],
+            'page_size': pagination['rowsPerPage'],
+            'ordering': f"{'-' if pagination.get('descending') else ''}{sort_by}",
+        }
+        if date_from_input.value:
+            params['date_from'] = date_from_input.value
+        if date_to_input.value:
+            params['date_to'] = date_to_input.value
+        if tank_type_filter.value:
+            params['tank_type'] = tank_type_filter.value
+        if fish_type_filter.value:
+            params['fish_type'] = fish_type_filter.value
+
+        log_table.props('loading')
+        try:
+            data = await api.get("/logs/", params=params)
+
+            log_table.rows = [format_log_row(log) for log in data['results']]
+            pagination['rowsNumber'] = data['count']
+            log_table.pagination = pagination
+
+        except AuthenticationRequired:
+            pass # ログイン画面への遷移は api クライアントが行う
+        except ApiError as e:
+            if e.status_code == 404 and pagination['page'] != 1:
+                # 絞り込みで件数が減り、表示中のページが存在しなくなった場合は先頭に戻る
+                await fetch_logs({'page': 1})
+                return
+            ui.notify(f'飼育ログの取得に失敗しました: {e.detail}', type='negative')
+            print(f"Error details: {str(e)}")  # エラーの詳細をコンソールに出力
+        except Exception as e:
+            ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
+            print(f"Error details: {str(e)}")  # エラーの詳細をコンソールに出力
+        finally:
+            log_table.props(remove='loading')
 
-        log_data_container.clear() # 既存の内容をクリア
+    # ページ移動・件数変更・並び替えのたびにサーバーへ問い合わせる
+    log_table.on('request', lambda e: fetch_logs(e.args['pagination']))
 
-        access_token = app.storage.user.get('access_token')
-        if not access_token:
-            ui.notify('ログインしていません。', type='negative')
-            ui.navigate.to('/login')
+    # 選択したログの一括操作 (1回のリクエストでまとめて更新・削除する)
+    async def bulk_request(method, body, done_message):
+        ids = [row['id'] for row in log_table.selected]
+        if not ids:
+            ui.notify('ログを選択してください。', type='warning')
             return
-
-        headers = {'Authorization': f'Bearer {access_token}'}
-
         try:
-            response = requests.get(f"{DJANGO_API_BASE_URL}/logs/", headers=headers)
-            response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
+            data = await method('/logs/bulk/', json={'ids': ids, **body})
+            count = data.get('updated', data.get('deleted', 0))
+            ui.notify(done_message.format(count=count), type='positive')
+            log_table.selected = []
+            await fetch_logs()
+        except AuthenticationRequired:
+            pass
+        except ApiError as e:
+            ui.notify(f'一括操作に失敗しました: {e.detail}', type='negative')
+        except Exception as e:
+            ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
 
-            logs = response.json()
+    async def bulk_delete():
+        count = len(log_table.selected)
+        if count and not await ui.run_javascript(f'confirm("選択した{count}件の飼育ログを本当に削除しますか？");', timeout=None):
+            return
+        await bulk_request(api.delete, {}, '{count}件の飼育ログを削除しました！')
 
-            if not logs:
-                with log_data_container:
-                    ui.label('まだ飼育ログがありません。新しいログを作成しましょう！').classes('text-lg text-gray-600 mt-8')
+    async def bulk_set_fish_type():
+        if not bulk_fish_type_input.value:
+            ui.notify('変更後の魚の種類を入力してください。', type='warning')
+            return
+        await bulk_request(api.patch, {'changes': {'fish_type': bulk_fish_type_input.value}}, '{count}件の飼育ログを更新しました！')
+
+    with ui.row().classes('w-full items-end gap-4 mt-4'):
+        bulk_fish_type_input = ui.input('魚の種類をまとめて変更').props('clearable').classes('w-48')
+        ui.button('選択したログに反映', icon='edit', on_click=bulk_set_fish_type).classes('bg-blue-600 text-white')
+        ui.button('選択したログを削除', icon='delete', on_click=bulk_delete).classes('bg-red-600 text-white')
+
+    # 他の端末・タブでの変更を受け取り、表示中のページの行だけを書き換える (GET /api/logs/events/)
+    def newest_first():
+        pagination = log_table.pagination
+        return (
+            pagination['page'] == 1
+            and pagination.get('sortBy') in (None, 'log_date', 'id')
+            and pagination.get('descending')
+            and not (date_from_input.value or date_to_input.value or tank_type_filter.value or fish_type_filter.value)
+        )
+
+    async def apply_change(event, data):
+        rows = log_table.rows
+        visible = {row['id'] for row in rows}
+        if event == 'log.saved':
+            row = format_log_row(data['log'])
+            if row['id'] in visible:
+                log_table.rows = [row if current['id'] == row['id'] else current for current in rows]
+            elif newest_first():
+                # 絞り込みのない新しい順の先頭ページであれば、追加されたログを先頭に入れる
+                log_table.rows = [row] + rows[:log_table.pagination['rowsPerPage'] - 1]
+                log_table.pagination = {**log_table.pagination, 'rowsNumber': log_table.pagination['rowsNumber'] + 1}
+        elif event == 'log.deleted':
+            removed = visible & set(data['ids'])
+            if removed:
+                log_table.rows = [row for row in rows if row['id'] not in removed]
+                log_table.pagination = {**log_table.pagination, 'rowsNumber': max(log_table.pagination['rowsNumber'] - len(removed), 0)}
+        elif event == 'log.changed':
+            # 一括更新は変更後の値を含まないので、表示中の行が含まれていればページを読み直す
+            if visible & set(data['ids']):
+                await fetch_logs()
+        elif event == 'logs.reset':
+            await fetch_logs()
+
+    async def listen_changes():
+        reconnecting = False
+        while True:
+            try:
+                async for event, data in api.events('/logs/events/'):
+                    if event == 'open':
+                        # つなぎ直した場合は、切れていた間の変更を取りこぼしているので、購読が始まってからページを読み直す
+                        if reconnecting:
+                            await fetch_logs()
+                        reconnecting = True
+                        continue
+                    await apply_change(event, data)
+                continue  # サーバーが一定時間で接続を閉じたので、すぐにつなぎ直す
+            except AuthenticationRequired:
                 return
-
-            # テーブルでログを表示
-            columns = [
-                {'name': 'id', 'label': 'ID', 'field': 'id', 'sortable': True},
-                {'name': 'log_date', 'label': '日付', 'field': 'log_date', 'sortable': True},
-                {'name': 'fish_type', 'label': '魚の種類', 'field': 'fish_type', 'sortable': True},
-                {'name': 'tank_type', 'label': '水槽の種類', 'field': 'tank_type', 'sortable': True},
-                {'name': 'water_data', 'label': '水質データ', 'field': 'water_data'},
-                {'name': 'notes', 'label': 'メモ', 'field': 'notes'},
-            ]
-            rows = []
-            for log in logs:
-                # water_data をより見やすく整形
-                water_data_str = "未記録"
-                if log['water_data']:
-                    data_parts = []
-                    for k, v in log['water_data'].items():
-                        if k == 'ph' and v is not None:
-                            data_parts.append(f"pH: {v:.1f}")
-                        elif v is not None:
-                            data_parts.append(f"{k.upper()}: {int(v)}")
-                    water_data_str = ", ".join(data_parts) if data_parts else "未記録"
-
-                row = {
-                    'id': log['id'],
-                    'log_date': log['log_date'],
-                    'fish_type': log['fish_type'] if log['fish_type'] else '未設定',
-                    'tank_type': log['tank_type'],
-                    'water_data': water_data_str,
-                    'notes': (log['notes'][:50] + '...') if log['notes'] and len(log['notes']) > 50 else (log['notes'] if log['notes'] else 'なし'),
-                }
-                rows.append(row)
-
-            with log_data_container:
-                def handle_row_click(e):
-                    row = e.args[1]  # The row upon which user has clicked/tapped
-                    ui.navigate.to(f"/logs/{row['id']}")
-                
-                log_table = ui.table(
-                    columns=columns,
-                    rows=rows,
-                    row_key='id'
-                ).classes('w-full shadow-lg rounded-lg')
-                log_table.on('rowClick', handle_row_click)
-
-        except requests.exceptions.RequestException as e:
-            if response.status_code == 401:
-                ui.notify('認証エラー: ログインし直してください。', type='negative')
-                ui.navigate.to('/login')
-            else:
-                ui.notify(f'飼育ログの取得に失敗しました: {e}', type='negative')
-            print(f"Error details: {str(e)}")  # エラーの詳細をコンソールに出力
-        except ValueError as e:
-            ui.notify(f'JSONパースエラー: {e}', type='negative')
-        except Exception as e:
-            ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
-            print(f"Error details: {str(e)}")  # エラーの詳細をコンソールに出力
+            except ApiError:
+                pass
+            await asyncio.sleep(5)  # 接続できなかった場合は少し待ってからつなぎ直す
 
     ui.timer(0.1, fetch_logs, once=True) # ページ表示後に非同期でロード
+    # ui.notify やログイン画面への遷移をこのページに対して行えるよう、クライアントのコンテキストで動かす
+    listener = background_tasks.create(listen_changes(), name='log-events', context=ui.context.client)
+    ui.context.client.on_delete(lambda: listener.cancel())  # ページを閉じたら購読をやめる
     
     # ログアウトボタン（ナビゲーションバーとは別にページ内にも設置）
     ui.button('ログアウト', on_click=logout).classes('mt-8 px-6 py-3 bg-red-600 text-white rounded-lg shadow-md hover:bg-red-700')
@@ -269,7 +479,7 @@ async def new_log_entry_page():
             cl2_input = ui.number('Cl2 (塩素)', value=0.0, format='%.1f').props('step=0.1 min=0 max=5').classes('w-full')
         
         notes_input = ui.textarea('メモ').classes('w-full mt-4').props('rows=3')
-        fish_type_input = ui.input('魚種 (例: ネオンテトラ)').classes('w-full mt-4')
+        fish_type_input = species_input('魚種 (例: ネオンテトラ)').classes('w-full mt-4')
         
         tank_type_options_map = {
             'freshwater': '淡水',
@@ -280,7 +490,7 @@ async def new_log_entry_page():
         # ここに generate_ai_advice 関数を定義
         async def generate_ai_advice():
             # シンプルなローディング通知
-            ui.notify('🧠 AI分析中... お待ちください', type='ongoing')
+            ui.notify('🧠 水質を診断中...', type='ongoing')
             
             access_token = app.storage.user.get('access_token')
             if not access_token:
@@ -304,36 +514,15 @@ async def new_log_entry_page():
             }
 
             try:
-                headers = {
-                    'Authorization': f'Bearer {access_token}',
-                    'Content-Type': 'application/json'
-                }
-                # 非同期でAPIリクエストを実行（Connection lost対策）
-                import asyncio
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None, 
-                    lambda: requests.post(f"{DJANGO_API_BASE_URL}/generate-advice/", headers=headers, json=advice_data, timeout=60)
-                )
-                response.raise_for_status()
-
-                advice_result = response.json()
-                advice_text = advice_result.get('advice', 'アドバイスを生成できませんでした。')
-                
-                # アドバイス完了通知
-                ui.notify('✅ AIアドバイス生成完了！', type='positive')
-
-                with ui.dialog() as advice_dialog:
-                    with ui.card().classes('w-full max-w-2xl q-pa-md'):
-                        ui.label('AIアドバイス').classes('text-h6 text-primary mb-4')
-                        ui.markdown(advice_text).classes('whitespace-pre-wrap q-mb-md')
-                        ui.button('閉じる', on_click=advice_dialog.close).classes('w-full')
-                advice_dialog.open()
-
-            except requests.exceptions.RequestException as e:
-                error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
-                ui.notify(f'❌ AIアドバイス生成失敗: {error_message}', type='negative')
+                # 非同期クライアントで送信するため、応答待ちの間もイベントループは塞がれない
+                # まずルールによる診断がすぐに返る (AIの文章はダイアログから追加で依頼する)
+                advice_result = await api.post("/generate-advice/", json=advice_data)
+                open_advice_dialog(advice_result, advice_data)
+
+            except AuthenticationRequired:
+                pass
+            except ApiError as e:
+                ui.notify(f'❌ AIアドバイス生成失敗: {e.detail}', type='negative')
             except Exception as e:
                 ui.notify(f'❌ 予期せぬエラーが発生しました: {e}', type='negative')
 
@@ -371,25 +560,13 @@ async def new_log_entry_page():
 
             try:
                 print("=== 画像データ読み込み開始 ===")
-                image_bytes = e.content.read() 
-                print(f"Image bytes length: {len(image_bytes)}")
-                
-                files = {'image': (e.name, image_bytes, getattr(e, 'type', 'image/jpeg'))}
-                headers = {'Authorization': f'Bearer {access_token}'}
-                api_url = f"{DJANGO_API_BASE_URL}/analyze-image/"
+                # ブラウザ側で縮小済みの画像を、メモリに読み込まずにそのままバックエンドへストリーミングする
+                e.content.seek(0)
+                files = {'image': (e.name, e.content, getattr(e, 'type', 'image/jpeg'))}
                 
-                print(f"API URL: {api_url}")
-                print(f"Headers: {headers}")
                 print("=== APIリクエスト送信 ===")
                 
-                response = requests.post(api_url, headers=headers, files=files)
-                print(f"Response status: {response.status_code}")
-                print(f"Response headers: {dict(response.headers)}")
-                print(f"Raw response content: {response.text[:500]}...")
-                
-                response.raise_for_status()
-
-                analysis_result = response.json()
+                analysis_result = await api.post("/analyze-image/", files=files, timeout=AI_REQUEST_TIMEOUT)
                 water_data_from_image = analysis_result.get('water_data', {})
                 
                 # デバッグ情報をコンソールに出力
@@ -446,15 +623,13 @@ async def new_log_entry_page():
 
                 ui.notify('画像から水質データを自動入力しました！', type='positive')
 
-            except requests.exceptions.RequestException as e:
+            except AuthenticationRequired:
+                dialog.close()
+            except ApiError as e:
                 print(f"=== APIリクエストエラー ===")
-                print(f"Request exception: {e}")
-                if 'response' in locals():
-                    print(f"Response status: {response.status_code}")
-                    print(f"Response text: {response.text}")
+                print(f"Request exception: {e} (status: {e.status_code}, data: {e.data})")
                 dialog.close()
-                error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
+                error_message = e.data.get('error', e.detail)
                 ui.notify(f'画像解析失敗: {error_message}', type='negative')
                 print(f"Error message shown: {error_message}")
             except Exception as e:
@@ -469,8 +644,8 @@ async def new_log_entry_page():
                 print("=== 画像アップロード処理終了 ===")
                 print("--- --- --- --- --- --- ---")
 
-        ui.upload(label='画像をアップロード', on_upload=handle_image_upload, auto_upload=True, max_file_size=5_000_000, max_files=1).classes('w-full')
-        ui.label('推奨: JPEG/PNG形式, 最大5MB').classes('text-sm text-gray-500')
+        create_strip_image_upload(handle_image_upload)
+        ui.label('JPEG/PNG形式 (ブラウザで縮小してから送信します)').classes('text-sm text-gray-500')
 
         ui.separator().classes('my-6')
 
@@ -493,26 +668,16 @@ async def new_log_entry_page():
                 "notes": notes_input.value,
             }
 
-            access_token = app.storage.user.get('access_token')
-            if not access_token:
-                ui.notify('ログインしていません。', type='negative')
-                ui.navigate.to('/login')
-                return
-
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-
             try:
-                response = requests.post(f"{DJANGO_API_BASE_URL}/logs/", headers=headers, json=log_data)
-                response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
+                await api.post("/logs/", json=log_data)
 
                 ui.notify('飼育ログが正常に保存されました！', type='positive')
                 ui.navigate.to('/logs') # ログ一覧ページに戻る
-            except requests.exceptions.RequestException as e:
-                error_response = response.json() if hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
+            except AuthenticationRequired:
+                pass
+            except ApiError as e:
+                error_response = e.data
+                error_message = e.detail
                 # tank_type のバリデーションエラーを抽出して表示
                 if 'tank_type' in error_response:
                     error_message = f"水槽の種類エラー: {error_response['tank_type'][0]}"
@@ -544,23 +709,15 @@ async def delete_log_entry(log_id: int):
     if not await ui.run_javascript(f'confirm("ID: {log_id} の飼育ログを本当に削除しますか？");', timeout=None):
         return # ユーザーがキャンセルした場合
 
-    access_token = app.storage.user.get('access_token')
-    if not access_token:
-        ui.notify('ログインしていません。', type='negative')
-        ui.navigate.to('/login')
-        return
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-
     try:
-        response = requests.delete(f"{DJANGO_API_BASE_URL}/logs/{log_id}/", headers=headers)
-        response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
+        await api.delete(f"/logs/{log_id}/")
 
         ui.notify(f'飼育ログ (ID: {log_id}) を削除しました！', type='positive')
         ui.navigate.to('/logs') # 削除後、一覧ページを再読み込み
-    except requests.exceptions.RequestException as e:
-        error_detail = response.json() if hasattr(response, 'json') else str(e)
-        ui.notify(f'飼育ログの削除に失敗しました: {error_detail}', type='negative')
+    except AuthenticationRequired:
+        pass
+    except ApiError as e:
+        ui.notify(f'飼育ログの削除に失敗しました: {e.detail}', type='negative')
     except Exception as e:
         ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
 
@@ -592,16 +749,12 @@ async def advice_page():
 
             advice_container.clear()
 
-            access_token = app.storage.user.get('access_token')
-            headers = {'Authorization': f'Bearer {access_token}'}
-
             try:
-                # 最新のログを取得
-                response = requests.get(f"{DJANGO_API_BASE_URL}/logs/", headers=headers)
-                response.raise_for_status()
-                logs = response.json()
+                # 最新のログ・集計・保存済みアドバイスを1回のリクエストで取得
+                dashboard = await api.get("/logs/dashboard/")
+                latest_log = dashboard['latest']
 
-                if not logs:
+                if not latest_log:
                     # ログがない場合のメッセージ
                     with advice_container:
                         with ui.card().classes('w-full p-8 text-center bg-gray-50'):
@@ -611,15 +764,6 @@ async def advice_page():
                             ui.button('飼育ログを作成', icon='add', on_click=lambda: ui.navigate.to('/logs/new')).classes('px-8 py-3 bg-blue-600 text-white rounded-lg shadow-md hover:bg-blue-700')
                     return
 
-                # 最新ログでAIアドバイスを生成
-                latest_log = logs[0]
-                advice_data = {
-                    "water_data": latest_log.get('water_data', {}),
-                    "notes": latest_log.get('notes', ''),
-                    "fish_type": latest_log.get('fish_type', ''),
-                    "tank_type": latest_log.get('tank_type', 'freshwater'),
-                }
-
                 with advice_container:
                     # 最新ログ情報表示
                     with ui.card().classes('w-full p-6 mb-6 bg-blue-50'):
@@ -637,19 +781,40 @@ async def advice_page():
                             if water_info:
                                 ui.label(f'水質: {", ".join(water_info)}').classes('text-lg')
 
+                    # 直近のログの集計
+                    stats = dashboard['stats']
+                    if stats['parameters']:
+                        with ui.card().classes('w-full p-6 mb-6'):
+                            ui.label(f'📈 直近{stats["count"]}件の水質').classes('text-xl font-bold mb-4 text-blue-800')
+                            with ui.grid(columns=4).classes('w-full gap-2'):
+                                for label in ('項目', '最新', '平均', '範囲'):
+                                    ui.label(label).classes('font-bold')
+                                for key, item in stats['parameters'].items():
+                                    ui.label(key.upper())
+                                    ui.label(str(item['latest']))
+                                    ui.label(str(item['avg']))
+                                    ui.label(f"{item['min']} 〜 {item['max']}")
+
+                    # ルールによる診断 (AIの応答を待たずにすぐ表示する)
+                    rule_advice = dashboard.get('rule_advice')
+                    if rule_advice:
+                        with ui.card().classes('w-full p-6 mb-6'):
+                            ui.label('🩺 水質の診断').classes('text-xl font-bold mb-4 text-blue-800')
+                            ui.markdown(rule_advice['advice']).classes('text-lg whitespace-pre-wrap')
+
                     # AIアドバイス生成中表示
                     with ui.card().classes('w-full p-6 text-center') as advice_card:
                         ui.spinner(size='xl', thickness=10).classes('text-purple-500 mb-4')
                         ui.label('🧠 AI が分析中...').classes('text-xl font-bold mb-2')
                         ui.label('水質データと過去の履歴を分析してアドバイスを生成しています').classes('text-gray-600')
 
-                # AIアドバイス生成
+                # 保存済みのアドバイスがあればそのまま表示し、なければ log_id だけを送って生成する (enrich=true)
                 try:
-                    response = requests.post(f"{DJANGO_API_BASE_URL}/generate-advice/", headers=headers, json=advice_data)
-                    response.raise_for_status()
-
-                    advice_result = response.json()
-                    advice_text = advice_result.get('advice', 'アドバイスを生成できませんでした。')
+                    if dashboard['advice']:
+                        advice_text = dashboard['advice']['advice']
+                    else:
+                        advice_result = await api.post("/generate-advice/", json=dashboard['advice_request']['body'], timeout=AI_REQUEST_TIMEOUT)
+                        advice_text = advice_result.get('advice', 'アドバイスを生成できませんでした。')
                     
                     # アドバイス表示に切り替え
                     advice_card.clear()
@@ -661,23 +826,25 @@ async def advice_page():
                             ui.button('新しいログを作成', icon='add', on_click=lambda: ui.navigate.to('/logs/new')).classes('px-6 py-3 bg-blue-600 text-white rounded-lg shadow-md hover:bg-blue-700')
                             ui.button('ログ一覧を見る', icon='list', on_click=lambda: ui.navigate.to('/logs')).classes('px-6 py-3 bg-gray-600 text-white rounded-lg shadow-md hover:bg-gray-700')
 
-                except requests.exceptions.RequestException as e:
+                except AuthenticationRequired:
+                    pass
+                except ApiError as e:
                     advice_card.clear()
                     with advice_card:
                         ui.icon('error', size='3rem').classes('text-red-500 mb-4')
                         ui.label('アドバイス生成に失敗しました').classes('text-xl font-bold mb-4 text-red-600')
-                        error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                        error_message = error_response.get('detail', str(e))
-                        ui.label(f'エラー: {error_message}').classes('text-gray-600 mb-4')
+                        ui.label(f'エラー: {e.detail}').classes('text-gray-600 mb-4')
                         ui.button('再試行', icon='refresh', on_click=fetch_latest_log_and_advice).classes('px-6 py-3 bg-purple-600 text-white rounded-lg shadow-md hover:bg-purple-700')
 
-            except requests.exceptions.RequestException as e:
+            except AuthenticationRequired:
+                pass
+            except ApiError as e:
                 advice_container.clear()
                 with advice_container:
                     with ui.card().classes('w-full p-6 text-center'):
                         ui.icon('error', size='3rem').classes('text-red-500 mb-4')
                         ui.label('データの取得に失敗しました').classes('text-xl font-bold mb-4 text-red-600')
-                        ui.label(f'エラー: {e}').classes('text-gray-600 mb-4')
+                        ui.label(f'エラー: {e.detail}').classes('text-gray-600 mb-4')
                         ui.button('再試行', icon='refresh', on_click=fetch_latest_log_and_advice).classes('px-6 py-3 bg-blue-600 text-white rounded-lg shadow-md hover:bg-blue-700')
 
         ui.timer(0.1, fetch_latest_log_and_advice, once=True)
@@ -707,14 +874,8 @@ async def log_detail_page(log_id: int):
 
         detail_container.clear() # 既存の内容をクリア
 
-        access_token = app.storage.user.get('access_token')
-        headers = {'Authorization': f'Bearer {access_token}'}
-
         try:
-            response = requests.get(f"{DJANGO_API_BASE_URL}/logs/{log_id}/", headers=headers)
-            response.raise_for_status() 
-
-            log_data = response.json()
+            log_data = await api.get(f"/logs/{log_id}/")
 
             with detail_container:
                 ui.label(f'日付: {log_data.get("log_date", "N/A")}').classes('text-lg font-semibold')
@@ -765,34 +926,19 @@ async def log_detail_page(log_id: int):
                     with dialog:
                         with ui.card().classes('items-center'):
                             ui.spinner(size='xl', thickness=10).classes('text-blue-500')
-                            ui.label('AIアドバイスを生成中...').classes('text-lg mt-4')
+                            ui.label('水質を診断中...').classes('text-lg mt-4')
                     dialog.open()
 
                     try:
-                        headers = {
-                            'Authorization': f'Bearer {access_token}',
-                            'Content-Type': 'application/json'
-                        }
-                        response = requests.post(f"{DJANGO_API_BASE_URL}/generate-advice/", headers=headers, json=advice_data)
-                        response.raise_for_status()
-
-                        advice_result = response.json()
-                        advice_text = advice_result.get('advice', 'アドバイスを生成できませんでした。')
-                        
+                        advice_result = await api.post("/generate-advice/", json=advice_data)
                         dialog.close()
+                        open_advice_dialog(advice_result, advice_data)
 
-                        # 新しいダイアログでアドバイスを表示
-                        with ui.dialog() as advice_dialog:
-                            with ui.card().classes('w-full max-w-2xl q-pa-md'):
-                                ui.label('AIアドバイス').classes('text-h6 text-primary mb-4')
-                                ui.markdown(advice_text).classes('whitespace-pre-wrap q-mb-md')
-                                ui.button('閉じる', on_click=advice_dialog.close).classes('w-full')
-                        advice_dialog.open()
-
-                    except requests.exceptions.RequestException as e:
+                    except AuthenticationRequired:
+                        dialog.close()
+                    except ApiError as e:
                         dialog.close()
-                        error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                        error_message = error_response.get('detail', str(e))
+                        error_message = e.detail
                         ui.notify(f'AIアドバイス生成失敗: {error_message}', type='negative')
                         if "API key" in error_message or "API_KEY" in error_message:
                             ui.notify("Gemini APIキーが正しく設定されているか確認してください。", type='negative', timeout=5000)
@@ -809,8 +955,10 @@ async def log_detail_page(log_id: int):
                     ui.button('削除', icon='delete', on_click=lambda: delete_log_entry(log_id)).classes('px-6 py-3 bg-red-600 text-white rounded-lg shadow-md hover:bg-red-700')
                     ui.button('一覧に戻る', on_click=lambda: ui.navigate.to('/logs')).props('flat color=grey').classes('q-ml-md')
 
-        except requests.exceptions.RequestException as e:
-            ui.notify(f'飼育ログ詳細の取得に失敗しました: {e}', type='negative')
+        except AuthenticationRequired:
+            pass
+        except ApiError as e:
+            ui.notify(f'飼育ログ詳細の取得に失敗しました: {e.detail}', type='negative')
             with detail_container:
                 detail_container.clear()
                 ui.label('ログ詳細の読み込み中にエラーが発生しました。').classes('text-negative text-lg')
@@ -892,7 +1040,7 @@ async def edit_log_entry_page(log_id: int):
             cl2_input = ui.number('Cl2 (塩素)').props('step=0.1 min=0 max=5').classes('w-full')
         
         notes_input = ui.textarea('メモ').classes('w-full mt-4').props('rows=3')
-        fish_type_input = ui.input('魚種 (例: ネオンテトラ)').classes('w-full mt-4')
+        fish_type_input = species_input('魚種 (例: ネオンテトラ)').classes('w-full mt-4')
         
         tank_type_options_map = {
             'freshwater': '淡水',
@@ -903,10 +1051,7 @@ async def edit_log_entry_page(log_id: int):
         # ログデータのロード
         async def load_log_data():
             try:
-                headers = {'Authorization': f'Bearer {access_token}'}
-                response = requests.get(f"{DJANGO_API_BASE_URL}/logs/{log_id}/", headers=headers)
-                response.raise_for_status()
-                log_data = response.json()
+                log_data = await api.get(f"/logs/{log_id}/")
 
                 # フォームにデータを設定
                 water_data = log_data.get('water_data', {})
@@ -920,8 +1065,10 @@ async def edit_log_entry_page(log_id: int):
                 fish_type_input.value = log_data.get('fish_type')
                 tank_type_input.value = log_data.get('tank_type')
 
-            except requests.exceptions.RequestException as e:
-                ui.notify(f'ログデータのロードに失敗しました: {e}', type='negative')
+            except AuthenticationRequired:
+                pass
+            except ApiError as e:
+                ui.notify(f'ログデータのロードに失敗しました: {e.detail}', type='negative')
                 ui.navigate.to('/logs')
             except Exception as e:
                 ui.notify(f'予期せぬエラーが発生しました: {e}', type='negative')
@@ -963,25 +1110,13 @@ async def edit_log_entry_page(log_id: int):
 
             try:
                 print("=== 画像データ読み込み開始 ===")
-                image_bytes = e.content.read() 
-                print(f"Image bytes length: {len(image_bytes)}")
+                # ブラウザ側で縮小済みの画像を、メモリに読み込まずにそのままバックエンドへストリーミングする
+                e.content.seek(0)
+                files = {'image': (e.name, e.content, getattr(e, 'type', 'image/jpeg'))}
                 
-                files = {'image': (e.name, image_bytes, getattr(e, 'type', 'image/jpeg'))}
-                headers = {'Authorization': f'Bearer {access_token}'}
-                api_url = f"{DJANGO_API_BASE_URL}/analyze-image/"
-                
-                print(f"API URL: {api_url}")
-                print(f"Headers: {headers}")
                 print("=== APIリクエスト送信 ===")
                 
-                response = requests.post(api_url, headers=headers, files=files)
-                print(f"Response status: {response.status_code}")
-                print(f"Response headers: {dict(response.headers)}")
-                print(f"Raw response content: {response.text[:500]}...")
-                
-                response.raise_for_status()
-
-                analysis_result = response.json()
+                analysis_result = await api.post("/analyze-image/", files=files, timeout=AI_REQUEST_TIMEOUT)
                 water_data_from_image = analysis_result.get('water_data', {})
                 
                 # デバッグ情報をコンソールに出力
@@ -1038,15 +1173,13 @@ async def edit_log_entry_page(log_id: int):
 
                 ui.notify('画像から水質データを自動入力しました！', type='positive')
 
-            except requests.exceptions.RequestException as e:
+            except AuthenticationRequired:
+                dialog.close()
+            except ApiError as e:
                 print(f"=== APIリクエストエラー ===")
-                print(f"Request exception: {e}")
-                if 'response' in locals():
-                    print(f"Response status: {response.status_code}")
-                    print(f"Response text: {response.text}")
+                print(f"Request exception: {e} (status: {e.status_code}, data: {e.data})")
                 dialog.close()
-                error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
+                error_message = e.data.get('error', e.detail)
                 ui.notify(f'画像解析失敗: {error_message}', type='negative')
                 print(f"Error message shown: {error_message}")
             except Exception as e:
@@ -1061,8 +1194,8 @@ async def edit_log_entry_page(log_id: int):
                 print("=== 画像アップロード処理終了 ===")
                 print("--- --- --- --- --- --- ---")
 
-        ui.upload(label='画像をアップロード', on_upload=handle_image_upload, auto_upload=True, max_file_size=5_000_000, max_files=1).classes('w-full')
-        ui.label('推奨: JPEG/PNG形式, 最大5MB').classes('text-sm text-gray-500')
+        create_strip_image_upload(handle_image_upload)
+        ui.label('JPEG/PNG形式 (ブラウザで縮小してから送信します)').classes('text-sm text-gray-500')
 
         ui.separator().classes('my-6')
 
@@ -1094,48 +1227,26 @@ async def edit_log_entry_page(log_id: int):
                 "tank_type": tank_type_input.value,
             }
 
-            # AI思考中のローディング表示（強化版）
+            # 診断中のローディング表示
             dialog = ui.dialog().props('persistent no-backdrop-dismiss')
             with dialog:
                 with ui.card().classes('items-center p-8 min-w-96 text-center'):
                     ui.spinner(size='xl', thickness=10).classes('text-purple-500 mb-6')
-                    ui.label('🧠 AI が深く分析中...').classes('text-2xl font-bold mb-3 text-purple-700')
-                    ui.label('水質データと過去の履歴を総合的に分析しています').classes('text-lg text-gray-600 mb-2')
-                    ui.label('しばらくお待ちください...').classes('text-sm text-gray-500')
+                    ui.label('🧠 水質を診断中...').classes('text-2xl font-bold mb-3 text-purple-700')
                     ui.linear_progress().classes('w-full mt-4').props('indeterminate color=purple')
             dialog.open()
 
             try:
-                headers = {
-                    'Authorization': f'Bearer {access_token}',
-                    'Content-Type': 'application/json'
-                }
-                # 非同期でAPIリクエストを実行（Connection lost対策）
-                import asyncio
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None, 
-                    lambda: requests.post(f"{DJANGO_API_BASE_URL}/generate-advice/", headers=headers, json=advice_data, timeout=60)
-                )
-                response.raise_for_status()
-
-                advice_result = response.json()
-                advice_text = advice_result.get('advice', 'アドバイスを生成できませんでした。')
-                
-                # アドバイス完了通知
-                ui.notify('✅ AIアドバイス生成完了！', type='positive')
-
-                # 新しいダイアログでアドバイスを表示
-                with ui.dialog() as advice_dialog:
-                    with ui.card().classes('w-full max-w-2xl q-pa-md'):
-                        ui.label('AIアドバイス').classes('text-h6 text-primary mb-4')
-                        ui.markdown(advice_text).classes('whitespace-pre-wrap q-mb-md')
-                        ui.button('閉じる', on_click=advice_dialog.close).classes('w-full')
-                advice_dialog.open()
-
-            except requests.exceptions.RequestException as e:
-                error_response = response.json() if 'response' in locals() and hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
+                # 非同期クライアントで送信するため、応答待ちの間もイベントループは塞がれない
+                advice_result = await api.post("/generate-advice/", json=advice_data)
+                dialog.close()
+                open_advice_dialog(advice_result, advice_data)
+
+            except AuthenticationRequired:
+                dialog.close()
+            except ApiError as e:
+                dialog.close()
+                error_message = e.detail
                 ui.notify(f'❌ AIアドバイス生成失敗: {error_message}', type='negative')
                 if "API key" in error_message or "API_KEY" in error_message:
                     ui.notify("Gemini APIキーが正しく設定されているか確認してください。", type='negative', timeout=5000)
@@ -1163,20 +1274,16 @@ async def edit_log_entry_page(log_id: int):
                 "notes": notes_input.value,
             }
 
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-
             try:
-                response = requests.put(f"{DJANGO_API_BASE_URL}/logs/{log_id}/", headers=headers, json=updated_log_data)
-                response.raise_for_status()
+                await api.put(f"/logs/{log_id}/", json=updated_log_data)
 
                 ui.notify('飼育ログを更新しました！', type='positive')
                 ui.navigate.to(f'/logs/{log_id}')
-            except requests.exceptions.RequestException as e:
-                error_response = response.json() if hasattr(response, 'json') else {}
-                error_message = error_response.get('detail', str(e))
+            except AuthenticationRequired:
+                pass
+            except ApiError as e:
+                error_response = e.data
+                error_message = e.detail
                 if 'tank_type' in error_response:
                     error_message = f"水槽の種類エラー: {error_response['tank_type'][0]}"
                 ui.notify(f'飼育ログの更新に失敗しました: {error_message}', type='negative')